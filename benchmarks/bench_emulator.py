@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Benchmark of the typical PASTTREC operations with the emulated TrbNet backend.
+
+For each operation the wall time and number of TrbNet transactions is reported.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pasttrec import communication, hardware  # noqa: E402
+from pasttrec.emulator import TrbNetComEmulator  # noqa: E402
+
+
+def bench_decode(connections):
+    communication.design_cache_interface = None  # force new detection
+    communication.decode_address(tuple(hex(trbid) for trbid in sorted(set(con.trbid for con in connections))))
+
+
+def bench_push(connections):
+    d = hardware.AsicRegistersValue().dump_config()
+    for con in connections:
+        con.write_chunk(d)
+
+
+def bench_push_broadcast(connections):
+    bench_push(communication.make_broadcast_connections(connections))
+
+
+def bench_push_multicable(connections):
+    bench_push(communication.make_multicable_connections(connections))
+
+
+def bench_read(connections):
+    for con in connections:
+        for reg in range(12):
+            con.read_reg(reg)
+
+
+def bench_read_parallel(connections):
+    def read(con):
+        return [con.read_reg(reg) for reg in range(12)]
+
+    for con, regs in communication.execute_parallel(read, connections):
+        pass
+
+
+def bench_baseline_step(connections):
+    for con in connections:
+        con.write_chunk([hardware.TrbRegistersOffsets.c_bl_reg[c] | 0x0F for c in range(con.fetype.n_channels)])
+
+    for trbid in set(con.trbid for con in connections):
+        communication.read_rm_scalers(trbid, hardware.TrbBoardType.TRB3.n_scalers)
+
+
+benchmarks = {
+    "decode": bench_decode,
+    "push": bench_push,
+    "push_broadcast": bench_push_broadcast,
+    "push_multicable": bench_push_multicable,
+    "read": bench_read,
+    "read_parallel": bench_read_parallel,
+    "baseline_step": bench_baseline_step,
+}
+
+
+def run(emu, connections, name, func):
+    emu.reset_counters()
+
+    t0 = time.perf_counter()
+    func(connections)
+    dt = time.perf_counter() - t0
+
+    n_ops = sum(emu.n_ops.values())
+    print("{:16s} {:10.3f} ms {:8d} ops  ({:s})".format(name, dt * 1e3, n_ops, str(emu.n_ops)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark PASTTREC operations with emulated TrbNet",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument("-b", "--boards", help="number of TRB3 boards", type=int, default=4)
+    parser.add_argument("-l", "--latency", help="latency of single TrbNet operation [s]", type=float, default=0.0)
+    parser.add_argument("benchmarks", help="benchmarks to run: " + ", ".join(benchmarks), type=str, nargs="*")
+
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f"unknown benchmark {name}")
+
+    boards = {0x6400 + i: hardware.TrbBoardType.TRB3 for i in range(args.boards)}
+    emu = TrbNetComEmulator(boards, latency=args.latency)
+    communication.trbnet_interface = emu
+
+    connections = communication.make_asic_connections(
+        communication.decode_address(tuple(hex(trbid) for trbid in boards))
+    )
+
+    for name in args.benchmarks or benchmarks:
+        run(emu, connections, name, benchmarks[name])
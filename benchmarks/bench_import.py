@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Benchmark of the import time of pasttrec modules.
+
+Each module is imported in a fresh interpreter, the time of the import and the modules loaded
+by it (the TrbNet library and backends should not be loaded before the first communication)
+are reported.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+probe = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+loaded = [m for m in ("trbnet", "pasttrec.interface", "pasttrec.emulator") if m in sys.modules]
+print(dt, ",".join(loaded))
+"""
+
+
+def measure(module):
+    rc = subprocess.run(
+        [sys.executable, "-c", probe.format(module=module)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, PYTHONPATH=root),
+        check=True,
+    )
+    parts = rc.stdout.decode().split()
+    return float(parts[0]), parts[1] if len(parts) > 1 else ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark import time of pasttrec modules",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument("-n", "--repeat", help="number of repetitions", type=int, default=5)
+    parser.add_argument(
+        "modules",
+        help="modules to import",
+        type=str,
+        nargs="*",
+        default=["pasttrec.misc", "pasttrec.output_formats", "pasttrec.communication"],
+    )
+
+    args = parser.parse_args()
+
+    for module in args.modules:
+        results = [measure(module) for i in range(args.repeat)]
+        dt = statistics.median(r[0] for r in results)
+        print("{:28s} {:10.3f} ms  loaded: {:s}".format(module, dt * 1e3, results[-1][1] or "-"))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Asyncio layer over the TrbNet communication.
+
+The register transactions are short and are executed by the synchronous interfaces, the waits
+(1-wire conversion, scalers integration window, SPI settle delay) are awaited, so they overlap
+for many boards driven from a single event loop. Operations on a single board are serialised.
+"""
+
+import asyncio
+import functools
+import weakref
+
+from pasttrec import communication, hardware, misc
+
+
+class AsyncTrbNetCom:
+    """
+    Awaitable wrapper of TrbNetComInterface.
+
+    Paramaters
+    ----------
+    com : TrbNetComInterface
+        The synchronous interface
+    executor : concurrent.futures.Executor
+        If given, the transactions run in the executor and do not block the event loop,
+        otherwise they are called directly
+    """
+
+    def __init__(self, com, executor=None):
+        self.com = com
+        self.executor = executor
+
+    async def run(self, func, *args):
+        """Execute blocking function."""
+
+        if self.executor is None:
+            return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def write(self, trbid, reg, data):
+        return await self.run(self.com.write, trbid, reg, data)
+
+    async def write_mem(self, trbid, reg, data, option=1):
+        return await self.run(self.com.write_mem, trbid, reg, data, option)
+
+    async def read(self, trbid, reg):
+        return await self.run(self.com.read, trbid, reg)
+
+    async def read_mem(self, trbid, reg, length, option=1):
+        return await self.run(self.com.read_mem, trbid, reg, length, option)
+
+    async def read_scalers(self, trbid, n_scalers, window):
+        """Return Scalers counted during the integration window."""
+
+        v1 = await self.read_mem(trbid, hardware.TrbRegisters.SCALERS.value, n_scalers)
+        await asyncio.sleep(window)
+        v2 = await self.read_mem(trbid, hardware.TrbRegisters.SCALERS.value, n_scalers)
+
+        return misc.parse_rm_scalers(n_scalers, v2).diff(misc.parse_rm_scalers(n_scalers, v1))
+
+
+class AsyncSpiTrbTdc:
+    """
+    Awaitable access to SpiTrbTdc of a single board.
+
+    Paramaters
+    ----------
+    acom : AsyncTrbNetCom
+        The async interface
+    spi : SpiTrbTdc
+        The synchronous SPI interface of the board, its register shadow is shared
+    """
+
+    def __init__(self, acom, spi):
+        self.acom = acom
+        self.spi = spi
+        self.locks = weakref.WeakKeyDictionary()  # asyncio.Lock of each event loop
+
+    @property
+    def trbid(self):
+        return self.spi.trbid
+
+    @property
+    def lock(self):
+        """Lock of the board in the running event loop, the wrappers can be used by many loops."""
+
+        loop = asyncio.get_running_loop()
+        lock = self.locks.get(loop)
+        if lock is None:
+            lock = self.locks[loop] = asyncio.Lock()
+        return lock
+
+    async def call(self, func, *args):
+        """Execute the SPI operation with the board locked."""
+
+        async with self.lock:
+            result = await self.acom.run(func, *args)
+            if self.spi.delay_asic_spi > 0.0:
+                await asyncio.sleep(self.spi.delay_asic_spi)
+            return result
+
+    async def write(self, cable, data):
+        return await self.call(self.spi.write, cable, data)
+
+    async def read(self, cable, data):
+        return await self.call(self.spi.read, cable, data)
+
+    async def write_chunk(self, cable, data):
+        return await self.call(self.spi.write_chunk, cable, data)
+
+    async def spi_reset(self, cable):
+        return await self.call(self.spi.spi_reset, cable)
+
+    async def __read_1wire(self, cable, delay, getter):
+        # the board stays in 1-wire mode during the conversion, keep it locked
+        async with self.lock:
+            await self.acom.run(self.spi.activate_1wire, cable)
+            await asyncio.sleep(delay)
+            return await self.acom.run(getter, cable)
+
+    async def read_1wire_temp(self, cable):
+        return await self.__read_1wire(cable, self.spi.delay_1wire_temp, self.spi.get_1wire_temp)
+
+    async def read_1wire_id(self, cable):
+        return await self.__read_1wire(cable, self.spi.delay_1wire_id, self.spi.get_1wire_id)
+
+
+class AsyncPasttrecConnection:
+    """Awaitable version of communication.PasttrecConnection."""
+
+    shared_async_spi = {}
+
+    def __init__(self, acom, trb_frontend, trbid, cable, asic):
+        self.con = communication.PasttrecConnection(trb_frontend, trbid, cable, asic)
+
+        async_spi = self.shared_async_spi.get(trbid)
+        if async_spi is None or async_spi.acom is not acom or async_spi.spi is not self.con.spi:
+            async_spi = self.shared_async_spi[trbid] = AsyncSpiTrbTdc(acom, self.con.spi)
+        self.async_spi = async_spi
+
+    @property
+    def fetype(self):
+        return self.con.fetype
+
+    @property
+    def trbid(self):
+        return self.con.trbid
+
+    @property
+    def cable(self):
+        return self.con.cable
+
+    @property
+    def asic(self):
+        return self.con.asic
+
+    @property
+    def address(self):
+        return self.con.address
+
+    async def write_reg(self, reg, val):
+        return await self.async_spi.call(self.con.write_reg, reg, val)
+
+    async def read_reg(self, reg):
+        return await self.async_spi.call(self.con.read_reg, reg)
+
+    async def read_regs(self, regs):
+        return await self.async_spi.call(self.con.read_regs, regs)
+
+    async def read_all_regs(self):
+        return await self.async_spi.call(self.con.read_all_regs)
+
+    async def write_chunk(self, data):
+        return await self.async_spi.call(self.con.write_chunk, data)
+
+    async def reset_asic(self):
+        return await self.async_spi.call(self.con.reset_asic)
+
+    async def reset_spi(self):
+        return await self.async_spi.spi_reset(self.cable)
+
+    async def read_1wire_temp(self):
+        return await self.async_spi.read_1wire_temp(self.cable)
+
+    async def read_1wire_id(self):
+        return await self.async_spi.read_1wire_id(self.cable)
+
+    def __str__(self):
+        return "Async " + str(self.con)
+
+
+def make_async_asic_connections(address, acom=None):
+    """Make instances of AsyncPasttrecConnection based on the decoded addresses."""
+
+    if acom is None:
+        acom = AsyncTrbNetCom(communication.get_trbnet_interface())
+
+    fee_types = communication.get_trb_design_type(communication.filter_decoded_trbids(address))
+    return tuple(
+        AsyncPasttrecConnection(acom, fee_types[addr], addr, cable, asic)
+        for addr, cable, asic in address
+        if fee_types[addr] is not None
+    )
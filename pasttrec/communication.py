@@ -20,80 +20,213 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
+import json
 import os
+import threading
+import time
 from colorama import Fore, Style
+import numpy as np
 
-from pasttrec import hardware, g_verbose
+from pasttrec import hardware, g_verbose, misc, output_formats
 from pasttrec.misc import trbaddr
-from pasttrec.trb_spi import SpiTrbTdc
+from pasttrec.trb_spi import SpiTrbTdc, then
 
 
-"""Try to import TrbNet library"""
-try:
-    from trbnet import TrbNet
-except ImportError:
-    trbnet_available = False
-    print("ERROR: Trbnet library not found.")
-else:
-    trbnet_available = True
+cmd_to_file = None  # if set to file, redirect output to this file
+trbnet_interface_env = os.getenv("TRBNET_INTERFACE")
+
+"""
+The backend is created on the first use with get_trbnet_interface(), so tools which do not
+communicate with the boards do not load the TrbNet library. It can also be set directly.
+"""
+trbnet_interface = None
+trbnet_interface_lock = threading.Lock()
+
+
+def make_trbnet_lib():
+    """Try to import TrbNet library and connect to the DAQOPSERVER."""
+
+    try:
+        from trbnet import TrbNet
+    except ImportError:
+        print("ERROR: Trbnet library not found.")
+        return None
+
+    from pasttrec.interface import TrbNetComLib
+
     lib = os.getenv("LIBTRBNET")
     host = os.getenv("DAQOPSERVER")
     if g_verbose:
         print("INFO: Trbnet library found in {:s} at host {:s}".format(lib, host))
 
-cmd_to_file = None  # if set to file, redirect output to this file
-trbnet_interface_env = os.getenv("TRBNET_INTERFACE")
+    return TrbNetComLib(TrbNet(libtrbnet=lib, daqopserver=host))
 
-trbnet_interface = None
 
+def make_trbnet_interface():
+    """
+    Env TRBNET_INTERFACE controls which backend to use for communication:
+    trbnet, shell, shell-persistent, emulator or replay. Default one is libtrbnet.
+    """
 
-"""
-Env TRBNET_INTERFACE controls which backend to use for communication.
-Default one is libtrbnet.
-"""
-if trbnet_interface_env is not None:
     if trbnet_interface_env == "trbnet":
-        trbnet = TrbNet(libtrbnet=lib, daqopserver=host)
+        return make_trbnet_lib()
 
-        from pasttrec.interface import TrbNetComLib
+    elif trbnet_interface_env == "shell":
+        from pasttrec.interface import TrbNetComShell
 
-        trbnet_interface = TrbNetComLib(trbnet)
+        return TrbNetComShell()
 
-    elif trbnet_interface_env == "shell":
+    elif trbnet_interface_env == "shell-persistent":
         from pasttrec.interface import TrbNetComShell
 
-        trbnet_interface = TrbNetComShell()
+        # the writes are not waited for, the tools must not exit before they are done
+        com = TrbNetComShell(persistent=True)
+        atexit.register(com.close)
+        return com
 
-    elif trbnet_interface_env == "file":
-        pass
-        # import pasttrec.trb_comm.file as comm
-    else:
-        raise "TRBNET_INTERFACE is incorrect"
-else:
-    if trbnet_available:
-        trbnet = TrbNet(libtrbnet=lib, daqopserver=host)
+    elif trbnet_interface_env == "emulator":
+        from pasttrec.emulator import TrbNetComEmulator, parse_boards_spec
 
-        from pasttrec.interface import TrbNetComLib
+        return TrbNetComEmulator(
+            parse_boards_spec(os.getenv("TRBNET_EMULATOR", "")),
+            latency=float(os.getenv("TRBNET_EMULATOR_LATENCY", "0.0")),
+        )
 
-        trbnet_interface = TrbNetComLib(trbnet)
+    elif trbnet_interface_env == "replay":
+        from pasttrec.trace import TrbNetComReplay
 
-    elif cmd_to_file:
+        return TrbNetComReplay(os.getenv("TRBNET_TRACE", "trace.jsonl"))
+
+    elif trbnet_interface_env is not None:
+        raise ValueError("TRBNET_INTERFACE is incorrect: {:s}".format(trbnet_interface_env))
+
+    com = make_trbnet_lib()
+    if com is None and cmd_to_file:
         from pasttrec.interface import TrbNetComShell
 
-        trbnet_interface = TrbNetComShell()
+        com = TrbNetComShell()
 
-    else:
-        pass
-        # import pasttrec.trb_comm.file as comm
+    return com
+
+
+def get_trbnet_interface():
+    """Return the backend, create it on the first call."""
+
+    global trbnet_interface
+
+    if trbnet_interface is None:
+        with trbnet_interface_lock:
+            if trbnet_interface is None:
+                com = make_trbnet_interface()
+                if com is None:
+                    raise RuntimeError("No TrbNet backend available, see TRBNET_INTERFACE")
+
+                if os.getenv("TRBNET_RECORD"):
+                    from pasttrec.trace import TrbNetComRecorder
+
+                    com = TrbNetComRecorder(com, os.getenv("TRBNET_RECORD"))
+                    atexit.register(com.close)
+
+                if os.getenv("TRBNET_STATS"):
+                    from pasttrec.stats import TrbNetComStats
+
+                    com = TrbNetComStats(com)
+                    atexit.register(com.report, os.getenv("TRBNET_STATS"))
+
+                trbnet_interface = com
+
+    return trbnet_interface
+
+
+broadcast_all = 0xFFFF  # address of all endpoints
+
+"""
+Hardware types (register 0x42) of the endpoints, filled by detect_designs() with a single broadcast
+read for all endpoints. Env PASTTREC_DESIGN_CACHE sets a file where the types are stored for
+PASTTREC_DESIGN_CACHE_TTL seconds (default 600), so the next tools do not need to read them.
+"""
+design_cache = {}
+design_cache_interface = None
+design_cache_file = os.getenv("PASTTREC_DESIGN_CACHE")
+design_cache_ttl = float(os.getenv("PASTTREC_DESIGN_CACHE_TTL", "600"))
+
+
+def load_design_cache():
+    """Load the hardware types from design_cache_file, return False if it is missing or expired."""
+
+    try:
+        with open(design_cache_file) as fp:
+            d = json.load(fp)
+    except (OSError, TypeError, ValueError):
+        return False
+
+    if d.get("host") != os.getenv("DAQOPSERVER") or time.time() - d.get("time", 0) > design_cache_ttl:
+        return False
+
+    design_cache.update({int(k, 16): v for k, v in d["designs"].items()})
+    return True
+
+
+def save_design_cache():
+    if design_cache_file is None:
+        return
+
+    d = {
+        "host": os.getenv("DAQOPSERVER"),
+        "time": time.time(),
+        "designs": {trbaddr(k): v for k, v in design_cache.items()},
+    }
+
+    try:
+        with open(design_cache_file, "w") as fp:
+            json.dump(d, fp)
+    except OSError as e:
+        print("Cannot write design cache:", e)
+
+
+def detect_designs():
+    """Fill design_cache with hardware types of all endpoints."""
+
+    global design_cache_interface
+
+    design_cache.clear()
+    design_cache_interface = get_trbnet_interface()
+
+    if load_design_cache():
+        return
+
+    try:
+        res = design_cache_interface.read_mem(broadcast_all, 0x42, 1)
+    except ValueError:
+        return
+
+    if not isinstance(res, dict):  # backend does not decode the response
+        return
+
+    for trbid, values in res.items():
+        if len(values):
+            design_cache[trbid] = values[0] & 0xFFFF0000
+
+    save_design_cache()
 
 
 def detect_design(address):
-    """Detect the Trb board type"""
+    """Detect the Trb board type, endpoints not found with detect_designs() are read directly"""
 
     if type(address) == str:
         address = int(address, 16)
 
-    rc = trbnet_interface.read(address, 0x42)
+    if design_cache_interface is not get_trbnet_interface():
+        detect_designs()
+
+    rc = design_cache.get(address)
+    if rc is None:
+        rc = get_trbnet_interface().read(address, 0x42)
+        design_cache[address] = rc & 0xFFFF0000
 
     try:
         return hardware.TrbBoardTypeMapping[rc & 0xFFFF0000]
@@ -232,6 +365,7 @@ class CardConnection:
     """These functions write, read memory for given cable and asic."""
 
     shared_trb_spi = {}
+    shared_asic_regs = {}  # (trbid, cable, asic): {reg: value} known from writes and reads
     encoder = hardware.PasttrecDataWordEncoder()
 
     def __init__(self, trb_frontend, trbid, cable):
@@ -243,7 +377,7 @@ class CardConnection:
         self.cable = cable
 
         if trbid not in self.shared_trb_spi:
-            self.shared_trb_spi[trbid] = self.trb_fe_type.spi(trbnet_interface, trbid)
+            self.shared_trb_spi[trbid] = self.trb_fe_type.spi(get_trbnet_interface(), trbid)
         self.trb_spi = self.shared_trb_spi[trbid]
 
     @property
@@ -258,6 +392,16 @@ class CardConnection:
     def address(self):
         return (self.trbid, self.cable)
 
+    @property
+    def targets(self):
+        """Addresses of boards affected by the connection."""
+        return (self.trbid,)
+
+    @property
+    def cables(self):
+        """Cables affected by the connection."""
+        return self.cable if isinstance(self.cable, tuple) else (self.cable,)
+
     def read_1wire_temp(self):
         return self.trb_spi.read_1wire_temp(self.cable)
 
@@ -274,8 +418,66 @@ class CardConnection:
         return self.trb_spi.get_1wire_id(self.cable)
 
     def reset_spi(self):
+        for trbid in self.targets:
+            for cable in self.cables:
+                for asic in range(self.trb_fe_type.n_asics):
+                    self.shared_asic_regs.pop((trbid, cable, asic), None)
+
         self.trb_spi.spi_reset(self.cable)
 
+    def write_chunks(self, data):
+        """
+        Write data of the asics of the cable with a single SPI write_chunk, e.g. full configuration
+        of both asics (24 words) is sent in two bursts.
+
+        Paramaters
+        ----------
+        data : dict
+            Map of asic to list of data (reg << 8 | value)
+        """
+
+        words = []
+        for asic, d in data.items():
+            d = np.asarray(d, dtype=np.uint32)
+            words.append(self.encoder.encode_writes(asic, (d >> 8) & 0xF, d))
+
+        self.__write_words(np.concatenate(words))
+
+    def write_images(self, asics, images, mask=None):
+        """
+        Write register images of the asics with a single SPI write_chunk.
+
+        Paramaters
+        ----------
+        asics : list
+            Asics (n,) of the cable
+        images : array
+            Register images (n, 12), see AsicRegistersValue.images()
+        mask : array
+            If given (n, 12), only the selected registers are written
+        """
+
+        words = self.encoder.encode_images(asics, images)
+        self.__write_words(words if mask is None else words[mask])
+
+    def __write_words(self, words):
+        words = np.asarray(words, dtype=np.uint32).ravel()
+        asics, regs, values = self.encoder.decode(words)
+
+        try:
+            self.trb_spi.write_chunk(self.cable, words.tolist())
+        except Exception:
+            for trbid in self.targets:
+                for cable in self.cables:
+                    for asic in set(asics.tolist()):
+                        self.shared_asic_regs.pop((trbid, cable, asic), None)
+            raise
+
+        for trbid in self.targets:
+            for cable in self.cables:
+                for asic, reg, value in zip(asics.tolist(), regs.tolist(), values.tolist()):
+                    self.shared_asic_regs.setdefault((trbid, cable, asic), {})[reg] = value
+
     def __str__(self):
         return f"Frontend connection to {trbaddr(self.trbid)} for cable={self.cable}"
 
@@ -308,13 +510,71 @@ class PasttrecConnection(CardConnection):
 
         self.asic = asic
 
+    def known_regs(self):
+        """Return register values of the asic known from previous writes and reads."""
+        return self.shared_asic_regs.get((self.trbid, self.cable, self.asic), {})
+
+    def remember(self, regs):
+        for trbid in self.targets:
+            for cable in self.cables:
+                self.shared_asic_regs.setdefault((trbid, cable, self.asic), {}).update(regs)
+
+    def forget(self):
+        for trbid in self.targets:
+            for cable in self.cables:
+                self.shared_asic_regs.pop((trbid, cable, self.asic), None)
+
     def write_reg(self, reg, val):
         word = self.encoder.write(self.asic, reg, val)
-        self.trb_spi.write(self.cable, word)
+        try:
+            self.trb_spi.write(self.cable, word)
+        except Exception:
+            self.forget()
+            raise
+        self.remember({reg: val & 0xFF})
 
     def read_reg(self, reg):
         word = self.encoder.read(self.asic, reg)
-        return self.trb_spi.read(self.cable, word << 1)
+        rc = self.trb_spi.read(self.cable, word << 1)
+
+        if isinstance(rc, Future):  # read in a batch
+
+            def done(f):
+                if not f.cancelled() and f.exception() is None:
+                    self.remember({reg: f.result() & 0xFF})
+
+            rc.add_done_callback(done)
+        else:
+            self.remember({reg: rc & 0xFF})
+
+        return rc
+
+    def read_regs(self, regs):
+        """
+        Read list of registers with a single batch, see SpiTrbTdc.read_chunk() for the cost of the reads.
+        Inside of an outer batch the results are Futures.
+        """
+
+        regs = list(regs)
+        words = self.encoder.encode_reads(self.asic, regs) << 1
+        rcs = self.trb_spi.read_chunk(self.cable, words.tolist())
+
+        if not any(isinstance(rc, Future) for rc in rcs):
+            self.remember(dict(zip(regs, self.encoder.decode(rcs)[2].tolist())))
+            return rcs
+
+        values = {}
+
+        def done(reg, rc):
+            values[reg] = rc & 0xFF
+            if len(values) == len(regs):
+                self.remember(values)
+            return rc
+
+        return [then(rc, functools.partial(done, reg)) for reg, rc in zip(regs, rcs)]
+
+    def read_all_regs(self):
+        return self.read_regs(reg.value for reg in hardware.AsicRegisters)
 
     def write_data(self, data):
         word = self.encoder.write_data(self.asic, data)
@@ -322,9 +582,15 @@ class PasttrecConnection(CardConnection):
 
     def write_chunk(self, data):
         word = self.encoder.write_chunk(self.asic, data)
-        self.trb_spi.write_chunk(self.cable, word)
+        try:
+            self.trb_spi.write_chunk(self.cable, word)
+        except Exception:
+            self.forget()
+            raise
+        self.remember({(x >> 8) & 0xF: x & 0xFF for x in (data if isinstance(data, list) else [data])})
 
     def reset_asic(self):
+        self.forget()
         word = self.encoder.reset(self.asic)
         self.trb_spi.write(self.cable, word << 1)
 
@@ -343,21 +609,613 @@ def make_asic_connections(address):
     )
 
 
+def find_endpoints(trb_frontend):
+    """Return addresses of all endpoints of given board type, found with its broadcast address."""
+
+    try:
+        res = get_trbnet_interface().read_mem(trb_frontend.broadcast, 0x42, 1)
+    except ValueError:
+        return ()
+
+    if not isinstance(res, dict):  # backend does not decode the response
+        return ()
+
+    return tuple(
+        sorted(
+            trbid
+            for trbid, values in res.items()
+            if len(values) and hardware.TrbBoardTypeMapping.get(values[0] & 0xFFFF0000) == trb_frontend
+        )
+    )
+
+
+class BroadcastPasttrecConnection(PasttrecConnection):
+    """
+    Write-only connection to the same cable and asic of all endpoints of the board type,
+    using the broadcast address of the board type.
+    """
+
+    def __init__(self, trb_frontend, cable, asic, members):
+        PasttrecConnection.__init__(self, trb_frontend, trb_frontend.broadcast, cable, asic)
+
+        self.members = members
+        self.__sync(True)
+
+    @property
+    def targets(self):
+        return self.members
+
+    def __member_spis(self):
+        return tuple(self.shared_trb_spi[trbid] for trbid in self.members if trbid in self.shared_trb_spi)
+
+    def __sync(self, force=False):
+        """The control registers of the boards are unknown if they were accessed individually."""
+
+        if force or any(len(spi.shadow) for spi in self.__member_spis()):
+            self.trb_spi.invalidate()
+            self.trb_spi.owire_mode = True
+
+    def __release(self):
+        """The broadcast changed control registers of all boards."""
+
+        for spi in self.__member_spis():
+            spi.invalidate()
+
+    def write_reg(self, reg, val):
+        self.__sync()
+        PasttrecConnection.write_reg(self, reg, val)
+        self.__release()
+
+    def read_reg(self, reg):
+        raise TypeError("Cannot read from broadcast address {:s}".format(trbaddr(self.trbid)))
+
+    def read_regs(self, regs):
+        raise TypeError("Cannot read from broadcast address {:s}".format(trbaddr(self.trbid)))
+
+    def write_data(self, data):
+        self.__sync()
+        PasttrecConnection.write_data(self, data)
+        self.__release()
+
+    def write_chunk(self, data):
+        self.__sync()
+        PasttrecConnection.write_chunk(self, data)
+        self.__release()
+
+    def reset_asic(self):
+        self.__sync()
+        PasttrecConnection.reset_asic(self)
+        self.__release()
+
+    def __str__(self):
+        return f"Pasttrec broadcast connection to {trbaddr(self.trbid)} for cable={self.cable} asic={self.asic}"
+
+
+class MultiCablePasttrecConnection(PasttrecConnection):
+    """
+    Write-only connection to the same asic on several cables of a board, the SPI outputs of all
+    cables are enabled at once, so each word is transmitted only once.
+    """
+
+    def __init__(self, trb_frontend, trbid, cables, asic):
+        PasttrecConnection.__init__(self, trb_frontend, trbid, tuple(cables), asic)
+
+    def read_reg(self, reg):
+        raise TypeError("Cannot read from more cables {:s} at once".format(str(self.cable)))
+
+    def read_regs(self, regs):
+        raise TypeError("Cannot read from more cables {:s} at once".format(str(self.cable)))
+
+    def __str__(self):
+        return f"Pasttrec connection to {trbaddr(self.trbid)} for cables={self.cable} asic={self.asic}"
+
+
+def make_multicable_connections(connections):
+    """
+    Replace connections to the same asic on different cables of a board with a single connection
+    to all the cables. Use it only for writing the same values to all connections, see also
+    make_broadcast_connections().
+    """
+
+    groups = {}
+    for con in connections:
+        groups.setdefault((con.fetype, con.trbid, con.asic), []).append(con)
+
+    result = []
+    for (fetype, trbid, asic), cons in groups.items():
+        cables = tuple(sorted(set(cable for con in cons for cable in con.cables)))
+        if len(cables) > 1:
+            result.append(MultiCablePasttrecConnection(fetype, trbid, cables, asic))
+        else:
+            result.extend(cons)
+
+    return tuple(result)
+
+
+def make_broadcast_connections(connections):
+    """
+    Replace connections to the same cable and asic of all endpoints of a board type with a single
+    broadcast connection. Use it only for writing the same values to all connections.
+    """
+
+    groups = {}
+    for con in connections:
+        groups.setdefault((con.fetype, con.cable, con.asic), []).append(con)
+
+    endpoints = {}
+    result = []
+    for (fetype, cable, asic), cons in groups.items():
+        if fetype not in endpoints:
+            endpoints[fetype] = find_endpoints(fetype)
+
+        trbids = tuple(sorted(set(con.trbid for con in cons)))
+        if len(trbids) > 1 and trbids == endpoints[fetype]:
+            result.append(BroadcastPasttrecConnection(fetype, cable, asic, trbids))
+        else:
+            result.extend(cons)
+
+    return tuple(result)
+
+
+def execute_parallel(func, connections, jobs=0):
+    """
+    Call func(con) for each connection and yield pairs of connection and result, in order of connections.
+
+    Connections of different boards are processed concurrently, connections of the same board
+    one after another in the calling order, so each SPI interface is used only by a single thread.
+    Do not mix broadcast connections with connections to its members.
+
+    Paramaters
+    ----------
+    func : callable
+        The function taking connection as the only argument
+    connections : tuple
+        The connections
+    jobs : int
+        Number of threads, 0 for one thread per board, 1 for sequential execution
+    """
+
+    if jobs == 1:
+        for con in connections:
+            yield con, func(con)
+        return
+
+    groups = {}
+    futures = []
+    for con in connections:
+        future = Future()
+        groups.setdefault(con.trbid, []).append((con, future))
+        futures.append((con, future))
+
+    def worker(group):
+        for con, future in group:
+            try:
+                future.set_result(func(con))
+            except Exception as e:
+                future.set_exception(e)
+
+        com = get_trbnet_interface()
+        try:
+            com.sync()
+        finally:
+            com.release()
+
+    with ThreadPoolExecutor(max_workers=jobs or max(len(groups), 1)) as pool:
+        for group in groups.values():
+            pool.submit(worker, group)
+
+        for con, future in futures:
+            yield con, future.result()
+
+
+def check_asic_connection(con, regs, test_vals, delay=0.0, no_skip=False):
+    """
+    Write test values to the registers of the asic and read them back.
+
+    Paramaters
+    ----------
+    con : PasttrecConnection
+        The tested asic
+    regs : list
+        Registers to test
+    test_vals : list
+        Values written to each register
+    delay : float
+        Wait between write and read
+    no_skip : bool
+        Continue after failed test
+
+    Returns number of passed tests and the failure message, None if the asic is OK.
+    """
+
+    passed = 0
+
+    for reg in regs:
+        for t in test_vals:
+            con.write_reg(reg, t)
+            time.sleep(delay)
+            rc = con.read_reg(reg)
+            try:
+                _t = rc & 0xFF
+            except (TypeError, ValueError):
+                _t = None
+
+            if _t != t or _t is None:
+                if not no_skip:
+                    return passed, (
+                        Fore.RED
+                        + " Test failed for register {:d}".format(reg)
+                        + Style.RESET_ALL
+                        + "  Sent {:d}, received {:s}".format(t, str(_t))
+                    )
+            else:
+                passed += 1
+
+    return passed, None
+
+
+@contextmanager
+def batch():
+    """
+    Queue all TrbNet operations and execute them at once at the end of the block.
+
+    Reads return futures with results available after the block, see interface.TrbNetComBatch.
+    If the execution fails, the shadow registers of all SPI connections are invalidated.
+    """
+
+    try:
+        with get_trbnet_interface().batch() as b:
+            yield b
+    except Exception:
+        for spi in CardConnection.shared_trb_spi.values():
+            spi.invalidate()
+        CardConnection.shared_asic_regs.clear()
+        raise
+
+
+def set_known_regs(regs):
+    """
+    Take register values of the asics as their known state, e.g. from a snapshot saved by another
+    process. The values must match the asics, the snapshot is not valid after a power cycle.
+
+    Paramaters
+    ----------
+    regs : dict
+        Map of asic address (trbid, cable, asic) to AsicRegistersValue
+    """
+
+    for address, value in regs.items():
+        CardConnection.shared_asic_regs[tuple(address)] = dict(enumerate(value.regs))
+
+
+def get_known_regs():
+    """Return map of asic address to AsicRegistersValue for the asics with all registers known."""
+
+    n_regs = len(hardware.AsicRegisters)
+    return {
+        address: hardware.AsicRegistersValue.from_regs(regs[reg] for reg in range(n_regs))
+        for address, regs in CardConnection.shared_asic_regs.items()
+        if all(reg in regs for reg in range(n_regs))
+    }
+
+
+def push_asic_configs(configs, readback=False, jobs=0, baseline=None):
+    """
+    Write configuration to the asics, only registers which differ from the known state of the asic
+    are written, both asics of a cable in a single SPI write, grouped per board. The state is known
+    from previous writes and reads in this process, or from the baseline snapshot file.
+
+    Paramaters
+    ----------
+    configs : dict
+        Map of asic address (trbid, cable, asic) to AsicRegistersValue or list of data words
+        (reg << 8 | value) of all registers
+    readback : bool
+        Read registers of unknown value from the asics first, otherwise they are written. A read
+        costs more TrbNet operations than a write, use it to avoid writing unchanged registers.
+    jobs : int
+        Number of threads, see execute_parallel()
+    baseline : str
+        Snapshot file (see output_formats.dump_snapshot) with the known state of the asics, it is
+        loaded if exists and updated after the writes
+
+    Returns number of written registers.
+    """
+
+    if baseline is not None and os.path.exists(baseline):
+        set_known_regs(output_formats.load_snapshot(baseline))
+
+    n_regs = len(hardware.AsicRegisters)
+
+    def value(cfg):
+        if isinstance(cfg, hardware.AsicRegistersValue):
+            return cfg
+
+        cfg = sorted(cfg, key=lambda x: (x >> 8) & 0xF)
+        if [(x >> 8) & 0xF for x in cfg] != list(range(n_regs)):
+            raise ValueError("Expected data words of all {:d} registers".format(n_regs))
+        return hardware.AsicRegistersValue.from_regs(x & 0xFF for x in cfg)
+
+    index = {address: i for i, address in enumerate(configs)}
+    images = hardware.AsicRegistersValue.images(value(cfg) for cfg in configs.values())
+
+    def push(card):
+        asics = [asic for asic in range(card.fetype.n_asics) if (card.trbid, card.cable, asic) in index]
+        rows = [index[(card.trbid, card.cable, asic)] for asic in asics]
+
+        known = []
+        for asic in asics:
+            con = PasttrecConnection(card.fetype, card.trbid, card.cable, asic)
+            if readback:
+                unknown = [reg for reg in range(n_regs) if reg not in con.known_regs()]
+                if len(unknown):
+                    con.read_regs(unknown)
+
+            regs = con.known_regs()
+            known.append([regs.get(reg, -1) for reg in range(n_regs)])
+
+        changed = images[rows] != np.array(known, dtype=np.int64).reshape(-1, n_regs)
+        if changed.any():
+            card.write_images(asics, images[rows], changed)
+
+        return int(changed.sum())
+
+    try:
+        connections = make_cable_connections(tuple(configs))
+        return sum(n for card, n in execute_parallel(push, connections, jobs))
+    finally:
+        if baseline is not None:
+            # asics of failed writes are forgotten and not stored
+            output_formats.dump_snapshot(baseline, get_known_regs())
+
+
 def asics_to_defaults(address, def_pasttrec):
-    """Set asics to defaults from config."""
-    d = def_pasttrec.dump_config()
-    for addr, cable, asic in address:
-        write_data(addr, cable, asic, d)
+    """
+    Set asics to defaults from config. The same asic of all cables of a board is written at once,
+    and with the broadcast address if all endpoints of the board type are selected, see
+    make_multicable_connections() and make_broadcast_connections(). Only the registers which
+    differ from the known state of any of the written asics are sent.
+
+    Returns number of written registers, a register written to many asics at once is counted once.
+    """
+
+    data = def_pasttrec.dump_config()
+
+    def write(con):
+        known = [
+            con.shared_asic_regs.get((trbid, cable, con.asic), {}) for trbid in con.targets for cable in con.cables
+        ]
+        changed = [x for x in data if any(regs.get((x >> 8) & 0xF) != x & 0xFF for regs in known)]
+        if len(changed):
+            con.write_chunk(changed)
+        return len(changed)
+
+    connections = make_broadcast_connections(make_multicable_connections(make_asic_connections(address)))
+
+    # broadcast and individual connections may share the boards, do not run them concurrently
+    broadcast = any(isinstance(con, BroadcastPasttrecConnection) for con in connections)
+    return sum(n for con, n in execute_parallel(write, connections, 1 if broadcast else 0))
 
 
 def asic_to_defaults(address, cable, asic, def_pasttrec):
     """Set asics to defaults from config."""
-    write_data(address, cable, asic, def_pasttrec.dump_config())
+    push_asic_configs({(address, cable, asic): def_pasttrec})
 
 
 def read_rm_scalers(trbid, n_scalers):
-    return trbnet_interface.read_mem(trbid, hardware.TrbRegisters.SCALERS.value, n_scalers)
+    return get_trbnet_interface().read_mem(trbid, hardware.TrbRegisters.SCALERS.value, n_scalers)
 
 
 def read_r_scalers(trbid, channel):
-    return trbnet_interface.read(trbid, hardware.TrbRegisters.SCALERS.value + channel)
+    return get_trbnet_interface().read(trbid, hardware.TrbRegisters.SCALERS.value + channel)
+
+
+def scaler_channels(connections):
+    """Return scalers indices of the channels of the connections, grouped by trbid."""
+
+    channels = {}
+    for con in connections:
+        first = misc.calc_tdc_channel(con.fetype, con.cable, con.asic, 0)
+        channels.setdefault(con.trbid, []).extend(range(first, first + con.fetype.n_channels))
+
+    return {trbid: np.array(sorted(set(v))) for trbid, v in channels.items()}
+
+
+def count_scan_point(scanner, connections, result, step, index=None, checkpoint=None, target=None, max_time=10.0):
+    """
+    Count scalers of the asics of the connections for a scan step and store them in the result
+    (misc.Baselines or misc.Thresholds), or restore them from the checkpoint if already measured.
+
+    Paramaters
+    ----------
+    scanner : ScalersScanner
+        The scanner, its window is the fixed counting time
+    connections : tuple
+        The asics
+    result : misc.Baselines or misc.Thresholds
+        The scan results
+    step : int
+        The step of the scan, the counts are stored at this position
+    index : int
+        The step in the checkpoint, if different than step
+    checkpoint : misc.ScanCheckpoint
+        The checkpoint, if any
+    target : int
+        Count until target counts (see ScalersScanner.measure_until), the counts are normalised to the window
+    max_time : float
+        Maximal counting time with target
+    """
+
+    index = step if index is None else index
+    points = []
+
+    if checkpoint is not None and all(
+        checkpoint.has(trbaddr(con.trbid), con.cable, con.asic, index) for con in connections
+    ):
+        # the registers were set anyway, only the counting is skipped
+        scanner.invalidate()
+        for con in connections:
+            points.append((con, *checkpoint.get(trbaddr(con.trbid), con.cable, con.asic, index)))
+    else:
+        if target is None:
+            bb, exposure = scanner.measure(), scanner.window
+        else:
+            window = scanner.window
+            bb, exposure = scanner.measure_until(
+                target, max_time, channels=scaler_channels(connections), min_time=window
+            )
+            for v in bb.scalers.values():
+                v[:] = np.rint(v * (window / exposure))
+
+        for con in connections:
+            first = misc.calc_tdc_channel(con.fetype, con.cable, con.asic, 0)
+            counts = bb.scalers[con.trbid][first : first + con.fetype.n_channels]
+            points.append((con, counts, exposure))
+
+            if checkpoint is not None:
+                checkpoint.add(trbaddr(con.trbid), con.cable, con.asic, index, counts.tolist(), exposure)
+
+        if checkpoint is not None:
+            checkpoint.commit()
+
+    for con, counts, exposure in points:
+        result.set_point(trbaddr(con.trbid), con.fetype, con.cable, con.asic, step, counts, exposure)
+
+
+def upper_counts(counts, sigma=3.0):
+    """Return upper confidence bound of the expected Poisson counts, e.g. 9 for 0 counts at 3 sigma."""
+
+    return counts + sigma * np.sqrt(counts) + sigma * sigma
+
+
+class ScalersScanner:
+    """
+    Count scalers of many boards in a common integration window.
+
+    All boards are read in a single batch (or with the broadcast address if all endpoints of the
+    board type are scanned) and the window is waited once for all of them. With reuse enabled,
+    the closing snapshot of a measurement opens the next one, so the register changes done
+    between the measurements fall into the next window, which is shortened to keep its length.
+
+    Paramaters
+    ----------
+    boards : dict
+        The TrbBoardType of each trbid to read
+    window : float
+        The integration time [s]
+    settle : float
+        Delay after register change before the opening snapshot
+    reuse : bool
+        Reuse the closing snapshot as the opening one of the next measurement, the settle delay is
+        skipped then, so disable it if the settle is needed
+    """
+
+    def __init__(self, boards, window, settle=0.0, reuse=True):
+        self.window = window
+        self.settle = settle
+        self.reuse = reuse
+        self.last = None
+
+        self.n_scalers = max((fetype.n_scalers for fetype in boards.values()), default=0)
+        self.sources = []
+
+        for fetype in set(boards.values()):
+            trbids = tuple(sorted(trbid for trbid, ft in boards.items() if ft == fetype))
+            if len(trbids) > 1 and trbids == find_endpoints(fetype):
+                self.sources.append((fetype.broadcast, fetype.n_scalers))
+            else:
+                self.sources.extend((trbid, fetype.n_scalers) for trbid in trbids)
+
+    def snapshot(self):
+        """Read scalers of all boards, return Scalers and the time of the snapshot."""
+
+        with batch():
+            results = [read_rm_scalers(addr, n_scalers) for addr, n_scalers in self.sources]
+
+        t = time.monotonic()
+
+        s = misc.Scalers(self.n_scalers)
+        for res in results:
+            for trbid, values in misc.parse_rm_scalers(self.n_scalers, res.result()).scalers.items():
+                s.scalers[trbid] = values
+
+        return s, t
+
+    def invalidate(self):
+        """Do not reuse the last snapshot, e.g. after a break in the scan."""
+
+        self.last = None
+
+    def __open(self):
+        if self.reuse and self.last is not None:
+            return self.last
+
+        time.sleep(self.settle)
+        return self.snapshot()
+
+    def __close(self, snapshot):
+        self.last = snapshot if self.reuse else None
+
+    def measure(self):
+        """Return Scalers counted in the integration window."""
+
+        start, t_start = self.__open()
+
+        time.sleep(max(0.0, self.window - (time.monotonic() - t_start)))
+
+        end, t_end = self.snapshot()
+        self.__close((end, t_end))
+
+        return end.diff(start)
+
+    def measure_until(self, target, max_time, poll=0.05, channels=None, min_time=0.0, sigma=3.0):
+        """
+        Count until each active channel reaches the target counts, but not longer than max_time.
+        The channel is active if at the upper bound of its rate the target could be reached
+        within max_time, the channels are checked only after min_time. Return Scalers and the
+        exposure time [s].
+
+        Paramaters
+        ----------
+        target : int
+            Requested counts, for relative error e use 1/e^2
+        max_time : float
+            Maximal integration time [s]
+        poll : float
+            Interval of the scalers readout [s]
+        channels : dict
+            Scalers indices of each trbid to check, all channels if None
+        min_time : float
+            Minimal integration time [s], e.g. the fixed window of the scan
+        sigma : float
+            Width of the upper confidence bound of the counts, in standard deviations
+        """
+
+        start, t_start = self.__open()
+
+        while True:
+            time.sleep(max(0.0, min(poll, max_time - (time.monotonic() - t_start))))
+
+            end, t_end = self.snapshot()
+            counts = end.diff(start)
+            exposure = t_end - t_start
+
+            if exposure >= max_time:
+                break
+
+            if exposure < min_time:
+                continue
+
+            checked = (
+                (v if channels is None else v[channels[trbid]])
+                for trbid, v in counts.scalers.items()
+                if channels is None or trbid in channels
+            )
+            # channels which would not reach the target in max_time even at the upper bound of their
+            # rate are not active, the bound keeps channels with few counts active
+            if all(np.all((v >= target) | (upper_counts(v, sigma) * (max_time / exposure) < target)) for v in checked):
+                break
+
+        self.__close((end, t_end))
+
+        return counts, exposure
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+This module provides an in-memory emulator of the TrbNet network with TDC boards and PASTTREC cards.
+
+The emulator implements the same interface as TrbNetComLib and TrbNetComShell and can be selected with
+TRBNET_INTERFACE=emulator. The boards are given with TRBNET_EMULATOR, e.g. "0x6400:TRB3,0x6401:TRB5SC",
+and the per-operation latency (in seconds) with TRBNET_EMULATOR_LATENCY.
+"""
+
+import math
+import random
+import threading
+import time
+
+from pasttrec import g_verbose, hardware
+from pasttrec.interface import TrbNetComInterface, batchable
+from pasttrec.misc import trbaddr
+
+TrbBoardTypeIds = {v: k for k, v in hardware.TrbBoardTypeMapping.items()}
+
+BROADCAST_ALL = 0xFFFF
+
+
+class EmulatedPasttrec:
+    """Register file of a single PASTTREC ASIC."""
+
+    n_regs = 12
+
+    def __init__(self):
+        self.regs = [0] * self.n_regs
+        self.reset()
+
+    def reset(self):
+        self.regs[:] = [x & 0xFF for x in hardware.AsicRegistersValue().dump_config()]
+
+    @property
+    def vth(self):
+        return self.regs[hardware.AsicRegisters.VTH.value]
+
+    def bl(self, channel):
+        return self.regs[hardware.AsicRegisters.BL0.value + channel]
+
+
+class EmulatedTdc:
+    """
+    A TDC board with the SPI block, 1-wire mux and scalers.
+
+    The noise of each channel is modelled with a gaussian distribution of the baseline around
+    the channel offset. The rate of the threshold crossings is then given by the Rice formula:
+    rate = noise_rate * exp(-(vth - baseline)**2 / (2 * noise_sigma**2)), all values in mV.
+    """
+
+    spi_buffer_size = 16
+    bl_step = 2.0  # mV per baseline DAC step
+    bl_offset = -31.0  # mV for baseline DAC = 0
+    vth_step = 2.0  # mV per threshold DAC step
+
+    def __init__(self, trbid, trb_fe_type, seed=None, noise_rate=1e5, noise_sigma=4.0, offset_sigma=6.0):
+        self.trbid = trbid
+        self.fetype = trb_fe_type
+        self.rng = random.Random(trbid if seed is None else seed)
+
+        self.registers = {
+            0x42: TrbBoardTypeIds[trb_fe_type],
+            0x23: 0x0,
+            0xD410: 0x0,
+            0xD412: 0x0,
+            0xD415: 0xFFFF,
+            0xD416: 0xFFFF,
+            0xD417: 0x0000FFFF,
+            0xD419: 20,
+        }
+        self.spi_buffer = [0] * self.spi_buffer_size
+
+        self.asics = [[EmulatedPasttrec() for a in range(trb_fe_type.n_asics)] for c in range(trb_fe_type.n_cables)]
+
+        n = trb_fe_type.n_scalers
+        self.noise_offset = [self.rng.gauss(0.0, offset_sigma) for i in range(n)]
+        self.noise_rate = [noise_rate * self.rng.uniform(0.5, 1.5) for i in range(n)]
+        self.noise_sigma = noise_sigma
+        self.scalers = [0] * n
+        self.scalers_time = time.monotonic()
+
+        self.wire_temp = [20.0 + self.rng.uniform(0.0, 10.0) for c in range(trb_fe_type.n_cables)]
+        self.wire_id = [(self.rng.getrandbits(48) << 8) | 0x28 for c in range(trb_fe_type.n_cables)]
+
+    def channel_rate(self, channel):
+        """Calculate noise rate for given tdc channel from the current ASIC settings."""
+
+        ch = channel % self.fetype.n_channels
+        asic = channel // self.fetype.n_channels % self.fetype.n_asics
+        cable = channel // (self.fetype.n_channels * self.fetype.n_asics)
+        pasttrec = self.asics[cable][asic]
+
+        baseline = self.bl_offset + self.bl_step * pasttrec.bl(ch) + self.noise_offset[channel]
+        x = (self.vth_step * pasttrec.vth - baseline) / self.noise_sigma
+        return self.noise_rate[channel] * math.exp(-0.5 * x * x)
+
+    def poisson(self, mu):
+        if mu <= 0.0:
+            return 0
+        if mu > 30.0:
+            return max(0, int(round(self.rng.gauss(mu, math.sqrt(mu)))))
+
+        limit = math.exp(-mu)
+        k = 0
+        p = self.rng.random()
+        while p > limit:
+            k += 1
+            p *= self.rng.random()
+        return k
+
+    def update_scalers(self):
+        now = time.monotonic()
+        dt = now - self.scalers_time
+        self.scalers_time = now
+
+        for i in range(len(self.scalers)):
+            self.scalers[i] = (self.scalers[i] + self.poisson(self.channel_rate(i) * dt)) % 0x80000000
+
+    def selected_cables(self):
+        """Cables which have CS, SDO and SCK outputs enabled."""
+
+        enabled = self.registers[0xD410] & ~self.registers[0xD415] & ~self.registers[0xD416]
+        return tuple(c for c in range(self.fetype.n_cables) if enabled & (1 << c))
+
+    def spi_transmit(self, length):
+        word_length = self.registers[0xD419]
+        owire = self.registers[0x23]
+
+        if owire:
+            # clocks for the 1-wire devices, nothing to do
+            return
+
+        reset_cables = tuple(c for c in range(self.fetype.n_cables) if self.registers[0xD417] & (0x10000 << c))
+        if reset_cables:
+            if word_length >= 25:
+                for c in reset_cables:
+                    for pasttrec in self.asics[c]:
+                        pasttrec.reset()
+            return
+
+        self.update_scalers()
+
+        for i, data in enumerate(self.spi_buffer[0 : min(length, self.spi_buffer_size)]):
+            for cable in self.selected_cables():
+                rc = self.spi_word(cable, data)
+                if rc is not None:
+                    self.spi_buffer[i] = rc  # received word replaces the transmitted one
+
+    def spi_word(self, cable, data):
+        """Decode and execute single SPI data word."""
+
+        encoder = hardware.PasttrecDataWordEncoder
+
+        if data >> 16 == encoder.c_base_w >> 16 and not data & 0x1000:
+            word = data
+            write = True
+        elif data >> 17 == encoder.c_base_r >> 16 and (data >> 1) & 0x1000:
+            word = data >> 1
+            write = False
+        else:
+            return
+
+        try:
+            asic = encoder.c_asic.index(word & 0x6000)
+        except ValueError:
+            return
+
+        if asic >= self.fetype.n_asics:
+            return
+
+        reg = (word >> 8) & 0xF
+        if reg >= EmulatedPasttrec.n_regs:
+            return
+
+        if write:
+            self.asics[cable][asic].regs[reg] = word & 0xFF
+            return None
+
+        self.registers[0xD412] = self.asics[cable][asic].regs[reg]
+        return self.registers[0xD412]
+
+    def owire_cable(self):
+        mux = self.registers[0x23] >> 1
+        for c in range(self.fetype.n_cables):
+            if mux & (1 << c):
+                return c
+        return None
+
+    def write(self, reg, data):
+        if 0xD400 <= reg < 0xD400 + self.spi_buffer_size:
+            self.spi_buffer[reg - 0xD400] = data
+        elif reg == 0xD411:
+            self.spi_transmit(data & 0xFFFF)
+        else:
+            self.registers[reg] = data
+
+    def read(self, reg, update=True):
+        if 0xD400 <= reg < 0xD400 + self.spi_buffer_size:
+            return self.spi_buffer[reg - 0xD400]
+
+        scalers = hardware.TrbRegisters.SCALERS.value
+        if scalers <= reg < scalers + len(self.scalers):
+            if update:
+                self.update_scalers()
+            return self.scalers[reg - scalers]
+
+        if reg in (0x8, 0xA, 0xB):
+            cable = self.owire_cable()
+            if cable is None:
+                return 0
+            if reg == 0x8:
+                return int(self.wire_temp[cable] / 0.0625) << 16
+            if reg == 0xA:
+                return self.wire_id[cable] & 0xFFFFFFFF
+            return self.wire_id[cable] >> 32
+
+        return self.registers.get(reg, 0)
+
+
+class TrbNetComEmulator(TrbNetComInterface):
+    """
+    Emulated TrbNet network.
+
+    Paramaters
+    ----------
+    latency : float or dict
+        Delay added to each operation, either common value or a map of operation name
+        (write, write_mem, read, read_mem) to the delay.
+    """
+
+    operations = ("write", "write_mem", "read", "read_mem")
+
+    def __init__(self, boards=None, latency=0.0, **noise):
+        self.boards = {}
+        self.noise = noise
+        self.lock = threading.Lock()
+
+        if isinstance(latency, dict):
+            self.latency = {op: latency.get(op, 0.0) for op in self.operations}
+        else:
+            self.latency = {op: latency for op in self.operations}
+
+        self.n_ops = {op: 0 for op in self.operations}
+
+        if boards is not None:
+            for trbid, trb_fe_type in boards.items():
+                self.add_board(trbid, trb_fe_type)
+
+    def add_board(self, trbid, trb_fe_type):
+        self.boards[trbid] = EmulatedTdc(trbid, trb_fe_type, **self.noise)
+        return self.boards[trbid]
+
+    def reset_counters(self):
+        self.n_ops = {op: 0 for op in self.operations}
+
+    def endpoints(self, trbid):
+        """Return all boards which respond to the address."""
+
+        if trbid in self.boards:
+            return (self.boards[trbid],)
+
+        if trbid == BROADCAST_ALL:
+            return tuple(self.boards[x] for x in sorted(self.boards))
+
+        return tuple(self.boards[x] for x in sorted(self.boards) if self.boards[x].fetype.broadcast == trbid)
+
+    def __operation(self, op):
+        self.n_ops[op] += 1
+        if self.latency[op] > 0.0:
+            time.sleep(self.latency[op])
+
+    def print_verbose(self, rc):
+        """Print verbose return info from trbnet communication"""
+
+        if rc is None:
+            return
+
+        if g_verbose >= 1:
+            print("[{:s}]  {:d}".format(hex(rc[0]), rc[1]))
+
+    @batchable
+    def write(self, trbid, reg, data):
+        self.__operation("write")
+        with self.lock:
+            for tdc in self.endpoints(trbid):
+                tdc.write(reg, data)
+        return 0
+
+    @batchable
+    def write_mem(self, trbid, reg, data, option=1):
+        self.__operation("write_mem")
+        with self.lock:
+            for tdc in self.endpoints(trbid):
+                for i, d in enumerate(data):
+                    tdc.write(reg + i if option == 0 else reg, d)
+        return 0
+
+    @batchable
+    def read(self, trbid, reg):
+        self.__operation("read")
+        with self.lock:
+            endpoints = self.endpoints(trbid)
+            if len(endpoints):
+                return endpoints[0].read(reg)
+
+        raise ValueError("Trbid {:s} not available".format(trbaddr(trbid)))
+
+    @batchable
+    def read_mem(self, trbid, reg, length, option=1):
+        """
+        Read memory block.
+        Function return of map where the key is the trb address and value is tuple of memory block
+        """
+        self.__operation("read_mem")
+        with self.lock:
+            res = {}
+            for tdc in self.endpoints(trbid):
+                tdc.update_scalers()
+                res[tdc.trbid] = tuple(tdc.read(reg + i, False) for i in range(length))
+            return res
+
+
+def parse_boards_spec(spec):
+    """
+    Parse emulated boards description in form "ADDR:TYPE,ADDR:TYPE,...", e.g. "0x6400:TRB3,0x6401:TRB5SC".
+    The type can be skipped, TRB3 is used then.
+    """
+
+    boards = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not len(entry):
+            continue
+
+        parts = entry.split(":")
+        trbid = int(parts[0], 16)
+        boards[trbid] = hardware.TrbBoardType[parts[1].upper()] if len(parts) > 1 else hardware.TrbBoardType.TRB3
+
+    return boards
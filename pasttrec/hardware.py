@@ -9,6 +9,7 @@ The functions provide also export/import of the components settings.
 """
 
 from enum import Enum
+import numpy as np
 
 from pasttrec import LIBVERSION
 from pasttrec.trb_spi import SpiTrbTdc
@@ -30,15 +31,24 @@ class AsicRegisters(Enum):
 
 
 class AsicRegistersValue:
-    bg_int = 1
-    gain = 0
-    peaking = 0
-    tc1c = 0
-    tc1r = 0
-    tc2c = 0
-    tc2r = 0
-    vth = 0
-    bl = [0] * 8
+    """
+    Values of the 12 registers of the ASIC, stored as bytes. The settings are accessed as attributes,
+    the baselines as a writeable view of the baseline registers.
+    """
+
+    __slots__ = ("regs",)
+
+    # field: (register, shift, width)
+    fields = {
+        "bg_int": (0, 4, 1),
+        "gain": (0, 2, 2),
+        "peaking": (0, 0, 2),
+        "tc1c": (1, 3, 3),
+        "tc1r": (1, 0, 3),
+        "tc2c": (2, 3, 3),
+        "tc2r": (2, 0, 3),
+        "vth": (3, 0, 8),
+    }
 
     def __init__(
         self,
@@ -52,6 +62,7 @@ class AsicRegistersValue:
         vth=0,
         bl=[0] * 8,
     ):
+        self.regs = bytearray(12)
         self.bg_int = bg_int
         self.gain = gain
         self.peaking = peaking
@@ -60,7 +71,62 @@ class AsicRegistersValue:
         self.tc2c = tc2c
         self.tc2r = tc2r
         self.vth = vth
-        self.bl = [i for i in bl]
+        self.bl = bl
+
+    def __getattr__(self, name):
+        try:
+            reg, shift, width = AsicRegistersValue.fields[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        return (self.regs[reg] >> shift) & ((1 << width) - 1)
+
+    def __setattr__(self, name, value):
+        if name not in AsicRegistersValue.fields:
+            return object.__setattr__(self, name, value)
+
+        reg, shift, width = AsicRegistersValue.fields[name]
+        mask = ((1 << width) - 1) << shift
+        self.regs[reg] = (self.regs[reg] & ~mask) | ((value << shift) & mask)
+
+    @property
+    def bl(self):
+        return memoryview(self.regs)[4:12]
+
+    @bl.setter
+    def bl(self, values):
+        values = list(values)
+        if len(values) != 8:
+            raise ValueError("Expected 8 baseline values, got {:d}".format(len(values)))
+        self.regs[4:12] = bytes(int(v) & 0xFF for v in values)
+
+    def copy(self):
+        return AsicRegistersValue.from_regs(self.regs)
+
+    @staticmethod
+    def from_regs(regs):
+        """Make value from 12 register values (bytes or list of ints)."""
+
+        c = AsicRegistersValue.__new__(AsicRegistersValue)
+        object.__setattr__(c, "regs", bytearray(regs))
+        return c
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __eq__(self, other):
+        return isinstance(other, AsicRegistersValue) and self.regs == other.regs
+
+    def __repr__(self):
+        return "AsicRegistersValue({:s})".format(", ".join("{:s}={}".format(k, v) for k, v in self.export().items()))
+
+    def export(self):
+        """Return the settings in JSON compatible form."""
+
+        d = {k: getattr(self, k) for k in AsicRegistersValue.fields}
+        d["bl"] = list(self.regs[4:12])
+        return d
 
     @staticmethod
     def load_asic_from_dict(d, test_version=None):
@@ -72,19 +138,13 @@ class AsicRegistersValue:
         return p
 
     def dump_config(self):
-        r_all = [0] * 12
-        t = (self.bg_int << 4) | (self.gain << 2) | self.peaking
-        r_all[0] = TrbRegistersOffsets.c_config_reg[0] | t
-        t = (self.tc1c << 3) | self.tc1r
-        r_all[1] = TrbRegistersOffsets.c_config_reg[1] | t
-        t = (self.tc2c << 3) | self.tc2r
-        r_all[2] = TrbRegistersOffsets.c_config_reg[2] | t
-        r_all[3] = TrbRegistersOffsets.c_config_reg[3] | self.vth
+        return [i << 8 | r for i, r in enumerate(self.regs)]
 
-        for i in range(8):
-            r_all[4 + i] = TrbRegistersOffsets.c_bl_reg[i] | self.bl[i]
+    @staticmethod
+    def images(values):
+        """Return (n, 12) array with register images of the values."""
 
-        return r_all
+        return np.frombuffer(b"".join(v.regs for v in values), dtype=np.uint8).reshape(-1, 12)
 
     def dump_config_hex(self):
         return [hex(i) for i in self.dump_config()]
@@ -157,11 +217,48 @@ class PasttrecDataWordEncoder:
             return self.c_base_w | self.c_asic[asic] | data
 
     def write_chunk(self, asic, data):
-        if isinstance(data, list):
+        if isinstance(data, np.ndarray):
+            return (self.c_base_w | self.c_asic[asic] | data.astype(np.uint32)).tolist()
+        elif isinstance(data, list):
             return [self.c_base_w | self.c_asic[asic] | x for x in data]
         else:
             return self.c_base_w | self.c_asic[asic] | data
 
+    def encode_writes(self, asic, reg, val):
+        """
+        Vectorised write(), the arguments are arrays (or scalars) broadcast against each other,
+        e.g. for many asics and registers at once. The values are limited to 8 bits.
+        """
+
+        asic_bits = np.asarray(self.c_asic, dtype=np.uint32)[np.asarray(asic)]
+        reg_bits = np.asarray(reg, dtype=np.uint32) << 8
+        return self.c_base_w | asic_bits | reg_bits | (np.asarray(val, dtype=np.uint32) & 0xFF)
+
+    def encode_reads(self, asic, reg):
+        """Vectorised read()."""
+
+        asic_bits = np.asarray(self.c_asic, dtype=np.uint32)[np.asarray(asic)]
+        return self.c_base_r | asic_bits | (np.asarray(reg, dtype=np.uint32) << 8)
+
+    def encode_images(self, asic, images):
+        """
+        Encode register images (n, 12) of asics (n,), see AsicRegistersValue.images(),
+        into array of (n, 12) words.
+        """
+
+        images = np.asarray(images)
+        return self.encode_writes(np.asarray(asic)[..., None], np.arange(images.shape[-1]), images)
+
+    def decode(self, words):
+        """
+        Split the words into arrays of asic, register and value. For the words read back from
+        the asic only the value is meaningful.
+        """
+
+        words = np.asarray(words, dtype=np.uint32)
+        asic = ((words & self.c_asic[1]) != 0).astype(np.int64)
+        return asic, (words >> 8) & 0xF, words & 0xFF
+
 
 class TrbRegisters(Enum):
     SCALERS = 0xC001
@@ -199,8 +296,8 @@ class PasttrecCard:
     def export(self):
         return {
             "name": self.name,
-            "asic1": self.asic1.__dict__ if self.asic1 is not None else None,
-            "asic2": self.asic2.__dict__ if self.asic2 is not None else None,
+            "asic1": self.asic1.export() if self.asic1 is not None else None,
+            "asic2": self.asic2.export() if self.asic2 is not None else None,
         }
 
     def export_script(self, cable):
@@ -221,8 +318,8 @@ class PasttrecCard:
 
         pc = PasttrecCard(
             d["name"],
-            AsicRegistersValue().load_asic_from_dict(d["asic1"]),
-            AsicRegistersValue().load_asic_from_dict(d["asic2"]),
+            AsicRegistersValue().load_asic_from_dict(d["asic1"]) if d["asic1"] is not None else None,
+            AsicRegistersValue().load_asic_from_dict(d["asic2"]) if d["asic2"] is not None else None,
         )
 
         return True, pc
@@ -233,12 +330,14 @@ class TdcConnection:
     cable1 = None
     cable2 = None
     cable3 = None
+    cable4 = None  # TRB5SC only, exported only if set
 
-    def __init__(self, id, cable1=None, cable2=None, cable3=None):
+    def __init__(self, id, cable1=None, cable2=None, cable3=None, cable4=None):
         self.id = hex(id) if isinstance(id, int) else id
         self.cable1 = cable1
         self.cable2 = cable2
         self.cable3 = cable3
+        self.cable4 = cable4
 
     def set_card(self, pos, card):
         if pos == 0:
@@ -247,18 +346,40 @@ class TdcConnection:
             self.cable2 = card
         elif pos == 2:
             self.cable3 = card
+        elif pos == 3:
+            self.cable4 = card
+
+    def get_card(self, pos):
+        return (self.cable1, self.cable2, self.cable3, self.cable4)[pos]
+
+    def asics(self):
+        """Return list of (cable, asic, AsicRegistersValue) of all asics."""
+
+        res = []
+        for cable in range(4):
+            card = self.get_card(cable)
+            if isinstance(card, PasttrecCard):
+                for asic, p in enumerate((card.asic1, card.asic2)):
+                    if p is not None:
+                        res.append((cable, asic, p))
+        return res
 
     def export(self):
         c1 = self.cable1.export() if isinstance(self.cable1, PasttrecCard) else None
         c2 = self.cable2.export() if isinstance(self.cable2, PasttrecCard) else None
         c3 = self.cable3.export() if isinstance(self.cable3, PasttrecCard) else None
 
-        return self.id, {"cable1": c1, "cable2": c2, "cable3": c3}
+        d = {"cable1": c1, "cable2": c2, "cable3": c3}
+        if isinstance(self.cable4, PasttrecCard):
+            d["cable4"] = self.cable4.export()
+
+        return self.id, d
 
     def export_script(self):
         c1 = self.cable1.export_script(0) if isinstance(self.cable1, PasttrecCard) else None
         c2 = self.cable2.export_script(1) if isinstance(self.cable2, PasttrecCard) else None
         c3 = self.cable3.export_script(2) if isinstance(self.cable3, PasttrecCard) else None
+        c4 = self.cable4.export_script(3) if isinstance(self.cable4, PasttrecCard) else None
 
         c = []
         if c1:
@@ -267,6 +388,8 @@ class TdcConnection:
             c.extend(c2)
         if c3:
             c.extend(c3)
+        if c4:
+            c.extend(c4)
         return self.id, c
 
 
@@ -300,11 +423,13 @@ def load(d, test_version=True):
         r1, _c1 = PasttrecCard.load_card_from_dict(v["cable1"])
         r2, _c2 = PasttrecCard.load_card_from_dict(v["cable2"])
         r3, _c3 = PasttrecCard.load_card_from_dict(v["cable3"])
+        r4, _c4 = PasttrecCard.load_card_from_dict(v.get("cable4"))
 
         c1 = _c1 if r1 else None
         c2 = _c2 if r2 else None
         c3 = _c3 if r3 else None
+        c4 = _c4 if r4 else None
 
-        connections.append(TdcConnection(id, cable1=c1, cable2=c2, cable3=c3))
+        connections.append(TdcConnection(id, cable1=c1, cable2=c2, cable3=c3, cable4=c4))
 
     return True, connections
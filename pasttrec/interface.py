@@ -25,6 +25,13 @@ This moduel provides implementation for various interfaces, like libtrbnet and s
 """
 
 import abc
+import collections
+from concurrent.futures import Future
+import functools
+import inspect
+import os
+import shlex
+import threading
 
 from pasttrec import g_verbose
 from pasttrec.misc import trbaddr
@@ -75,12 +82,176 @@ class TrbNetComInterface(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    def batch(self):
+        """Open batch of operations, see TrbNetComBatch."""
+        return TrbNetComBatch(self)
+
+    def execute_batch(self, ops):
+        """Execute list of (name, args, future) operations, by default one after another."""
+        for name, args, future in ops:
+            rc = getattr(self, name)(*args)
+            if future is not None:
+                future.set_result(rc)
+
+    def on_batch_failure(self, callback):
+        """Call callback if the batch open in the current thread fails, see TrbNetComBatch.on_failure()."""
+        batch = TrbNetComBatch.current(self)
+        if batch is not None:
+            batch.on_failure(callback)
+
+    def sync(self):
+        """Wait until all operations issued from the current thread are completed."""
+        pass
+
+    def release(self):
+        """Free resources kept for the current thread, called by worker threads before they exit."""
+        pass
+
+
+class TrbNetComBatch:
+    """
+    Queue of TrbNet operations executed at once when the batch is closed.
+
+    Use as a context manager: with trbnet_interface.batch(): ...
+    Inside the block, all operations on the interface are queued. Writes return immediately,
+    reads return Future objects which get the results when the batch is flushed. Contiguous
+    register writes to the same board are merged into a single write_mem. Nested batches join
+    the outer one. The batches are kept separately for each thread. If the batch is cancelled or
+    its execution fails, the callbacks registered with on_failure() are called, e.g. to forget
+    state which assumed the queued writes were done.
+    """
+
+    local = threading.local()
+
+    def __init__(self, com):
+        self.com = com
+        self.ops = []
+        self.outer = None
+        self.failure_callbacks = []
+
+    @classmethod
+    def current(cls, com):
+        """Return batch open for the interface in the current thread."""
+        return getattr(cls.local, "batches", {}).get(id(com))
+
+    def __enter__(self):
+        batches = self.local.__dict__.setdefault("batches", {})
+        self.outer = batches.get(id(self.com))
+        if self.outer is not None:
+            return self.outer
+
+        batches[id(self.com)] = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is not None:
+            return False
+
+        del self.local.batches[id(self.com)]
+
+        if exc_type is None:
+            self.flush()
+        else:
+            self.cancel()
+
+        return False
+
+    def queue(self, name, args):
+        future = Future() if name in ("read", "read_mem") else None
+        self.ops.append((name, args, future))
+        return 0 if future is None else future
+
+    def on_failure(self, callback):
+        """Register callback called if the batch fails, each callback is registered once."""
+        if callback not in self.failure_callbacks:
+            self.failure_callbacks.append(callback)
+
+    def fail(self):
+        callbacks = self.failure_callbacks
+        self.failure_callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def cancel(self):
+        for _, _, future in self.ops:
+            if future is not None:
+                future.cancel()
+        self.ops = []
+        self.fail()
+
+    def merge(self):
+        """Return the queued operations with contiguous writes merged into write_mem."""
+
+        ops = []
+        i = 0
+        while i < len(self.ops):
+            name, args, future = self.ops[i]
+            i += 1
+
+            if name != "write":
+                ops.append((name, args, future))
+                continue
+
+            trbid, reg, data = args
+            block = [data]
+            while i < len(self.ops) and self.ops[i][0] == "write":
+                _trbid, _reg, _data = self.ops[i][1]
+                if _trbid != trbid or _reg != reg + len(block):
+                    break
+                block.append(_data)
+                i += 1
+
+            if len(block) == 1:
+                ops.append((name, args, future))
+            else:
+                ops.append(("write_mem", (trbid, reg, block, 0), None))
+
+        return ops
+
+    def flush(self):
+        """Execute queued operations."""
+
+        ops = self.merge()
+        self.ops = []
+
+        try:
+            self.com.execute_batch(ops)
+        except Exception as e:
+            for _, _, future in ops:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            self.fail()
+            raise
+
+        self.failure_callbacks = []
+
+
+def batchable(func):
+    """Queue the operation if a batch is open for the interface in the current thread."""
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        batch = TrbNetComBatch.current(self)
+        if batch is None:
+            return func(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        return batch.queue(func.__name__, bound.args[1:])
+
+    return wrapper
+
+
+class TrbNetComLib(TrbNetComInterface):
+    """Use libtrbnet for communication, the operations of a batch are executed one after another."""
 
-class TrbNetComLib:
     trbnet = None
 
     def __init__(self, trbnet):
         self.trbnet = trbnet
+        self.lock = threading.Lock()  # libtrbnet is not thread-safe
 
     def print_verbose(self, rc):
         """Print verbose return info from trbnet communication"""
@@ -91,30 +262,38 @@ class TrbNetComLib:
         if g_verbose >= 1:
             print("[{:s}]  {:d}".format(hex(rc[0]), rc[1]))
 
+    @batchable
     def write(self, trbid, reg, data):
-        rc = self.trbnet.trb_register_write(trbid, reg, data)
+        with self.lock:
+            rc = self.trbnet.trb_register_write(trbid, reg, data)
         self.print_verbose(rc)
         return 0
 
+    @batchable
     def write_mem(self, trbid, reg, data, option=1):
-        rc = self.trbnet.trb_register_write_mem(trbid, reg, option, data)
+        with self.lock:
+            rc = self.trbnet.trb_register_write_mem(trbid, reg, option, data)
         self.print_verbose(rc)
         return 0
 
+    @batchable
     def read(self, trbid, reg):
-        rc = self.trbnet.trb_register_read(trbid, reg)
+        with self.lock:
+            rc = self.trbnet.trb_register_read(trbid, reg)
         self.print_verbose(rc)
         if len(rc):
             return rc[1]
         else:
             raise ValueError("Trbid {:s} not available".format(trbaddr(trbid)))
 
+    @batchable
     def read_mem(self, trbid, reg, length, option=1):
         """
         Read memory block.
         Function return of map where the key is the trb address and value is tuple of memory block
         """
-        rc = self.trbnet.trb_register_read_mem(trbid, reg, option, length)
+        with self.lock:
+            rc = self.trbnet.trb_register_read_mem(trbid, reg, option, length)
         self.print_verbose(rc)
         i = 0
         res = {}
@@ -126,38 +305,197 @@ class TrbNetComLib:
         return res
 
 
-class TrbNetComShell:
+class TrbCmdCoprocess:
+    """
+    Long-living shell which runs trbcmd commands streamed over a pipe.
+
+    It is a shell co-process, not a trbcmd session: trbcmd is still started for each command, but
+    without a new Python subprocess and without waiting for the previous command. Each command is
+    followed by a marker with the return code, so the output can be parsed incrementally. Results
+    of the commands submitted with keep flag are returned by collect(), failure of the other ones
+    raises CalledProcessError when the co-process is waited for the next time.
+
+    Paramaters
+    ----------
+    host : str
+        DAQOPSERVER for the trbcmd commands
+    callback : callable
+        Called with CompletedProcess of each finished command, e.g. to print it
+    """
+
+    marker = "__trbcmd_done__"
+    max_pending = 256
+
+    def __init__(self, host=None, callback=None):
+        env = dict(os.environ)
+        if host is not None:
+            env["DAQOPSERVER"] = host
+
+        self.proc = subprocess.Popen(
+            ["/bin/sh"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            universal_newlines=True,
+            bufsize=1,
+        )
+        self.callback = callback
+        self.pending = collections.deque()
+        self.results = []
+        self.failed = []
+
+    def submit(self, cmd, data=None, keep=False):
+        """Send the command to the shell, data lines are passed to the command stdin."""
+
+        line = " ".join(shlex.quote(x) for x in cmd)
+
+        if data is None:
+            script = "{:s}; echo {:s} $?\n".format(line, self.marker)
+        else:
+            script = "{:s} << '__EOF__'; echo {:s} $?\n{:s}\n__EOF__\n".format(line, self.marker, "\n".join(data))
+
+        self.proc.stdin.write(script)
+        self.proc.stdin.flush()
+        self.pending.append((cmd, keep))
+
+        # do not let the markers fill the output pipe
+        if len(self.pending) >= self.max_pending:
+            self.drain()
+
+    def drain(self):
+        """Wait for all submitted commands, raise CalledProcessError if any not kept one failed."""
+
+        out = []
+
+        while len(self.pending):
+            line = self.proc.stdout.readline()
+            if not len(line):
+                self.pending.clear()
+                raise BrokenPipeError("trbcmd co-process terminated")
+
+            if line.startswith(self.marker):
+                cmd, keep = self.pending.popleft()
+                rc = subprocess.CompletedProcess(cmd, int(line.split()[1]), "".join(out))
+                if self.callback is not None:
+                    self.callback(rc)
+                if keep:
+                    self.results.append(rc)
+                elif rc.returncode != 0:
+                    self.failed.append(rc)
+                out = []
+            else:
+                out.append(line)
+
+        if len(self.failed):
+            rc = self.failed[0]
+            self.failed = []
+            raise subprocess.CalledProcessError(rc.returncode, rc.args, rc.stdout)
+
+    def collect(self):
+        """Wait for all submitted commands, return list of CompletedProcess of the kept ones."""
+
+        try:
+            self.drain()
+        finally:
+            results = self.results
+            self.results = []
+        return results
+
+    def execute(self, cmd, data=None):
+        """Execute the command and return its CompletedProcess."""
+
+        self.submit(cmd, data, True)
+        return self.collect()[-1]
+
+    def close(self):
+        try:
+            self.drain()
+        finally:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class TrbNetComShell(TrbNetComInterface):
+    """
+    Use trbcmd for communication.
+
+    Paramaters
+    ----------
+    persistent : bool
+        Keep single shell co-process per DAQ server (and thread) and stream the trbcmd commands
+        through it instead of running each of them with subprocess. Writes are not waited for,
+        their failure is raised by the next operation which waits for the co-process.
+    """
+
+    def __init__(self, persistent=False):
+        self.persistent = persistent
+        self.coprocesses = {}
+        self.lock = threading.Lock()
+
+    def coprocess(self):
+        """Return the co-process for the current DAQ server and thread."""
+
+        key = (os.getenv("DAQOPSERVER"), threading.get_ident())
+        with self.lock:
+            if key not in self.coprocesses:
+                self.coprocesses[key] = TrbCmdCoprocess(key[0], self.print_verbose)
+            return self.coprocesses[key]
+
+    def sync(self):
+        if self.persistent:
+            self.coprocess().drain()
+
+    def release(self):
+        """Close the co-process of the current thread."""
+
+        with self.lock:
+            cps = [self.coprocesses.pop(key) for key in list(self.coprocesses) if key[1] == threading.get_ident()]
+        for cp in cps:
+            cp.close()
+
+    def close(self):
+        """Wait for the queued commands and close all co-processes, raise the first failure."""
+
+        with self.lock:
+            cps = list(self.coprocesses.values())
+            self.coprocesses.clear()
+
+        error = None
+        for cp in cps:
+            try:
+                cp.close()
+            except Exception as e:
+                error = error or e
+
+        if error is not None:
+            raise error
+
     def print_verbose(self, rc):
-        """Print verbose return info from trbnet communication"""
+        """Print verbose return info from trbcmd, rc is CompletedProcess"""
 
         if rc is None:
             return
 
         if g_verbose >= 1:
-            print("[{:s}]  {:d}".format(hex(rc[0]), rc[1]))
+            print("[{:s}]  {:d}".format(" ".join(rc.args), rc.returncode))
 
+    @batchable
     def write(self, trbid, reg, data):
         cmd = ["trbcmd", "w", hex(trbid), hex(reg), hex(data)]
-        """
-        if cmd_to_file is not None:
-            cmd_to_file.write(' '.join(cmd) + '\n')
-            return True
-        """
+        if self.persistent:
+            self.coprocess().submit(cmd)
+            return 0
         rc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         self.print_verbose(rc)
         return rc.stdout.decode()
 
+    @batchable
     def write_mem(self, trbid, reg, data, option=1):
-        """
-        if cmd_to_file is not None:
-            cmd = ['trbcmd', 'wm', hex(trbid), hex(reg), str(mode), '- << EOF']
-            cmd_to_file.write(' '.join(cmd) + '\n')
-            for d in data:
-                cmd_to_file.write(hex(d) + '\n')
-            cmd_to_file.write('EOF\n')
-            return True
-        """
         cmd = ["trbcmd", "wm", hex(trbid), hex(reg), str(option), "-"]
+        if self.persistent:
+            self.coprocess().submit(cmd, [hex(x) for x in data])
+            return 0
+
         _data = "\n".join([hex(x) for x in data])
         rc = subprocess.run(
             cmd,
@@ -168,28 +506,56 @@ class TrbNetComShell:
         self.print_verbose(rc)
         return rc.stdout.decode()
 
+    @batchable
     def read(self, trbid, reg):
         cmd = ["trbcmd", "r", hex(trbid), hex(reg)]
-        """
-        if cmd_to_file is not None:
-            cmd_to_file.write(' '.join(cmd) + '\n')
-            return True
-        """
 
-        rc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.print_verbose(rc)
+        if self.persistent:
+            stdout = self.coprocess().execute(cmd).stdout
+        else:
+            rc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.print_verbose(rc)
+            stdout = rc.stdout.decode()
+
+        return self.parse_read(stdout)
+
+    @staticmethod
+    def parse_read(stdout):
         try:
-            return int(rc.stdout.decode().split()[1], 16)
+            return int(stdout.split()[1], 16)
         except IndexError:
             return 0xDEADBEEF  # TODO Add exceptions
 
+    @batchable
     def read_mem(self, trbid, reg, length, option=1):
         cmd = ["trbcmd", "rm", hex(trbid), hex(reg), str(length), "0"]
-        """
-        if cmd_to_file is not None:
-            cmd_to_file.write(' '.join(cmd) + '\n')
-            return True
-        """
+        if self.persistent:
+            return self.coprocess().execute(cmd).stdout
+
         rc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         self.print_verbose(rc)
         return rc.stdout.decode()
+
+    def execute_batch(self, ops):
+        """In the persistent mode submit all commands first and then collect the responses."""
+
+        if not self.persistent:
+            return TrbNetComInterface.execute_batch(self, ops)
+
+        cp = self.coprocess()
+        reads = []
+
+        for name, args, future in ops:
+            if name == "read":
+                trbid, reg = args
+                cp.submit(["trbcmd", "r", hex(trbid), hex(reg)], keep=True)
+                reads.append((future, self.parse_read))
+            elif name == "read_mem":
+                trbid, reg, length, option = args
+                cp.submit(["trbcmd", "rm", hex(trbid), hex(reg), str(length), "0"], keep=True)
+                reads.append((future, str))
+            else:
+                getattr(self, name)(*args)
+
+        for (future, parse), rc in zip(reads, cp.collect()):
+            future.set_result(parse(rc.stdout))
@@ -21,8 +21,11 @@
 # SOFTWARE.
 
 from colorama import Fore, Style
+import json
+import numpy as np
+import os
 
-from pasttrec import hardware
+from pasttrec import hardware, output_formats
 
 # Custom settings
 
@@ -34,10 +37,12 @@ class Baselines:
     """Holds baseline info for given card"""
 
     baselines = None
+    exposures = None
     config = None
 
     def __init__(self):
         self.baselines = {}
+        self.exposures = {}
 
     def add_trb(self, trbid, trb_design_type):
         if trbid not in self.baselines:
@@ -45,15 +50,41 @@ class Baselines:
             h = trb_design_type.n_channels
             a = trb_design_type.n_asics
             c = trb_design_type.n_cables
-            self.baselines[trbid] = [[[[0 for x in range(w)] for y in range(h)] for _a in range(a)] for _c in range(c)]
+            self.baselines[trbid] = np.zeros((c, a, h, w), dtype=np.int64)
+            self.exposures[trbid] = np.zeros((c, a, h, w))
+
+    def set_point(self, trbid, trb_design_type, cable, asic, step, counts, exposure):
+        """Store counts of the channels of the asic for the baseline step."""
+
+        self.add_trb(trbid, trb_design_type)
+        self.baselines[trbid][cable, asic, :, step] = counts
+        self.exposures[trbid][cable, asic, :, step] = exposure
+
+    def export(self):
+        """Return the data in JSON compatible form."""
+
+        return {
+            "baselines": {k: v.tolist() for k, v in self.baselines.items()},
+            "exposures": {k: v.tolist() for k, v in self.exposures.items()},
+            "config": self.config,
+        }
+
+    def save(self, filename):
+        """Write the data to file, see output_formats.dump_scan."""
+
+        output_formats.dump_scan(
+            filename, {"baselines": self.baselines, "exposures": self.exposures, "config": self.config}
+        )
 
 
 class Thresholds:
     thresholds = None
+    exposures = None
     config = None
 
     def __init__(self):
         self.thresholds = {}
+        self.exposures = {}
 
     def add_trb(self, trbid, trb_design_type):
         if trbid not in self.thresholds:
@@ -61,7 +92,31 @@ class Thresholds:
             h = trb_design_type.n_channels
             a = trb_design_type.n_asics
             c = trb_design_type.n_cables
-            self.thresholds[trbid] = [[[[0 for x in range(w)] for y in range(h)] for _a in range(a)] for _c in range(c)]
+            self.thresholds[trbid] = np.zeros((c, a, h, w), dtype=np.int64)
+            self.exposures[trbid] = np.zeros((c, a, h, w))
+
+    def set_point(self, trbid, trb_design_type, cable, asic, step, counts, exposure):
+        """Store counts of the channels of the asic for the threshold step."""
+
+        self.add_trb(trbid, trb_design_type)
+        self.thresholds[trbid][cable, asic, :, step] = counts
+        self.exposures[trbid][cable, asic, :, step] = exposure
+
+    def export(self):
+        """Return the data in JSON compatible form."""
+
+        return {
+            "thresholds": {k: v.tolist() for k, v in self.thresholds.items()},
+            "exposures": {k: v.tolist() for k, v in self.exposures.items()},
+            "config": self.config,
+        }
+
+    def save(self, filename):
+        """Write the data to file, see output_formats.dump_scan."""
+
+        output_formats.dump_scan(
+            filename, {"thresholds": self.thresholds, "exposures": self.exposures, "config": self.config}
+        )
 
 
 class Scalers:
@@ -74,20 +129,109 @@ class Scalers:
 
     def add_trb(self, trb):
         if trb not in self.scalers:
-            self.scalers[trb] = [0] * self.n_scalers
+            self.scalers[trb] = np.zeros(self.n_scalers, dtype=np.int64)
 
     def diff(self, scalers):
+        """Difference of 31-bit counters, the wrap-around is corrected."""
+
         s = Scalers(self.n_scalers)
         for k, v in self.scalers.items():
             if k in scalers.scalers:
-                s.add_trb(k)
-                for i in list(range(self.n_scalers)):
-                    vv = self.scalers[k][i] - scalers.scalers[k][i]
-                    if vv < 0:
-                        vv += 0x80000000
-                    s.scalers[k][i] = vv
+                s.scalers[k] = (v - scalers.scalers[k]) % 0x80000000
         return s
 
+    def export(self):
+        """Return the data in JSON compatible form."""
+
+        return {k: v.tolist() for k, v in self.scalers.items()}
+
+
+class ScanCheckpoint:
+    """
+    Append-only JSON lines file with completed points of a scan, used to resume broken scans.
+    The first line holds the scan settings, each next line one measured point.
+
+    Paramaters
+    ----------
+    filename : str
+        The checkpoint file
+    header : dict
+        The scan settings, resumed scan must have the same settings
+    resume : bool
+        Load points from existing file and append new ones, otherwise start new file
+    force : bool
+        Overwrite existing file when not resuming, otherwise ValueError is raised
+    """
+
+    def __init__(self, filename, header, resume=False, force=False):
+        self.filename = filename
+        self.header = json.loads(json.dumps(header))
+        self.points = {}
+
+        if resume and os.path.exists(filename):
+            self.__load()
+            self.fp = open(filename, "a")
+        else:
+            if os.path.exists(filename) and not force:
+                raise ValueError(
+                    "Checkpoint {:s} exists, resume the scan (--resume) or start a new one (--force)".format(filename)
+                )
+
+            self.fp = open(filename, "w")
+            self.__write(self.header)
+            self.commit()
+
+    def __load(self):
+        with open(self.filename) as fp:
+            text = fp.read()
+
+        lines = text.splitlines()
+        if not len(lines) or json.loads(lines[0]) != self.header:
+            raise ValueError("Checkpoint {:s} was made with different scan settings".format(self.filename))
+
+        for line in lines[1:]:
+            try:
+                rec = json.loads(line)
+            except ValueError:  # last line can be broken when the scan was killed
+                continue
+            self.points[(rec["trbid"], rec["cable"], rec["asic"], rec["step"])] = rec
+
+        if not text.endswith("\n"):
+            with open(self.filename, "a") as fp:
+                fp.write("\n")
+
+    def __write(self, rec):
+        self.fp.write(json.dumps(rec) + "\n")
+
+    def has(self, trbid, cable, asic, step):
+        return (trbid, cable, asic, step) in self.points
+
+    def get(self, trbid, cable, asic, step):
+        """Return counts and exposure of the point."""
+
+        rec = self.points[(trbid, cable, asic, step)]
+        return rec["counts"], rec["exposure"]
+
+    def add(self, trbid, cable, asic, step, counts, exposure):
+        rec = {"trbid": trbid, "cable": cable, "asic": asic, "step": step, "counts": counts, "exposure": exposure}
+        self.points[(trbid, cable, asic, step)] = rec
+        self.__write(rec)
+
+    def commit(self):
+        """Make sure the added points are stored on disk."""
+
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+    def close(self):
+        self.fp.close()
+
+    def remove(self):
+        """Close and delete the file, e.g. when the scan is completed."""
+
+        self.close()
+        os.remove(self.filename)
+
 
 def parse_rm_scalers(n_scalers, res):
     s = Scalers(n_scalers)
@@ -97,12 +241,7 @@ def parse_rm_scalers(n_scalers, res):
             continue
 
         s.add_trb(addr)
-
-        for channel in range(len(values)):
-            val = values[channel]
-            if val >= 0x80000000:
-                val -= 0x80000000
-            s.scalers[addr][channel] = val
+        s.scalers[addr][: len(values)] = np.array(values, dtype=np.int64) & 0x7FFFFFFF
 
     return s
 
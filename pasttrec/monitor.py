@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Monitoring of the scalers rates.
+
+ScalersMonitor polls the scalers of the boards with a fixed cadence and stores the rates of all
+channels in a RateHistory ring buffer. The recent history, mean and peak rates can be exported
+to a JSON file or served on a local (unix) socket.
+"""
+
+import json
+import os
+import socketserver
+import stat
+import threading
+import time
+
+import numpy as np
+
+from pasttrec import communication, misc
+from pasttrec.misc import trbaddr
+
+
+class RateHistory:
+    """
+    Ring buffer of rates of the channels of the boards.
+
+    Paramaters
+    ----------
+    trbids : iterable
+        The boards known at start, boards added later get zero rates in the older samples
+    n_channels : int
+        Number of channels (scalers) of each board
+    size : int
+        Number of stored samples, older ones are overwritten
+    """
+
+    def __init__(self, trbids, n_channels, size):
+        self.trbids = tuple(sorted(trbids))
+        self.index = {trbid: i for i, trbid in enumerate(self.trbids)}
+        self.size = size
+        self.n = 0  # number of samples added
+        self.times = np.zeros(size)
+        self.rates = np.zeros((size, len(self.trbids), n_channels), dtype=np.float32)
+
+    def add_boards(self, trbids):
+        """Extend the history with new boards."""
+
+        new = set(trbids) - set(self.trbids)
+        if not len(new):
+            return
+
+        trbids = tuple(sorted(set(self.trbids) | new))
+        rates = np.zeros((self.size, len(trbids), self.rates.shape[2]), dtype=np.float32)
+        rates[:, [trbids.index(trbid) for trbid in self.trbids]] = self.rates
+
+        self.trbids = trbids
+        self.index = {trbid: i for i, trbid in enumerate(self.trbids)}
+        self.rates = rates
+
+    def add(self, t, rates):
+        """Add sample of rates at time t, rates is map of trbid to array of the channel rates."""
+
+        self.add_boards(rates)
+
+        i = self.n % self.size
+        self.times[i] = t
+        self.rates[i] = 0.0
+        for trbid, r in rates.items():
+            self.rates[i, self.index[trbid], : len(r)] = r
+        self.n += 1
+
+    def __len__(self):
+        return min(self.n, self.size)
+
+    def recent(self, n=None):
+        """Return times (n,) and rates (n, boards, channels) of the last n samples, the oldest first."""
+
+        n = len(self) if n is None else min(n, len(self))
+        idx = np.arange(self.n - n, self.n) % self.size
+        return self.times[idx], self.rates[idx]
+
+    def mean(self, n=None):
+        """Return mean rates (boards, channels) of the last n samples."""
+
+        _, rates = self.recent(n)
+        return rates.mean(axis=0) if len(rates) else np.zeros(self.rates.shape[1:])
+
+    def peak(self, n=None):
+        """Return peak rates (boards, channels) of the last n samples."""
+
+        _, rates = self.recent(n)
+        return rates.max(axis=0) if len(rates) else np.zeros(self.rates.shape[1:])
+
+    def export(self, n=None, history=False):
+        """Return the last, mean and peak rates of the last n samples in JSON compatible form."""
+
+        times, rates = self.recent(n)
+        mean = self.mean(n)
+        peak = self.peak(n)
+
+        d = {
+            "time": times[-1] if len(times) else None,
+            "samples": len(times),
+            "span": times[-1] - times[0] if len(times) else 0.0,
+            "boards": {},
+        }
+        for i, trbid in enumerate(self.trbids):
+            d["boards"][trbaddr(trbid)] = {
+                "last": rates[-1, i].tolist() if len(rates) else None,
+                "mean": mean[i].tolist(),
+                "peak": peak[i].tolist(),
+            }
+            if history:
+                d["boards"][trbaddr(trbid)]["history"] = rates[:, i].tolist()
+        if history:
+            d["times"] = times.tolist()
+
+        return d
+
+
+class ScalersMonitor:
+    """
+    Polls scalers of the boards (usually with the broadcast address of the board type) and stores
+    the rates in RateHistory, which is created with the boards answering the first reads and
+    extended with boards answering later. Failed reads are counted and the polling continues.
+
+    Paramaters
+    ----------
+    trbid : int
+        The address of the boards
+    n_scalers : int
+        Number of scalers of each board
+    interval : float
+        Time between the reads [s]
+    size : int
+        Number of samples kept in the history
+    """
+
+    def __init__(self, trbid, n_scalers, interval=1.0, size=600):
+        self.trbid = trbid
+        self.n_scalers = n_scalers
+        self.interval = interval
+        self.size = size
+        self.history = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.prev = None
+        self.prev_time = None
+        self.n_errors = 0
+        self.last_error = None
+
+    def poll(self):
+        """Read the scalers and add rates since the previous poll to the history, returns False if the read failed."""
+
+        try:
+            s = misc.parse_rm_scalers(self.n_scalers, communication.read_rm_scalers(self.trbid, self.n_scalers))
+        except Exception as e:
+            with self.lock:
+                self.n_errors += 1
+                self.last_error = "{:s}: {:s}".format(type(e).__name__, str(e))
+            return False
+
+        t = time.time()
+
+        if self.prev is not None and t > self.prev_time:
+            d = s.diff(self.prev)
+            with self.lock:
+                if self.history is None:
+                    self.history = RateHistory(d.scalers, self.n_scalers, self.size)
+                self.history.add(t, {trbid: v / (t - self.prev_time) for trbid, v in d.scalers.items()})
+
+        self.prev = s
+        self.prev_time = t
+        return True
+
+    def export(self, n=None, history=False):
+        with self.lock:
+            if self.history is None:
+                d = {"time": None, "samples": 0, "span": 0.0, "boards": {}}
+            else:
+                d = self.history.export(n, history)
+            d["errors"] = self.n_errors
+            d["last_error"] = self.last_error
+            return d
+
+    def run(self, callback=None, count=None):
+        """
+        Poll with the fixed cadence until stop() (or count polls), callback(monitor) is called after each poll.
+        """
+
+        t0 = time.monotonic()
+        k = 0
+        while not self.stop_event.is_set() and (count is None or k < count):
+            self.poll()
+            if callback is not None:
+                callback(self)
+
+            k += 1
+            self.stop_event.wait(max(0.0, t0 + k * self.interval - time.monotonic()))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def write_status(filename, data):
+    """Write the data to JSON file, the file is replaced at once so readers never see it partially written."""
+
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(data, fp)
+    os.replace(tmp, filename)
+
+
+def serve_status(path, monitor, history=False):
+    """
+    Serve the exported monitor data on the unix socket, each connection receives the current JSON.
+    Returns the server running in a daemon thread, close it with shutdown().
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write((json.dumps(monitor.export(history=history)) + "\n").encode())
+
+    # remove the socket left by a previous run, but never other files
+    if os.path.exists(path) and stat.S_ISSOCK(os.lstat(path).st_mode):
+        os.unlink(path)
+
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
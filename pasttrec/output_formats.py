@@ -20,6 +20,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+import numpy as np
+import struct
+
+from pasttrec import LIBVERSION, hardware
+
 cmd_to_file = None  # if set to file, redirect output to this file
 bgs = "    "
 igs = "  "
@@ -41,3 +47,158 @@ def dat_write_chunk(trbid, cable, asic, data, format_string=None):
         cmd_to_file.write(format_string % tuple([trbid, cable, asic] + data) + "\n")
     else:
         print(format_string % tuple(trbid, cable, asic + data) + "\n")
+
+
+# Binary scan format: magic, length of JSON header, the header and raw arrays, each aligned to
+# scan_binary_align bytes. The header holds the non-array fields and dtype, shape and offset
+# (relative to the first array) of each array, so the arrays can be memory-mapped.
+scan_binary_magic = b"PTSCAN01"
+scan_binary_suffix = ".pscan"
+scan_binary_align = 64
+
+
+def _align(n):
+    return (n + scan_binary_align - 1) // scan_binary_align * scan_binary_align
+
+
+def _is_array_group(value):
+    return isinstance(value, dict) and len(value) and all(isinstance(v, np.ndarray) for v in value.values())
+
+
+def dump_scan(filename, data):
+    """
+    Write scan results to file, binary format is used for files with scan_binary_suffix.
+
+    Paramaters
+    ----------
+    filename : str
+        The output file
+    data : dict
+        Scan results, values which are dictionaries of numpy arrays are stored as arrays,
+        other values must be JSON serializable
+    """
+
+    if not filename.endswith(scan_binary_suffix):
+        with open(filename, "w") as fp:
+            json.dump(data, fp, indent=2, default=lambda x: x.tolist())
+        return
+
+    header = {}
+    arrays = []
+    offset = 0
+    for key, value in data.items():
+        if not _is_array_group(value):
+            header[key] = value
+            continue
+
+        header[key] = {"__arrays__": {}}
+        for k, v in value.items():
+            v = np.ascontiguousarray(v)
+            header[key]["__arrays__"][k] = {"dtype": v.dtype.str, "shape": v.shape, "offset": offset}
+            arrays.append((offset, v))
+            offset = _align(offset + v.nbytes)
+
+    h = json.dumps(header).encode()
+    start = _align(len(scan_binary_magic) + 8 + len(h))
+
+    with open(filename, "wb") as fp:
+        fp.write(scan_binary_magic + struct.pack("<Q", len(h)) + h)
+        for pos, v in arrays:
+            fp.seek(start + pos)
+            fp.write(v.tobytes())
+        fp.truncate(start + offset)
+
+
+def load_scan(filename):
+    """
+    Read scan results written with dump_scan. Arrays of binary files are memory-mapped and read
+    from disk only when accessed, arrays of JSON files are converted to numpy arrays.
+    """
+
+    with open(filename, "rb") as fp:
+        magic = fp.read(len(scan_binary_magic))
+        if magic != scan_binary_magic:
+            fp.seek(0)
+            data = json.load(fp)
+            for key, value in data.items():
+                if key in ("baselines", "thresholds", "exposures"):
+                    data[key] = {k: np.asarray(v) for k, v in value.items()}
+            return data
+
+        (n,) = struct.unpack("<Q", fp.read(8))
+        header = json.loads(fp.read(n))
+
+    start = _align(len(scan_binary_magic) + 8 + n)
+    buffer = np.memmap(filename, dtype=np.uint8, mode="r")
+
+    data = {}
+    for key, value in header.items():
+        if isinstance(value, dict) and "__arrays__" in value:
+            value = {
+                k: np.ndarray(tuple(a["shape"]), dtype=a["dtype"], buffer=buffer, offset=start + a["offset"])
+                for k, a in value["__arrays__"].items()
+            }
+        data[key] = value
+
+    return data
+
+
+def dump_snapshot(filename, regs):
+    """
+    Write registers of asics to file, JSON format of hardware.dump() or binary format for files
+    with scan_binary_suffix.
+
+    Paramaters
+    ----------
+    filename : str
+        The output file
+    regs : dict
+        Map of asic address (trbid, cable, asic) to AsicRegistersValue
+    """
+
+    address = sorted(regs)
+
+    if filename.endswith(scan_binary_suffix):
+        snapshot = {
+            "address": np.array(address, dtype=np.int32).reshape(-1, 3),
+            "regs": hardware.AsicRegistersValue.images([regs[a] for a in address]),
+        }
+        dump_scan(filename, {"version": LIBVERSION, "snapshot": snapshot})
+        return
+
+    tdcs = {}
+    for trbid, cable, asic in address:
+        t = tdcs.setdefault(trbid, hardware.TdcConnection(trbid))
+        card = t.get_card(cable)
+        if card is None:
+            card = hardware.PasttrecCard("noname")
+            t.set_card(cable, card)
+        card.set_asic(asic, regs[(trbid, cable, asic)])
+
+    with open(filename, "w") as fp:
+        json.dump(hardware.dump(list(tdcs.values())), fp, indent=2)
+
+
+def load_snapshot(filename):
+    """Read registers of asics written with dump_snapshot, see dump_snapshot for the result."""
+
+    with open(filename, "rb") as fp:
+        binary = fp.read(len(scan_binary_magic)) == scan_binary_magic
+
+    if binary:
+        data = load_scan(filename)
+        if data.get("version") != LIBVERSION or "snapshot" not in data:
+            raise ValueError("Unsupported snapshot file {:s}".format(filename))
+
+        snapshot = data["snapshot"]
+        return {
+            tuple(int(x) for x in a): hardware.AsicRegistersValue.from_regs(r)
+            for a, r in zip(snapshot["address"], snapshot["regs"])
+        }
+
+    with open(filename) as fp:
+        r, tdcs = hardware.load(json.load(fp))
+    if not r:
+        raise ValueError("Unsupported version {:s} of snapshot file {:s}".format(str(tdcs), filename))
+
+    return {(int(t.id, 16), cable, asic): p for t in tdcs for cable, asic, p in t.asics()}
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Latency statistics of the TrbNet operations.
+
+TrbNetComStats wraps any interface and collects number of operations and histograms of their
+latency for each operation type, trbid and register. It is enabled with TRBNET_STATS, the summary
+is printed at exit (TRBNET_STATS=1) or stored in JSON file (TRBNET_STATS=stats.json).
+"""
+
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+from pasttrec.interface import TrbNetComInterface, batchable
+from pasttrec.misc import trbaddr
+
+
+class LatencyHistogram:
+    """Number, sum, extremes and logarithmic histogram of latencies."""
+
+    bins = np.logspace(-6, 1, 29)  # 1 us - 10 s, 4 bins per decade
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.counts = np.zeros(len(self.bins) + 1, dtype=np.int64)
+
+    def add(self, dt):
+        self.n += 1
+        self.total += dt
+        self.min = min(self.min, dt)
+        self.max = max(self.max, dt)
+        self.counts[np.searchsorted(self.bins, dt)] += 1
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.counts += other.counts
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else 0.0
+
+    def quantile(self, q):
+        """Return upper edge of the bin containing the quantile."""
+
+        if not self.n:
+            return 0.0
+
+        i = int(np.searchsorted(np.cumsum(self.counts), q * self.n))
+        return min(float(self.bins[i]), self.max) if i < len(self.bins) else self.max
+
+    def export(self):
+        return {
+            "n": self.n,
+            "total": self.total,
+            "min": self.min if self.n else 0.0,
+            "max": self.max,
+            "counts": self.counts.tolist(),
+        }
+
+
+class TrbNetComStats(TrbNetComInterface):
+    """
+    Collects latency statistics of the interface.
+
+    Operations of a batch are timed one by one if the interface executes them one after another
+    (the default execute_batch, e.g. libtrbnet). Batches streamed by the interface (e.g. persistent
+    shell) are timed as a whole and their operations are only counted.
+
+    Paramaters
+    ----------
+    com : TrbNetComInterface
+        The measured interface
+    """
+
+    def __init__(self, com):
+        self.com = com
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.stats = {}  # (op, trbid, reg): LatencyHistogram
+        self.n_ops = {}
+        self.n_streamed = {}  # op: count in streamed batches
+        self.n_streamed_batches = 0
+
+    def __add(self, key, dt):
+        with self.lock:
+            h = self.stats.get(key)
+            if h is None:
+                h = self.stats[key] = LatencyHistogram()
+            h.add(dt)
+            self.n_ops[key[0]] = self.n_ops.get(key[0], 0) + 1
+
+    def __call(self, op, trbid, reg, *args):
+        t = time.perf_counter()
+        try:
+            return getattr(self.com, op)(trbid, reg, *args)
+        finally:
+            self.__add((op, trbid, reg), time.perf_counter() - t)
+
+    def print_verbose(self, rc):
+        self.com.print_verbose(rc)
+
+    @batchable
+    def write(self, trbid, reg, data):
+        return self.__call("write", trbid, reg, data)
+
+    @batchable
+    def write_mem(self, trbid, reg, data, option=1):
+        return self.__call("write_mem", trbid, reg, data, option)
+
+    @batchable
+    def read(self, trbid, reg):
+        return self.__call("read", trbid, reg)
+
+    @batchable
+    def read_mem(self, trbid, reg, length, option=1):
+        return self.__call("read_mem", trbid, reg, length, option)
+
+    def execute_batch(self, ops):
+        t = time.perf_counter()
+        streamed = type(self.com).execute_batch is not TrbNetComInterface.execute_batch
+        try:
+            if streamed:
+                self.com.execute_batch(ops)
+            else:
+                for name, args, future in ops:
+                    rc = self.__call(name, *args)
+                    if future is not None:
+                        future.set_result(rc)
+        finally:
+            self.__add(("batch", None, None), time.perf_counter() - t)
+            if streamed:
+                with self.lock:
+                    self.n_streamed_batches += 1
+                    for name, *_ in ops:
+                        self.n_ops[name] = self.n_ops.get(name, 0) + 1
+                        self.n_streamed[name] = self.n_streamed.get(name, 0) + 1
+
+    def sync(self):
+        t = time.perf_counter()
+        self.com.sync()
+        self.__add(("sync", None, None), time.perf_counter() - t)
+
+    def release(self):
+        self.com.release()
+
+    def by_operation(self):
+        """Return histograms merged for each operation type."""
+
+        res = {}
+        with self.lock:
+            for (op, trbid, reg), h in self.stats.items():
+                res.setdefault(op, LatencyHistogram()).merge(h)
+        return res
+
+    def summary(self, top=10):
+        """Return text summary: operation types and the registers with the longest total time."""
+
+        wall = time.perf_counter() - self.t0
+        ops = self.by_operation()
+        busy = sum(h.total for h in ops.values())
+
+        lines = [
+            "TrbNet statistics: {:.3f} s in operations of {:.3f} s wall time ({:.1f}%)".format(
+                busy, wall, 100.0 * busy / wall if wall > 0 else 0.0
+            ),
+            "{:10s} {:>8s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+                "operation", "count", "total [s]", "mean [ms]", "p50 [ms]", "p99 [ms]", "max [ms]"
+            ),
+        ]
+        for op, h in sorted(ops.items()):
+            lines.append(
+                "{:10s} {:8d} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:10.3f}".format(
+                    op,
+                    h.n,
+                    h.total,
+                    h.mean * 1e3,
+                    h.quantile(0.5) * 1e3,
+                    h.quantile(0.99) * 1e3,
+                    h.max * 1e3,
+                )
+            )
+
+        with self.lock:
+            streamed = dict(self.n_streamed)
+            n_batches = self.n_streamed_batches
+        if n_batches:
+            lines.append(
+                "streamed batches: {:d}, {:.1f} operations per batch, not timed separately: {:s}".format(
+                    n_batches,
+                    sum(streamed.values()) / n_batches,
+                    ", ".join("{:s} {:d}".format(op, n) for op, n in sorted(streamed.items())),
+                )
+            )
+
+        with self.lock:
+            regs = sorted(
+                ((h.total, key, h) for key, h in self.stats.items() if key[1] is not None),
+                key=lambda x: x[0],
+                reverse=True,
+            )
+
+        if len(regs):
+            lines.append(
+                "{:10s} {:>6s} {:>6s} {:>8s} {:>10s} {:>10s}".format(
+                    "operation", "trbid", "reg", "count", "total [s]", "mean [ms]"
+                )
+            )
+        for total, (op, trbid, reg), h in regs[:top]:
+            lines.append(
+                "{:10s} {:>6s} {:>6s} {:8d} {:10.3f} {:10.3f}".format(
+                    op, trbaddr(trbid), hex(reg), h.n, total, h.mean * 1e3
+                )
+            )
+
+        return "\n".join(lines)
+
+    def export(self):
+        """Return the statistics in JSON compatible form."""
+
+        with self.lock:
+            entries = [
+                dict(op=op, trbid=trbid, reg=reg, **h.export())
+                for (op, trbid, reg), h in sorted(self.stats.items(), key=str)
+            ]
+
+        return {
+            "wall": time.perf_counter() - self.t0,
+            "bins": LatencyHistogram.bins.tolist(),
+            "n_ops": dict(self.n_ops),
+            "n_streamed": dict(self.n_streamed),
+            "n_streamed_batches": self.n_streamed_batches,
+            "entries": entries,
+        }
+
+    def report(self, target):
+        """Print the summary (target "1" or "-") or write the statistics to JSON file."""
+
+        if target in ("1", "-"):
+            print(self.summary(), file=sys.stderr)
+            return
+
+        with open(target, "w") as fp:
+            json.dump(self.export(), fp, indent=2)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Recording and replaying of the TrbNet traffic.
+
+TrbNetComRecorder wraps any interface and writes each operation with its time, duration and
+result to a JSON lines trace, selected with TRBNET_RECORD=trace.jsonl. TrbNetComReplay serves
+the reads from the trace without hardware, selected with TRBNET_INTERFACE=replay and
+TRBNET_TRACE=trace.jsonl.
+"""
+
+import builtins
+import collections
+import json
+import threading
+import time
+
+from pasttrec.interface import TrbNetComInterface, batchable
+from pasttrec.misc import trbaddr
+
+trace_version = 1
+
+
+def encode_result(rc):
+    """Convert result of operation into JSON compatible form."""
+
+    if isinstance(rc, dict):  # read_mem
+        return {"mem": [[trbid, list(values)] for trbid, values in rc.items()]}
+
+    return rc
+
+
+def decode_error(rec):
+    """Make the recorded exception, types other than the built-in ones are replayed as ValueError."""
+
+    exc = getattr(builtins, rec.get("exception", ""), None)
+    if not isinstance(exc, type) or not issubclass(exc, Exception):
+        exc = ValueError
+
+    return exc(rec["error"])
+
+
+def decode_result(rc):
+    if isinstance(rc, dict) and "mem" in rc:
+        return {trbid: tuple(values) for trbid, values in rc["mem"]}
+
+    return rc
+
+
+class TrbNetComRecorder(TrbNetComInterface):
+    """
+    Records operations of the interface to the trace file.
+
+    Paramaters
+    ----------
+    com : TrbNetComInterface
+        The recorded interface
+    filename : str
+        The trace file
+    """
+
+    def __init__(self, com, filename):
+        self.com = com
+        self.lock = threading.Lock()
+        self.fp = open(filename, "w")
+        self.t0 = time.perf_counter()
+
+        header = {"trace": trace_version, "time": time.time(), "backend": type(com).__name__}
+        self.fp.write(json.dumps(header) + "\n")
+
+    def __record(self, t, dt, op, args, rc=None, error=None):
+        rec = {"t": round(t - self.t0, 6), "dt": round(dt, 6), "op": op, "args": args}
+        if error is not None:
+            rec["error"] = str(error)
+            rec["exception"] = type(error).__name__
+        else:
+            rec["rc"] = encode_result(rc)
+
+        with self.lock:
+            self.fp.write(json.dumps(rec, default=int) + "\n")
+
+    def __call(self, op, *args):
+        t = time.perf_counter()
+        try:
+            rc = getattr(self.com, op)(*args)
+        except Exception as e:
+            self.__record(t, time.perf_counter() - t, op, list(args), error=e)
+            raise
+
+        self.__record(t, time.perf_counter() - t, op, list(args), rc)
+        return rc
+
+    def print_verbose(self, rc):
+        self.com.print_verbose(rc)
+
+    @batchable
+    def write(self, trbid, reg, data):
+        return self.__call("write", trbid, reg, data)
+
+    @batchable
+    def write_mem(self, trbid, reg, data, option=1):
+        return self.__call("write_mem", trbid, reg, list(data), option)
+
+    @batchable
+    def read(self, trbid, reg):
+        return self.__call("read", trbid, reg)
+
+    @batchable
+    def read_mem(self, trbid, reg, length, option=1):
+        return self.__call("read_mem", trbid, reg, length, option)
+
+    def execute_batch(self, ops):
+        """Execute the batch with the recorded interface, the operations get time of the batch."""
+
+        t = time.perf_counter()
+        try:
+            self.com.execute_batch(ops)
+        finally:
+            dt = time.perf_counter() - t
+            for name, args, future in ops:
+                if future is None:
+                    self.__record(t, dt, name, list(args))
+                elif future.done() and not future.cancelled():
+                    error = future.exception()
+                    self.__record(t, dt, name, list(args), None if error else future.result(), error)
+
+    def sync(self):
+        self.com.sync()
+        self.flush()
+
+    def release(self):
+        self.com.release()
+
+    def flush(self):
+        with self.lock:
+            self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+
+class TrbNetComReplay(TrbNetComInterface):
+    """
+    Serves reads from the trace file.
+
+    Each read returns the next recorded result of the same operation with the same arguments,
+    the last one is repeated when they are used up. Writes are only counted.
+
+    Paramaters
+    ----------
+    filename : str
+        The trace file
+    timing : bool
+        Sleep for the recorded duration of each operation
+    """
+
+    operations = ("write", "write_mem", "read", "read_mem")
+
+    def __init__(self, filename, timing=False):
+        self.timing = timing
+        self.lock = threading.Lock()
+        self.results = collections.defaultdict(collections.deque)
+        self.last = {}
+        self.write_dt = {"write": [], "write_mem": []}
+        self.n_ops = {op: 0 for op in self.operations}
+
+        with open(filename) as fp:
+            header = json.loads(fp.readline())
+            if header.get("trace") != trace_version:
+                raise ValueError("Unsupported trace file {:s}".format(filename))
+
+            for line in fp:
+                rec = json.loads(line)
+                if rec["op"] in ("read", "read_mem"):
+                    self.results[(rec["op"], *rec["args"])].append(rec)
+                else:
+                    self.write_dt[rec["op"]].append(rec["dt"])
+
+        # writes are not matched, they take the average time
+        self.write_dt = {op: sum(v) / len(v) if len(v) else 0.0 for op, v in self.write_dt.items()}
+
+    def reset_counters(self):
+        self.n_ops = {op: 0 for op in self.operations}
+
+    def __operation(self, op, dt=0.0):
+        self.n_ops[op] += 1
+        if self.timing and dt > 0.0:
+            time.sleep(dt)
+
+    def __fetch(self, op, *args):
+        key = (op, *args)
+        with self.lock:
+            queue = self.results.get(key)
+            if queue:
+                self.last[key] = queue.popleft()
+            rec = self.last.get(key)
+
+        if rec is None:
+            raise ValueError("{:s} {:s} {:s} not in trace".format(op, trbaddr(args[0]), hex(args[1])))
+
+        self.__operation(op, rec["dt"])
+        if "error" in rec:
+            raise decode_error(rec)
+
+        return decode_result(rec["rc"])
+
+    def print_verbose(self, rc):
+        pass
+
+    @batchable
+    def write(self, trbid, reg, data):
+        self.__operation("write", self.write_dt["write"])
+        return 0
+
+    @batchable
+    def write_mem(self, trbid, reg, data, option=1):
+        self.__operation("write_mem", self.write_dt["write_mem"])
+        return 0
+
+    @batchable
+    def read(self, trbid, reg):
+        return self.__fetch("read", trbid, reg)
+
+    @batchable
+    def read_mem(self, trbid, reg, length, option=1):
+        return self.__fetch("read_mem", trbid, reg, length, option)
@@ -1,9 +1,30 @@
 import abc
+from concurrent.futures import Future
 from time import sleep
 
 from pasttrec import misc
 
 
+def then(rc, func):
+    """Apply func to the result, if the result is a Future (read in a batch) return Future of the applied result."""
+
+    if not isinstance(rc, Future):
+        return func(rc)
+
+    res = Future()
+
+    def done(f):
+        if f.cancelled():
+            res.cancel()
+        elif f.exception() is not None:
+            res.set_exception(f.exception())
+        else:
+            res.set_result(func(f.result()))
+
+    rc.add_done_callback(done)
+    return res
+
+
 class TrbSpiDriver(metaclass=abc.ABCMeta):
     """A TrbMetaclass that will be used for trb interface class creation."""
 
@@ -50,6 +71,14 @@ class SpiTrbTdc:
     default_word_length = 20
     owire_mode = False
 
+    # The received words replace the transmitted ones in the data memory (0xD400..0xD40F), so the
+    # responses of a chunk of reads are collected with a single read_mem. Otherwise only the last
+    # received word is available in 0xD412 and each read is transmitted separately.
+    fifo_readback = False
+
+    # Size of the SPI data memory, number of words sent with a single transmit
+    fifo_size = 16
+
     def __init__(self, trb_com, trbid: int):
         """
         The constructor
@@ -71,8 +100,65 @@ class SpiTrbTdc:
 
         self.flag_rb = False  # Enable blocking state when the response is expected
 
-        self.restore = self.trb_com.read(self.trbid, 0xD419) != self.default_word_length  # restore to some defaults
-        self.owire_mode = self.trb_com.read(self.trbid, 0x23) != 0x0  # restore to some defaults
+        # Shadow of the SPI control registers, only changed values are written to the board
+        self.shadow = {}
+        self.owire_mode = True  # if unknown, assume 1-wire mode to force full SPI setup
+
+        word_length = self.trb_com.read(self.trbid, 0xD419)
+        owire = self.trb_com.read(self.trbid, 0x23)
+
+        # the values are not known yet when created inside of a batch
+        if isinstance(word_length, int) and isinstance(owire, int):
+            self.shadow[0xD419] = word_length
+            self.shadow[0x23] = owire
+            self.owire_mode = owire != 0x0
+
+    @staticmethod
+    def cable_mask(cable):
+        """Return mask of the cable outputs, the cable can be also a tuple of cables."""
+
+        if isinstance(cable, int):
+            return 1 << cable
+
+        mask = 0
+        for c in cable:
+            mask |= 1 << c
+        return mask
+
+    def invalidate(self):
+        """Forget the state of the control registers, they will be written again on next access."""
+
+        self.shadow.clear()
+
+    def __write(self, reg: int, data: int):
+        try:
+            self.trb_com.write(self.trbid, reg, data)
+        except Exception:
+            self.invalidate()
+            raise
+
+    def __write_ctrl(self, reg: int, data: int):
+        """Write control register only if the value differs from the shadow."""
+
+        if self.shadow.get(reg) == data:
+            return
+
+        self.__write(reg, data)
+        self.shadow[reg] = data
+        self.trb_com.on_batch_failure(self.__batch_failed)
+
+    def __batch_failed(self):
+        """Writes of a failed batch are not known to be done, force full setup on next access."""
+
+        self.invalidate()
+        self.owire_mode = True
+
+    def __read(self, reg: int):
+        try:
+            return self.trb_com.read(self.trbid, reg)
+        except Exception:
+            self.invalidate()
+            raise
 
     def __prepare(self, cable: int):
         """
@@ -82,25 +168,32 @@ class SpiTrbTdc:
         ----------
         trbid : int
             The trbid address
-        cable : int
-            The cable number 0..max (typically 3 or 4 cables on a single TDC)
+        cable : int or tuple
+            The cable number 0..max (typically 3 or 4 cables on a single TDC), for writing also
+            tuple of cables which get the same data
         """
 
+        mask = self.cable_mask(cable)
+
         if self.owire_mode:
             self.__enable_spi(cable)
 
         # bring all CS (reset lines) in the default state (1) - upper four nibbles:
         # invert CS, lower four nibbles: disable CS
-        self.trb_com.write(self.trbid, 0xD417, 0x0000FFFF)
+        self.__write_ctrl(0xD417, 0x0000FFFF)
 
         # (chip-)select output $CONN for i/o multiplexer reasons, remember CS lines are disabled
-        self.trb_com.write(self.trbid, 0xD410, 1 << cable)
+        self.__write_ctrl(0xD410, mask)
 
         # disable all SDO outputs but output $CONN
-        self.trb_com.write(self.trbid, 0xD415, 0xFFFF & ~(1 << cable))
+        self.__write_ctrl(0xD415, 0xFFFF & ~mask)
 
         # disable all SCK outputs but output $CONN
-        self.trb_com.write(self.trbid, 0xD416, 0xFFFF & ~(1 << cable))
+        self.__write_ctrl(0xD416, 0xFFFF & ~mask)
+
+    def __check_read(self, cable):
+        if not isinstance(cable, int):
+            raise ValueError("Cannot read from more cables {:s} at once".format(str(cable)))
 
     def __transmit(self, length: int, data_word_length=20):
         """
@@ -114,15 +207,11 @@ class SpiTrbTdc:
             How many bits to transmit
         """
 
-        # Change the data word length either when:
-        #  1. The current data word is different than default
-        #  2. The restore flag was used
-        if data_word_length != self.default_word_length or self.restore:
-            self.trb_com.write(self.trbid, 0xD419, data_word_length)
-            self.restore = True
+        # Change the data word length only if different than the current one
+        self.__write_ctrl(0xD419, data_word_length)
 
         rb_flag = 1 << 16 if self.flag_rb else 0
-        self.trb_com.write(self.trbid, 0xD411, length & 0xFFFF | rb_flag)
+        self.__write(0xD411, length & 0xFFFF | rb_flag)
 
     def write(self, cable: int, data: int):
         """
@@ -130,8 +219,8 @@ class SpiTrbTdc:
 
         Paramaters
         ----------
-        cable : int
-            The cable number 0..max (typically 3 or 4 cables on a single TDC)
+        cable : int or tuple
+            The cable number 0..max (typically 3 or 4 cables on a single TDC), or tuple of cables
         data : int
             data to write
         """
@@ -139,7 +228,7 @@ class SpiTrbTdc:
         self.__prepare(cable)
 
         # writing one data word, append zero to the data word, the chip will get some more SCK clock cycles
-        self.trb_com.write(self.trbid, 0xD400, data)
+        self.__write(0xD400, data)
         # write 1 to length register to trigger sending
         self.__transmit(1)
 
@@ -155,62 +244,115 @@ class SpiTrbTdc:
             data to write
         """
 
+        self.__check_read(cable)
         self.__prepare(cable)
 
         # writing one data word, append zero to the data word, the chip will get some more SCK clock cycles
-        self.trb_com.write(self.trbid, 0xD400, data)
+        self.__write(0xD400, data)
         # write 1 to length register to trigger sending
         self.rb_flag = True
         self.__transmit(1)
 
-        if self.restore:
-            rc = self.trb_com.read(self.trbid, 0xD412)
-            self.trb_com.write(self.trbid, 0xD419, self.default_word_length)
-            self.restore = False
-            return rc
-
         self.rb_flag = False
 
-        return self.trb_com.read(self.trbid, 0xD412)
+        return self.__read(0xD412)
+
+    def write_chunk(self, cable: int, data: list):
+        """
+        Write list of data words to spi interface. The words are sent in bursts of fifo_size words,
+        all bursts are executed in a single batch.
 
-    def write_chunk(self, cable: int, data: int):
-        """ """
+        Paramaters
+        ----------
+        cable : int or tuple
+            The cable number 0..max (typically 3 or 4 cables on a single TDC), or tuple of cables
+        data : list
+            data words to write, may address both asics of the cable
+        """
 
         if isinstance(data, list):
             my_data_list = data
         else:
             my_data_list = [data]
 
-        self.__prepare(cable)
+        try:
+            with self.trb_com.batch():
+                self.__prepare(cable)
 
-        self.rb_flag = False
+                for d in misc.chunks(my_data_list, self.fifo_size):
+                    self.trb_com.write_mem(self.trbid, 0xD400, d, 0)
+
+                    # write length register to trigger sending
+                    self.__transmit(len(d))
+        except Exception:
+            self.invalidate()
+            raise
+
+    def read_chunk(self, cable: int, data: list):
+        """
+        Write list of data words to spi interface and return list of results, all operations are
+        queued in a single batch. Inside of an outer batch the results are Futures.
+
+        Without fifo_readback each word costs 3 TrbNet operations (data word, transmit and read of
+        the response), the batch saves the round trips only for backends which stream it
+        (shell-persistent); libtrbnet executes the operations one after another. With
+        fifo_readback a chunk of fifo_size words costs a write_mem, transmit and read_mem.
 
-        for d in misc.chunks(my_data_list, 16):
-            # i = 0
-            self.trb_com.write_mem(self.trbid, 0xD400, my_data_list, 0)
-            # for val in d:
-            #    # writing one data word, append zero to the data word, the chip will get some more SCK clock cycles
-            #    self.trb_com.write(self.trbid, 0xd400 + i, val)
-            #    i = i + 1
+        Paramaters
+        ----------
+        cable : int
+            The cable number 0..max (typically 3 or 4 cables on a single TDC)
+        data : list
+            data words to write
+        """
 
-            # write length register to trigger sending
-            self.__transmit(len(d))
+        self.__check_read(cable)
+
+        rcs = []
+        try:
+            with self.trb_com.batch():
+                self.__prepare(cable)
+
+                if self.fifo_readback:
+                    for d in misc.chunks(data, self.fifo_size):
+                        self.trb_com.write_mem(self.trbid, 0xD400, d, 0)
+                        self.__transmit(len(d))
+                        rc = self.trb_com.read_mem(self.trbid, 0xD400, len(d), 0)
+                        for i in range(len(d)):
+                            rcs.append(then(rc, lambda x, i=i: x[self.trbid][i]))
+                else:
+                    for d in data:
+                        self.__write(0xD400, d)
+                        self.__transmit(1)
+                        rcs.append(self.trb_com.read(self.trbid, 0xD412))
+        except Exception:
+            self.invalidate()
+            raise
+
+        # inside of an outer batch the operations are not executed yet
+        if any(isinstance(rc, Future) and not rc.done() for rc in rcs):
+            return rcs
+
+        return [rc.result() if isinstance(rc, Future) else rc for rc in rcs]
 
     def spi_reset(self, cable: int):
         """Reset sequence for the ASIC."""
 
+        # the reset is also a recovery procedure, do not trust the shadow
+        self.invalidate()
+
         self.__enable_spi(cable)
 
         # bring all CS (reset lines) in the default state (1) - upper four nibbles:
         # invert CS, lower four nibbles: disable CS
-        self.trb_com.write(self.trbid, 0xD417, 0x10000 << cable | 0x0000FFFF)
+        self.__write_ctrl(0xD417, self.cable_mask(cable) << 16 | 0x0000FFFF)
 
         # To reset the ASIC one needs to send 25 clocks with CS=0
         # Just send empty word instead of 25 cycles
         self.__transmit(1, 25)
 
         # restore default CS
-        self.trb_com.write(self.trbid, 0xD417, 0x0000FFFF)
+        self.__write_ctrl(0xD417, 0x0000FFFF)
 
     def read_1wire_temp(self, cable: int):
         """non mux| dedicated 1wire component for each connector/cable"""
@@ -220,7 +362,7 @@ class SpiTrbTdc:
         # delay is mandatory due to how the 1wire device works
         sleep(self.delay_1wire_temp)
 
-        rc = self.trb_com.read(self.trbid, 0x8)
+        rc = self.__read(0x8)
 
         return (rc >> 16) * 0.0625
 
@@ -232,8 +374,8 @@ class SpiTrbTdc:
         # delay is mandatory due to how the 1wire device works
         sleep(self.delay_1wire_id)
 
-        rc0 = self.trb_com.read(self.trbid, 0xA)
-        rc1 = self.trb_com.read(self.trbid, 0xB)
+        rc0 = self.__read(0xA)
+        rc1 = self.__read(0xB)
 
         return (rc1 << 32) | rc0
 
@@ -249,7 +391,7 @@ class SpiTrbTdc:
         1wire activation and temp readout.
         """
 
-        rc = self.trb_com.read(self.trbid, 0x8)
+        rc = self.__read(0x8)
         return (rc >> 16) * 0.0625
 
     def get_1wire_id(self, cable: int):
@@ -259,22 +401,24 @@ class SpiTrbTdc:
         1wire activation and id readout.
         """
 
-        rc0 = self.trb_com.read(self.trbid, 0xA)
-        rc1 = self.trb_com.read(self.trbid, 0xB)
+        rc0 = self.__read(0xA)
+        rc1 = self.__read(0xB)
 
         return (rc1 << 32) | rc0
 
     def __enable_spi(self, cable: int):
         """The sequence is required to change from 1-wire to SPI."""
 
+        self.invalidate()
         self.owire_mode = False
-        self.trb_com.write(self.trbid, 0x23, 0x0)
+        self.__write_ctrl(0x23, 0x0)
 
     def __enable_1wire(self, cable: int):
         """The sequence is required to change from SPI to 1-wire."""
 
+        self.invalidate()
         self.owire_mode = True
-        self.trb_com.write(self.trbid, 0x23, 0x0002 << cable)
+        self.__write_ctrl(0x23, 0x0002 << cable)
 
         # send clocks to charge and run 1-wire devices
         self.__transmit(1, 4)
@@ -38,6 +38,7 @@ else:
             "tools/asic_read.py",
             "tools/asic_reset.py",
             "tools/asic_set.py",
+            "tools/asic_snapshot.py",
             "tools/asic_tempid.py",
             "tools/asic_threshold.py",
             "tools/baseline_calc.py",
@@ -47,6 +48,7 @@ else:
             "tools/draw_baseline_scan.py",
             "tools/dump_threshold_scan.py",
             "tools/pasttrec_write_and_verify.py",
+            "tools/scalers_monitor.py",
             "tools/scalers_scan.py",
             "tools/spi_scan.py",
             "tools/threshold_scan.py",
@@ -54,6 +56,7 @@ else:
         ],
         install_requires=[
             "colorama",
+            "numpy",
         ],
         zip_safe=False,
     )
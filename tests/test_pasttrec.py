@@ -7,10 +7,16 @@ from context import *
 # import unittest
 # import tempfile
 
+import numpy as np
+import pytest
+import subprocess
+import threading
+
 from pasttrec import hardware, LIBVERSION
 
 # from pasttrec.trb_spi import TrbSpiProtocol, Trb3Spi, Trb5scSpi
 from pasttrec.interface import TrbNetComInterface, TrbNetComLib, TrbNetComShell
+from pasttrec.emulator import TrbNetComEmulator
 
 from pasttrec.hardware import PasttrecDataWordEncoder
 
@@ -96,6 +102,209 @@ def test_pasttrec_encoder():
     assert encoder.read(1, 1) == 0x0051000 | 0x4100
 
 
+def test_asic_registers_value():
+    p = hardware.AsicRegistersValue(gain=2, peaking=3, tc1c=5, tc1r=1, tc2c=6, tc2r=2, vth=10, bl=list(range(8)))
+
+    assert p.dump_config() == [0x01B, 0x129, 0x232, 0x30A, 0x400, 0x501, 0x602, 0x703, 0x804, 0x905, 0xA06, 0xB07]
+    assert p.export() == {
+        "bg_int": 1,
+        "gain": 2,
+        "peaking": 3,
+        "tc1c": 5,
+        "tc1r": 1,
+        "tc2c": 6,
+        "tc2r": 2,
+        "vth": 10,
+        "bl": [0, 1, 2, 3, 4, 5, 6, 7],
+    }
+    assert hardware.AsicRegistersValue.load_asic_from_dict(p.export()) == p
+
+    q = p.copy()
+    q.bl[3] = 31
+    q.gain = 1
+    assert p.bl[3] == 3 and q.bl[3] == 31
+    assert q.gain == 1 and q.peaking == 3 and q.bg_int == 1
+    assert q != p
+
+    try:
+        p.unknown = 1
+    except AttributeError:
+        pass
+    else:
+        assert False
+
+    q.bl = np.arange(8, 16)
+    assert len(q.regs) == 12
+    assert list(q.bl) == list(range(8, 16))
+
+    q.bl = [0x11F] * 8
+    assert list(q.bl) == [0x1F] * 8
+
+    try:
+        q.bl = range(7)
+    except ValueError:
+        pass
+    else:
+        assert False
+    assert len(q.regs) == 12
+
+
+fake_trbcmd = """#!/bin/sh
+case "$1" in
+    w) test "$3" != 0xbad ;;
+    r) echo "$2 0x$(printf '%08x' $(($3)))" ;;
+    wm) cat > /dev/null ;;
+    rm) echo "H: $2 $4" ;;
+esac
+"""
+
+
+def test_shell_persistent(tmp_path, monkeypatch):
+    trbcmd = tmp_path / "trbcmd"
+    trbcmd.write_text(fake_trbcmd)
+    trbcmd.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+
+    shell = TrbNetComShell()
+    shell_p = TrbNetComShell(persistent=True)
+
+    for sh in shell, shell_p:
+        sh.write(0x6400, 0xD400, 0x1)
+        sh.write_mem(0x6400, 0xD400, [0x1, 0x2, 0x3], 0)
+        assert sh.read(0x6400, 0xD412) == 0xD412
+        assert sh.read_mem(0x6400, 0xC001, 48) == "H: 0x6400 48\n"
+
+    # writes are streamed without waiting for the result
+    for i in range(1000):
+        shell_p.write(0x6400, 0xD400, i)
+    assert shell_p.read(0x6400, 0x42) == 0x42
+
+    with shell_p.batch():
+        shell_p.write(0x6400, 0xD400, 0x1)
+        r1 = shell_p.read(0x6400, 0xD412)
+        r2 = shell_p.read_mem(0x6400, 0xC001, 48)
+        r3 = shell_p.read(0x6401, 0x42)
+    assert r1.result() == 0xD412
+    assert r2.result() == "H: 0x6400 48\n"
+    assert r3.result() == 0x42
+
+    # failed write is raised by the next wait for the co-process
+    shell_p.write(0x6400, 0xBAD, 0x1)
+    with pytest.raises(subprocess.CalledProcessError):
+        shell_p.sync()
+    assert shell_p.read(0x6400, 0x42) == 0x42
+
+    # co-process of a worker thread is closed when the worker exits
+    def worker():
+        assert shell_p.read(0x6400, 0x42) == 0x42
+        shell_p.release()
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+
+    assert len(shell_p.coprocesses) == 1
+    shell_p.close()
+    assert len(shell_p.coprocesses) == 0
+
+
+def test_shell_persistent_exit(tmp_path):
+    trbcmd = tmp_path / "trbcmd"
+    trbcmd.write_text(fake_trbcmd.replace("w) ", 'w) echo "$3 $4" >> "$TRBCMD_LOG"; '))
+    trbcmd.chmod(0o755)
+
+    env = dict(os.environ)
+    env["PATH"] = str(tmp_path) + os.pathsep + env["PATH"]
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(pasttrec.__file__)))
+    env["TRBNET_INTERFACE"] = "shell-persistent"
+    env["TRBCMD_LOG"] = str(tmp_path / "trbcmd.log")
+
+    # the interpreter exits with the writes still queued in the co-process
+    script = """
+from pasttrec import communication
+com = communication.get_trbnet_interface()
+for i in range(5):
+    com.write(0x6400, 0xD400, i)
+com.write(0x6400, 0xBAD, 0x1)
+"""
+    rc = subprocess.run([sys.executable, "-c", script], env=env, stderr=subprocess.PIPE, universal_newlines=True)
+
+    writes = (tmp_path / "trbcmd.log").read_text().splitlines()
+    assert writes == ["0xd400 0x{:x}".format(i) for i in range(5)] + ["0xbad 0x1"]
+    assert "CalledProcessError" in rc.stderr
+
+
+def test_batch():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+
+    with emu.batch():
+        emu.write(0x6400, 0xD415, 0x1)
+        emu.write(0x6400, 0xD416, 0x2)
+        emu.write(0x6400, 0xD417, 0x3)
+        emu.write(0x6400, 0xD410, 0x4)
+        r1 = emu.read(0x6400, 0xD416)
+        emu.write(0x6400, 0xD416, 0x5)
+
+        with emu.batch():
+            r2 = emu.read(0x6400, 0xD416)
+            r3 = emu.read_mem(0x6400, 0xD415, 3)
+
+        assert sum(emu.n_ops.values()) == 0
+        assert r2.done() is False
+
+    assert emu.n_ops == {"write": 2, "write_mem": 1, "read": 2, "read_mem": 1}
+    assert r1.result() == 0x2
+    assert r2.result() == 0x5
+    assert r3.result() == {0x6400: (0x1, 0x5, 0x3)}
+
+
+def test_batch_errors():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+
+    try:
+        with emu.batch():
+            emu.write(0x6400, 0xD415, 0x1)
+            r1 = emu.read(0x6400, 0xD415)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert r1.cancelled()
+    assert emu.read(0x6400, 0xD415) == 0xFFFF
+
+    try:
+        with emu.batch():
+            emu.write(0x6400, 0xD415, 0x1)
+            r1 = emu.read(0x6401, 0xD415)
+            r2 = emu.read(0x6400, 0xD415)
+    except ValueError:
+        pass
+
+    assert isinstance(r1.exception(), ValueError)
+    assert isinstance(r2.exception(), ValueError)
+
+
+def test_pasttrec_vector_encoder():
+    encoder = PasttrecDataWordEncoder()
+
+    words = encoder.encode_writes([0, 1, 1], [1, 3, 11], [2, 0x7F, 0x1F])
+    assert words.tolist() == [encoder.write(0, 1, 2), encoder.write(1, 3, 0x7F), encoder.write(1, 11, 0x1F)]
+    assert encoder.encode_reads(1, np.arange(12)).tolist() == [encoder.read(1, reg) for reg in range(12)]
+
+    values = [hardware.AsicRegistersValue(vth=i, bl=[i] * 8) for i in range(4)]
+    asics = np.array([0, 1, 0, 1])
+    words = encoder.encode_images(asics, hardware.AsicRegistersValue.images(values))
+    assert words.shape == (4, 12)
+    for i, p in enumerate(values):
+        assert words[i].tolist() == encoder.write_chunk(asics[i], p.dump_config())
+        assert encoder.write_chunk(asics[i], np.array(p.dump_config())) == words[i].tolist()
+
+    asic, reg, val = encoder.decode(words)
+    assert (asic == asics[:, None]).all()
+    assert (reg == np.arange(12)).all()
+    assert (val == hardware.AsicRegistersValue.images(values)).all()
+
+
 # def test_spi_com():
 # assert issubclass(Trb3Spi, TrbSpiProtocol) == True
 # assert issubclass(Trb5scSpi, TrbSpiProtocol) == True
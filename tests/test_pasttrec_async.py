@@ -0,0 +1,69 @@
+#!/bin/env python3
+
+from context import *
+
+import asyncio
+import time
+
+from pasttrec import communication, hardware
+from pasttrec.async_communication import AsyncTrbNetCom, make_async_asic_connections
+from pasttrec.emulator import TrbNetComEmulator
+
+
+def make_connections(n_boards):
+    emu = TrbNetComEmulator({0x6400 + i: hardware.TrbBoardType.TRB3 for i in range(n_boards)})
+    communication.trbnet_interface = emu
+    communication.CardConnection.shared_trb_spi.clear()
+
+    address = communication.decode_address(tuple(hex(0x6400 + i) for i in range(n_boards)))
+    return emu, make_async_asic_connections(address, AsyncTrbNetCom(emu))
+
+
+def test_async_registers():
+    emu, connections = make_connections(2)
+
+    async def run():
+        await asyncio.gather(*(con.write_reg(3, 0x20 + con.cable) for con in connections))
+        return await asyncio.gather(*(con.read_reg(3) for con in connections))
+
+    assert asyncio.run(run()) == [0x20 + con.cable for con in connections]
+    assert emu.boards[0x6401].asics[2][1].regs[3] == 0x22
+
+
+def test_async_1wire_overlap():
+    emu, connections = make_connections(4)
+    cable_connections = tuple(con for con in connections if con.asic == 0)
+
+    for con in cable_connections:
+        con.async_spi.spi.delay_1wire_temp = 0.05
+
+    async def run():
+        return await asyncio.gather(*(con.read_1wire_temp() for con in cable_connections))
+
+    t0 = time.monotonic()
+    temps = asyncio.run(run())
+    dt = time.monotonic() - t0
+
+    for con, temp in zip(cable_connections, temps):
+        assert temp == int(emu.boards[con.trbid].wire_temp[con.cable] / 0.0625) * 0.0625
+
+    # waits of different boards overlap, cables of a single board are serialised
+    assert dt >= 3 * 0.05
+    assert dt < 12 * 0.05 / 2
+
+
+def test_async_two_loops():
+    emu, connections = make_connections(2)
+    cable_connections = tuple(con for con in connections if con.asic == 0)
+
+    for con in cable_connections:
+        con.async_spi.spi.delay_1wire_temp = 0
+
+    async def run(value):
+        await asyncio.gather(*(con.write_reg(3, value + con.cable) for con in connections))
+        await asyncio.gather(*(con.read_1wire_temp() for con in cable_connections))
+        return await asyncio.gather(*(con.read_reg(3) for con in connections))
+
+    # the connections outlive the event loop, every asyncio.run() uses its own lock
+    assert asyncio.run(run(0x20)) == [0x20 + con.cable for con in connections]
+    assert asyncio.run(run(0x30)) == [0x30 + con.cable for con in connections]
@@ -142,3 +142,27 @@ def test_group_decoded_cables():
         filtered_inp = communication.filter_decoded_cables(inp)
         sorted_inp = communication.sort_by_cable(filtered_inp)
         assert communication.group_cables(sorted_inp) == outp
+
+
+def test_lazy_interface():
+    from pasttrec.emulator import TrbNetComEmulator
+
+    saved = communication.trbnet_interface, communication.trbnet_interface_env
+    try:
+        communication.trbnet_interface = None
+        communication.trbnet_interface_env = "emulator"
+
+        com = communication.get_trbnet_interface()
+        assert isinstance(com, TrbNetComEmulator)
+        assert communication.get_trbnet_interface() is com
+
+        communication.trbnet_interface = None
+        communication.trbnet_interface_env = "unknown"
+        try:
+            communication.get_trbnet_interface()
+        except ValueError:
+            pass
+        else:
+            assert False
+    finally:
+        communication.trbnet_interface, communication.trbnet_interface_env = saved
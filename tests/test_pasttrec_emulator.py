@@ -0,0 +1,526 @@
+#!/bin/env python3
+
+from context import *
+
+import numpy as np
+import pytest
+import threading
+import time
+
+from pasttrec import communication, hardware, misc, output_formats
+from pasttrec.emulator import TrbNetComEmulator, parse_boards_spec
+from pasttrec.interface import TrbNetComInterface
+from pasttrec.trb_spi import SpiTrbTdc
+
+
+def make_emulator(**kwargs):
+    return TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3, 0x6401: hardware.TrbBoardType.TRB5SC}, **kwargs)
+
+
+def make_connections(emu, address):
+    communication.trbnet_interface = emu
+    communication.CardConnection.shared_trb_spi.clear()
+    communication.CardConnection.shared_asic_regs.clear()
+    return communication.make_asic_connections(communication.decode_address(address))
+
+
+def test_emulator_interface():
+    assert issubclass(TrbNetComEmulator, TrbNetComInterface) is True
+
+
+def test_parse_boards_spec():
+    assert parse_boards_spec("0x6400:TRB3, 0x6401:trb5sc,0x6402") == {
+        0x6400: hardware.TrbBoardType.TRB3,
+        0x6401: hardware.TrbBoardType.TRB5SC,
+        0x6402: hardware.TrbBoardType.TRB3,
+    }
+
+
+def test_emulator_design():
+    emu = make_emulator()
+    communication.trbnet_interface = emu
+
+    assert communication.detect_design(0x6400) == hardware.TrbBoardType.TRB3
+    assert communication.detect_design("0x6401") == hardware.TrbBoardType.TRB5SC
+    assert len(communication.decode_address("0x6401")) == 8
+    assert len(communication.decode_address("0x6400:1")) == 2
+
+
+def test_design_cache(tmp_path):
+    emu = make_emulator()
+    communication.trbnet_interface = emu
+
+    assert len(communication.decode_address(("0x6400", "0x6401:1", "0x6401:2"))) == 6 + 2 + 2
+    assert communication.get_trb_design_type((0x6400, 0x6401)) == {
+        0x6400: hardware.TrbBoardType.TRB3,
+        0x6401: hardware.TrbBoardType.TRB5SC,
+    }
+    assert emu.n_ops["read_mem"] == 1 and emu.n_ops["read"] == 0
+
+    try:
+        communication.detect_design(0x6402)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    communication.design_cache_file = str(tmp_path / "designs.json")
+    try:
+        emu = make_emulator()
+        communication.trbnet_interface = emu
+        assert communication.detect_design(0x6401) == hardware.TrbBoardType.TRB5SC
+
+        emu = make_emulator()
+        communication.trbnet_interface = emu
+        assert communication.detect_design(0x6401) == hardware.TrbBoardType.TRB5SC
+        assert sum(emu.n_ops.values()) == 0
+
+        emu = make_emulator()
+        communication.trbnet_interface = emu
+        communication.design_cache_ttl = -1.0
+        assert communication.detect_design(0x6401) == hardware.TrbBoardType.TRB5SC
+        assert emu.n_ops["read_mem"] == 1
+    finally:
+        communication.design_cache_file = None
+        communication.design_cache_ttl = 600.0
+
+
+def test_emulator_broadcast():
+    emu = make_emulator()
+
+    assert tuple(emu.read_mem(0xFFFF, 0x42, 1).keys()) == (0x6400, 0x6401)
+    assert tuple(emu.read_mem(0xFE4C, 0x42, 1).keys()) == (0x6400,)
+    assert tuple(emu.read_mem(0xFE81, 0x42, 1).keys()) == (0x6401,)
+
+    try:
+        emu.read(0x6402, 0x42)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_emulator_asic_registers():
+    emu = make_emulator()
+
+    for con in make_connections(emu, ("0x6400", "0x6401")):
+        con.write_reg(3, 0x10 + con.cable * 2 + con.asic)
+        con.write_reg(11, 0x1F)
+
+    for con in make_connections(emu, ("0x6400", "0x6401")):
+        assert con.read_reg(3) == 0x10 + con.cable * 2 + con.asic
+        assert con.read_reg(11) == 0x1F
+        assert emu.boards[con.trbid].asics[con.cable][con.asic].regs[3] == 0x10 + con.cable * 2 + con.asic
+
+    con = make_connections(emu, ("0x6400:1:0",))[0]
+    con.write_chunk(hardware.AsicRegistersValue(vth=7, bl=[3] * 8).dump_config())
+    assert emu.boards[0x6400].asics[1][0].regs == [0x10, 0, 0, 7] + [3] * 8
+
+    con.reset_spi()
+    assert emu.boards[0x6400].asics[1][0].regs == [0x10] + [0] * 11
+    assert emu.boards[0x6400].asics[1][1].regs == [0x10] + [0] * 11
+    assert emu.boards[0x6400].asics[0][0].regs[3] == 0x10
+
+
+def test_emulator_1wire():
+    emu = make_emulator()
+    spi = SpiTrbTdc(emu, 0x6400)
+    spi.delay_1wire_temp = 0
+    spi.delay_1wire_id = 0
+
+    tdc = emu.boards[0x6400]
+    assert spi.read_1wire_temp(2) == int(tdc.wire_temp[2] / 0.0625) * 0.0625
+    assert spi.read_1wire_id(1) == tdc.wire_id[1]
+
+
+def test_emulator_scalers():
+    emu = make_emulator(noise_rate=1e6)
+    communication.trbnet_interface = emu
+    n_scalers = hardware.TrbBoardType.TRB3.n_scalers
+
+    v1 = misc.parse_rm_scalers(n_scalers, communication.read_rm_scalers(0x6400, n_scalers))
+    time.sleep(0.05)
+    v2 = misc.parse_rm_scalers(n_scalers, communication.read_rm_scalers(0x6400, n_scalers))
+
+    assert sum(v2.diff(v1).scalers[0x6400]) > 0
+
+
+def test_emulator_latency():
+    emu = make_emulator(latency={"read": 0.01})
+
+    t0 = time.monotonic()
+    for i in range(5):
+        emu.read(0x6400, 0x42)
+        emu.write(0x6400, 0xD400, 0)
+    assert time.monotonic() - t0 >= 0.05
+    assert emu.n_ops["read"] == 5
+    assert emu.n_ops["write"] == 5
+
+
+def test_broadcast_connections():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3, 0x6401: hardware.TrbBoardType.TRB3})
+
+    connections = make_connections(emu, ("0x6400", "0x6401"))
+    assert communication.find_endpoints(hardware.TrbBoardType.TRB5SC) == ()
+    assert communication.find_endpoints(hardware.TrbBoardType.TRB3) == (0x6400, 0x6401)
+
+    bc_connections = communication.make_broadcast_connections(connections)
+    assert len(bc_connections) == 6
+    assert all(con.trbid == 0xFE4C for con in bc_connections)
+
+    # only part of boards selected
+    assert communication.make_broadcast_connections(connections[:6]) == connections[:6]
+
+    emu.reset_counters()
+    for con in bc_connections:
+        con.write_reg(3, 0x21)
+    # full setup with 1-wire switch once, then only cable changes
+    assert emu.n_ops["write"] == (1 + 4 + 1 + 2) + 2 + 2 * (3 + 2 + 2)
+
+    for con in connections:
+        assert emu.boards[con.trbid].asics[con.cable][con.asic].regs[3] == 0x21
+
+    # individual access after broadcast and broadcast after individual access
+    connections[1].write_reg(3, 0x22)
+    bc_connections[0].write_reg(4, 0x0A)
+    assert connections[1].read_reg(3) == 0x22
+    assert emu.boards[0x6401].asics[0][0].regs[4] == 0x0A
+
+    # broadcast is write-only
+    with pytest.raises(TypeError, match="broadcast"):
+        bc_connections[0].read_reg(3)
+    with pytest.raises(TypeError, match="broadcast"):
+        bc_connections[0].read_regs([3, 4])
+
+
+def test_execute_parallel():
+    emu = TrbNetComEmulator({0x6400 + i: hardware.TrbBoardType.TRB3 for i in range(4)}, latency={"read": 0.005})
+    connections = make_connections(emu, ("0x6400", "0x6401", "0x6402", "0x6403"))
+
+    threads = {}
+
+    def read(con):
+        threads.setdefault(con.trbid, set()).add(threading.get_ident())
+        return con.read_reg(0)
+
+    t0 = time.monotonic()
+    res = tuple(communication.execute_parallel(read, connections, 1))
+    t_seq = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    res_par = tuple(communication.execute_parallel(read, connections))
+    t_par = time.monotonic() - t0
+
+    assert res == res_par
+    assert tuple(con for con, _ in res_par) == connections
+    assert all(v == 0x10 for _, v in res_par)
+    assert all(len(t) <= 2 for t in threads.values())  # main thread and one worker
+    assert t_par < t_seq / 2
+
+
+def test_check_asic_connection():
+    emu = make_emulator()
+    connections = make_connections(emu, "0x6400")
+
+    assert communication.check_asic_connection(connections[0], range(12), [0x00, 0xFF, 0x55]) == (36, None)
+
+    class Broken:
+        def write_reg(self, reg, val):
+            pass
+
+        def read_reg(self, reg):
+            return 0
+
+    passed, failure = communication.check_asic_connection(Broken(), [3], [0x00, 0x5A, 0xFF])
+    assert passed == 1 and "register 3" in failure
+    assert communication.check_asic_connection(Broken(), [3], [0x00, 0x5A, 0xFF], no_skip=True) == (1, None)
+
+
+def test_scalers_scanner():
+    emu = TrbNetComEmulator({0x6400 + i: hardware.TrbBoardType.TRB3 for i in range(3)}, noise_rate=1e6)
+    communication.trbnet_interface = emu
+    boards = {0x6400: hardware.TrbBoardType.TRB3, 0x6401: hardware.TrbBoardType.TRB3}
+
+    # baselines close to the threshold for high noise
+    for asic in emu.boards[0x6401].asics[0]:
+        asic.regs[4:12] = [15] * 8
+
+    # part of the boards, each read separately but waited once
+    scanner = communication.ScalersScanner(boards, 0.02)
+    t0 = time.monotonic()
+    for i in range(3):
+        s = scanner.measure()
+        assert sorted(s.scalers) == [0x6400, 0x6401]
+        assert sum(s.scalers[0x6401]) > 0
+    assert time.monotonic() - t0 < 3 * 0.02 * 2
+    assert emu.n_ops["read_mem"] == 1 + 2 * 4  # endpoints discovery and 4 snapshots
+
+    # all boards, read with broadcast and without reusing the snapshots
+    boards[0x6402] = hardware.TrbBoardType.TRB3
+    emu.reset_counters()
+    scanner = communication.ScalersScanner(boards, 0.01, reuse=False)
+    for i in range(3):
+        assert sorted(scanner.measure().scalers) == [0x6400, 0x6401, 0x6402]
+    assert emu.n_ops["read_mem"] == 1 + 2 * 3
+
+
+def test_scalers_scanner_settle():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+    communication.trbnet_interface = emu
+    boards = {0x6400: hardware.TrbBoardType.TRB3}
+
+    # the settle delay is kept for each measurement unless the snapshots are reused
+    for reuse, n_settle in ((False, 3), (True, 1)):
+        scanner = communication.ScalersScanner(boards, 0.0, settle=0.05, reuse=reuse)
+        t0 = time.monotonic()
+        for i in range(3):
+            scanner.measure()
+        dt = time.monotonic() - t0
+        assert n_settle * 0.05 <= dt < (n_settle + 1) * 0.05
+
+
+def test_scalers_scanner_target():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3}, noise_rate=1e6)
+    communication.trbnet_interface = emu
+    connections = make_connections(emu, ("0x6400:0:0",))
+    channels = communication.scaler_channels(connections)
+    assert channels[0x6400].tolist() == list(range(8))
+
+    scanner = communication.ScalersScanner({0x6400: hardware.TrbBoardType.TRB3}, 1.0)
+
+    # quiet channels do not extend the window, but are counted at least min_time
+    s, exposure = scanner.measure_until(100, 1.0, 0.01, channels)
+    assert exposure < 0.5
+    s, exposure = scanner.measure_until(100, 1.0, 0.01, channels, min_time=0.2)
+    assert 0.2 <= exposure < 0.5
+
+    emu.boards[0x6400].asics[0][0].regs[4:12] = [15] * 8
+    s, exposure = scanner.measure_until(100, 1.0, 0.01, channels)
+    assert exposure < 0.5
+    assert s.scalers[0x6400][:8].max() >= 100
+
+    # the target is not reachable within max_time for any channel
+    s, exposure = scanner.measure_until(10**9, 0.5, 0.01, channels, min_time=0.1)
+    assert 0.1 <= exposure < 0.2
+
+    # few counts in the first poll keep the channel active
+    assert communication.upper_counts(np.array([0, 100])).tolist() == [9, 139]
+
+
+def test_push_asic_configs():
+    emu = make_emulator()
+    connections = make_connections(emu, "0x6400")
+    address = tuple((con.trbid, con.cable, con.asic) for con in connections)
+
+    p = hardware.AsicRegistersValue(gain=2, vth=10, bl=[3] * 8)
+    assert communication.push_asic_configs({addr: p for addr in address}) == 12 * 6
+    assert emu.boards[0x6400].asics[2][1].regs == [x & 0xFF for x in p.dump_config()]
+
+    # nothing changed
+    emu.reset_counters()
+    assert communication.push_asic_configs({addr: p for addr in address}) == 0
+    assert sum(emu.n_ops.values()) == 0
+
+    # single register written with write_reg and single changed value
+    connections[0].write_reg(hardware.AsicRegisters.VTH.value, 11)
+    q = hardware.AsicRegistersValue(gain=2, vth=10, bl=[3] * 7 + [4])
+    assert communication.push_asic_configs({address[0]: q, address[1]: q}) == 1 + 1 + 1
+    assert emu.boards[0x6400].asics[0][0].regs == [x & 0xFF for x in q.dump_config()]
+
+    # unknown state, read the asics first
+    communication.CardConnection.shared_asic_regs.clear()
+    emu.reset_counters()
+    assert communication.push_asic_configs({addr: p for addr in address}, readback=True) == 2
+    assert emu.n_ops["read"] == 12 * 6
+    assert emu.boards[0x6400].asics[0][1].regs == [x & 0xFF for x in p.dump_config()]
+
+    # reset makes the state unknown again
+    connections[0].reset_spi()
+    assert len(connections[0].known_regs()) == 0
+    assert len(connections[2].known_regs()) == 12
+
+
+@pytest.mark.parametrize("suffix", [".json", ".pscan"])
+def test_push_asic_configs_baseline(tmp_path, suffix):
+    emu = make_emulator()
+    connections = make_connections(emu, "0x6400")
+    address = tuple((con.trbid, con.cable, con.asic) for con in connections)
+    baseline = str(tmp_path / ("baseline" + suffix))
+
+    p = hardware.AsicRegistersValue(gain=2, vth=10, bl=[3] * 8)
+    assert communication.push_asic_configs({addr: p for addr in address}, baseline=baseline) == 12 * 6
+
+    # known state of another process is taken from the baseline
+    communication.CardConnection.shared_asic_regs.clear()
+    emu.reset_counters()
+    q = hardware.AsicRegistersValue(gain=2, vth=11, bl=[3] * 8)
+    assert communication.push_asic_configs({address[0]: q}, baseline=baseline) == 1
+    assert sum(emu.n_ops.values()) < 12
+    assert emu.boards[0x6400].asics[0][0].regs == [x & 0xFF for x in q.dump_config()]
+
+    communication.CardConnection.shared_asic_regs.clear()
+    communication.set_known_regs(output_formats.load_snapshot(baseline))
+    assert communication.get_known_regs() == {addr: q if addr == address[0] else p for addr in address}
+
+
+def test_read_regs():
+    emu = make_emulator()
+    p = hardware.AsicRegistersValue(gain=1, vth=9, bl=list(range(8)))
+    values = [x & 0xFF for x in p.dump_config()]
+
+    for con in make_connections(emu, "0x6400:1"):
+        con.write_chunk(p.dump_config())
+
+    for fifo_readback in (False, True):
+        SpiTrbTdc.fifo_readback = fifo_readback
+        try:
+            connections = make_connections(emu, "0x6400:1")
+            emu.reset_counters()
+            for con in connections:
+                assert [rc & 0xFF for rc in con.read_all_regs()] == values
+                assert con.known_regs() == dict(enumerate(values))
+
+            with communication.batch():
+                rcs = connections[1].read_regs([3, 11])
+            assert [rc.result() & 0xFF for rc in rcs] == [9, 7]
+        finally:
+            SpiTrbTdc.fifo_readback = False
+
+        if fifo_readback:
+            assert emu.n_ops["read"] == 0
+            assert emu.n_ops["read_mem"] == 2 + 1
+        else:
+            assert emu.n_ops["read"] == 12 * 2 + 2
+
+
+def test_write_chunks():
+    emu = make_emulator()
+    connections = make_connections(emu, "0x6401:3")
+    card = communication.make_cable_connections(communication.decode_address("0x6401:3"))[0]
+
+    p = hardware.AsicRegistersValue(gain=1, vth=9, bl=list(range(8)))
+    q = hardware.AsicRegistersValue(gain=2, vth=11, bl=list(range(8, 16)))
+
+    card.write_chunks({0: q.dump_config()})
+
+    # both asics in two bursts, two transmits
+    emu.reset_counters()
+    card.write_chunks({0: p.dump_config(), 1: q.dump_config()})
+    assert emu.boards[0x6401].asics[3][0].regs == list(p.regs)
+    assert emu.boards[0x6401].asics[3][1].regs == list(q.regs)
+    assert emu.boards[0x6401].asics[2][0].regs == [0x10] + [0] * 11
+    assert emu.n_ops["write_mem"] == 2
+    assert emu.n_ops["write"] == 2
+    assert connections[1].known_regs() == dict(enumerate(q.regs))
+
+    # single asic, more than one burst
+    connections[0].write_chunk(q.dump_config() + p.dump_config())
+    assert emu.boards[0x6401].asics[3][0].regs == list(p.regs)
+
+    # selected registers of the images of both asics
+    emu.reset_counters()
+    mask = np.zeros((2, 12), dtype=bool)
+    mask[0, 3] = mask[1, 4] = True
+    card.write_images([0, 1], hardware.AsicRegistersValue.images([q, p]), mask)
+    assert emu.boards[0x6401].asics[3][0].regs == list(p.regs[:3]) + [q.regs[3]] + list(p.regs[4:])
+    assert emu.boards[0x6401].asics[3][1].regs == list(q.regs[:4]) + [p.regs[4]] + list(q.regs[5:])
+    assert emu.n_ops["write_mem"] == 1
+    assert connections[1].known_regs()[4] == p.regs[4]
+
+    # configs given as data words must have all registers
+    assert communication.push_asic_configs({(0x6401, 3, 1): q.dump_config()}) == 1
+    with pytest.raises(ValueError):
+        communication.push_asic_configs({(0x6401, 3, 1): q.dump_config()[:4]})
+
+
+def test_multicable_connections():
+    emu = make_emulator()
+    connections = make_connections(emu, ("0x6400", "0x6401:1:0", "0x6401:3:0"))
+
+    mc_connections = communication.make_multicable_connections(connections)
+    assert [(con.trbid, con.cable, con.asic) for con in mc_connections] == [
+        (0x6400, (0, 1, 2), 0),
+        (0x6400, (0, 1, 2), 1),
+        (0x6401, (1, 3), 0),
+    ]
+
+    emu.reset_counters()
+    for con in mc_connections:
+        con.write_chunk(hardware.AsicRegistersValue(vth=0x21, bl=[5] * 8).dump_config())
+    # one burst per connection and merged SDO/SCK setup of each board
+    assert emu.n_ops["write_mem"] == 3 + 2
+
+    for con in connections:
+        assert emu.boards[con.trbid].asics[con.cable][con.asic].regs[3] == 0x21
+        assert con.known_regs()[3] == 0x21
+    assert emu.boards[0x6401].asics[0][0].regs[3] == 0
+
+    # reads select a single cable again
+    assert connections[4].read_reg(3) == 0x21
+    with pytest.raises(TypeError, match="cables"):
+        mc_connections[0].read_reg(3)
+    with pytest.raises(TypeError, match="cables"):
+        mc_connections[0].read_regs([3, 4])
+
+    mc_connections[2].reset_spi()
+    assert emu.boards[0x6401].asics[1][0].regs == [0x10] + [0] * 11
+    assert emu.boards[0x6401].asics[3][0].regs == [0x10] + [0] * 11
+    assert len(connections[6].known_regs()) == 0
+    assert emu.boards[0x6400].asics[2][0].regs[3] == 0x21
+
+
+def test_asics_to_defaults():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3, 0x6401: hardware.TrbBoardType.TRB3})
+    connections = make_connections(emu, ("0x6400", "0x6401"))
+    address = tuple((con.trbid, con.cable, con.asic) for con in connections)
+
+    p = hardware.AsicRegistersValue(gain=2, vth=10, bl=[3] * 8)
+
+    # broadcast to all cables of both boards, each asic in one burst
+    emu.reset_counters()
+    assert communication.asics_to_defaults(address, p) == 12 * 2
+    assert emu.n_ops["write_mem"] == 2 + 1
+    for con in connections:
+        assert emu.boards[con.trbid].asics[con.cable][con.asic].regs == list(p.regs)
+        assert con.known_regs() == dict(enumerate(p.regs))
+
+    # nothing changed
+    emu.reset_counters()
+    assert communication.asics_to_defaults(address, p) == 0
+    assert emu.n_ops["write"] + emu.n_ops["write_mem"] == 0
+
+    # register changed on a single asic is written to all of them
+    connections[3].write_reg(hardware.AsicRegisters.VTH.value, 11)
+    assert communication.asics_to_defaults(address, p) == 1
+    assert emu.boards[0x6400].asics[1][1].regs == list(p.regs)
+
+    # part of the boards, the same asic of all cables at once
+    connections[0].write_reg(hardware.AsicRegisters.VTH.value, 11)
+    emu.reset_counters()
+    assert communication.asics_to_defaults(address[:6], p) == 1
+    assert emu.n_ops["write"] == 2  # data and transmit, once for the three cables
+    assert emu.boards[0x6400].asics[0][0].regs == list(p.regs)
+
+
+def test_count_scan_point(tmp_path):
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3}, noise_rate=1e6)
+    connections = make_connections(emu, ("0x6400:0",))
+    scanner = communication.ScalersScanner({0x6400: hardware.TrbBoardType.TRB3}, 0.02)
+    ckpt = misc.ScanCheckpoint(str(tmp_path / "scan.ckpt"), {"scan": "test"})
+
+    for con in connections:
+        con.write_chunk(hardware.AsicRegistersValue(bl=[15] * 8).dump_config())
+
+    ttt = misc.Thresholds()
+    communication.count_scan_point(scanner, connections, ttt, 0, checkpoint=ckpt)
+    communication.count_scan_point(scanner, connections, ttt, 1, target=100, max_time=1.0)
+    assert (ttt.thresholds["0x6400"][0, :, :, :2].sum(axis=(0, 1)) > 0).all()
+    assert (ttt.exposures["0x6400"][0, :, :, 0] == 0.02).all()
+    assert (ttt.exposures["0x6400"][0, :, :, 1] >= 0.02).all()
+
+    # restored from the checkpoint without reading the scalers
+    emu.reset_counters()
+    bbb = misc.Baselines()
+    communication.count_scan_point(scanner, connections, bbb, 5, 0, checkpoint=ckpt)
+    assert emu.n_ops["read_mem"] == 0
+    assert (bbb.baselines["0x6400"][0, :, :, 5] == ttt.thresholds["0x6400"][0, :, :, 0]).all()
@@ -0,0 +1,118 @@
+#!/bin/env python3
+
+from context import *
+
+import json
+import numpy as np
+import os
+
+from pasttrec import hardware, misc, output_formats
+
+
+def test_scalers_diff():
+    a1 = misc.parse_rm_scalers(4, {0x6400: (0x7FFFFFF0, 5, 0x80000010, 7), 0x6401: (1, 2)})
+    a2 = misc.parse_rm_scalers(4, {0x6400: (0x10, 15, 0x20, 7), 0x6402: (1,)})
+
+    bb = a2.diff(a1)
+    assert tuple(bb.scalers) == (0x6400,)
+    assert bb.scalers[0x6400].tolist() == [0x20, 10, 0x10, 0]
+    assert a1.export()[0x6401] == [1, 2, 0, 0]
+
+
+def test_baselines_export():
+    bbb = misc.Baselines()
+    bbb.add_trb("0x6400", hardware.TrbBoardType.TRB5SC)
+    bbb.baselines["0x6400"][3, 1, :, 31] = 5
+    bbb.config = {"vth": 0}
+
+    d = json.loads(json.dumps(bbb.export()))
+    assert len(d["baselines"]["0x6400"]) == 4
+    assert d["baselines"]["0x6400"][3][1][7][31] == 5
+    assert d["config"] == {"vth": 0}
+
+
+def test_scan_checkpoint(tmp_path):
+    filename = str(tmp_path / "scan.ckpt")
+    header = {"scan": "threshold", "config": {"bl": (0, 0)}}
+
+    ckpt = misc.ScanCheckpoint(filename, header)
+    ckpt.add("0x6400", 0, 1, 5, [1, 2, 3], 0.5)
+    ckpt.commit()
+    ckpt.close()
+
+    # interrupted write
+    with open(filename, "a") as fp:
+        fp.write('{"trbid": "0x64')
+
+    ckpt = misc.ScanCheckpoint(filename, header, resume=True)
+    assert ckpt.has("0x6400", 0, 1, 5)
+    assert not ckpt.has("0x6400", 0, 0, 5)
+    assert ckpt.get("0x6400", 0, 1, 5) == ([1, 2, 3], 0.5)
+    ckpt.add("0x6400", 0, 0, 5, [4], 1.0)
+    ckpt.close()
+
+    ckpt = misc.ScanCheckpoint(filename, header, resume=True)
+    assert len(ckpt.points) == 2
+    ckpt.close()
+
+    try:
+        misc.ScanCheckpoint(filename, {"scan": "baseline"}, resume=True)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    # existing checkpoint is not overwritten by mistake
+    try:
+        misc.ScanCheckpoint(filename, header)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+    ckpt = misc.ScanCheckpoint(filename, header, force=True)
+    assert len(ckpt.points) == 0
+    ckpt.remove()
+    assert not os.path.exists(filename)
+
+
+def test_scan_binary_format(tmp_path):
+    ttt = misc.Thresholds()
+    ttt.add_trb("0x6400", hardware.TrbBoardType.TRB3)
+    ttt.add_trb("0x6401", hardware.TrbBoardType.TRB5SC)
+    ttt.thresholds["0x6400"][2, 1, 7, 127] = 123
+    ttt.thresholds["0x6401"][3, 0, 0, 0] = 1 << 40
+    ttt.exposures["0x6401"][:] = 0.25
+    ttt.config = {"vth": 10, "bl": [0] * 8}
+
+    for name in ("scan.json", "scan.pscan"):
+        filename = str(tmp_path / name)
+        ttt.save(filename)
+
+        d = output_formats.load_scan(filename)
+        assert d["config"] == ttt.config
+        for k in ttt.thresholds:
+            assert d["thresholds"][k].shape == ttt.thresholds[k].shape
+            assert (d["thresholds"][k] == ttt.thresholds[k]).all()
+            assert (d["exposures"][k] == ttt.exposures[k]).all()
+
+    with open(str(tmp_path / "scan.pscan"), "rb") as fp:
+        assert fp.read(len(output_formats.scan_binary_magic)) == output_formats.scan_binary_magic
+    assert isinstance(d["thresholds"]["0x6400"].base, np.memmap)
+
+
+def test_snapshot_format(tmp_path):
+    regs = {
+        (0x6400, 0, 1): hardware.AsicRegistersValue(gain=2, vth=10, bl=[3] * 8),
+        (0x6400, 2, 0): hardware.AsicRegistersValue(tc1c=5, vth=12, bl=list(range(8))),
+        (0x6401, 3, 1): hardware.AsicRegistersValue(peaking=3, vth=7, bl=[31] * 8),
+    }
+
+    for name in ("snapshot.json", "snapshot" + output_formats.scan_binary_suffix):
+        output_formats.dump_snapshot(str(tmp_path / name), regs)
+        assert output_formats.load_snapshot(str(tmp_path / name)) == regs
+
+    d = json.load(open(tmp_path / "snapshot.json"))
+    assert d["0x6400"]["cable2"] is None
+    assert "cable4" not in d["0x6400"]
+    assert d["0x6401"]["cable4"]["asic2"] == regs[(0x6401, 3, 1)].export()
@@ -0,0 +1,106 @@
+#!/bin/env python3
+
+from context import *
+
+import json
+import socket
+
+import numpy as np
+
+from pasttrec import communication, hardware, monitor
+from pasttrec.emulator import TrbNetComEmulator
+
+
+def test_rate_history():
+    h = monitor.RateHistory((0x6401, 0x6400), 4, 3)
+    assert len(h) == 0
+    assert h.mean().shape == (2, 4)
+
+    for i in range(5):
+        h.add(10.0 + i, {0x6400: np.full(4, i), 0x6401: np.arange(4) * i, 0x6402: np.ones(4)})
+
+    assert len(h) == 3
+    times, rates = h.recent()
+    assert times.tolist() == [12.0, 13.0, 14.0]
+    assert rates[:, 0, 0].tolist() == [2, 3, 4]
+
+    assert h.mean()[0].tolist() == [3.0] * 4
+    assert h.peak()[1].tolist() == [0, 4, 8, 12]
+    assert h.mean(2)[0].tolist() == [3.5] * 4
+
+    d = h.export(history=True)
+    assert d["samples"] == 3 and d["span"] == 2.0
+    assert list(d["boards"]) == ["0x6400", "0x6401", "0x6402"]
+    assert d["boards"]["0x6401"]["last"] == [0, 4, 8, 12]
+    assert d["boards"]["0x6400"]["history"][0] == [2] * 4
+
+    # board answering later, zero rates before
+    h.add(15.0, {0x63FF: np.full(4, 7), 0x6400: np.full(4, 5)})
+    assert h.trbids == (0x63FF, 0x6400, 0x6401, 0x6402)
+    times, rates = h.recent()
+    assert rates[:, 0, 0].tolist() == [0, 0, 7]
+    assert rates[:, 1, 0].tolist() == [3, 4, 5]
+    assert rates[:, 2, 3].tolist() == [9, 12, 0]
+
+
+def test_scalers_monitor(tmp_path):
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3, 0x6401: hardware.TrbBoardType.TRB3}, noise_rate=1e6)
+    communication.trbnet_interface = emu
+
+    board = hardware.TrbBoardType.TRB3
+    mon = monitor.ScalersMonitor(board.broadcast, board.n_scalers, interval=0.01, size=5)
+    server = monitor.serve_status(str(tmp_path / "mon.sock"), mon)
+
+    try:
+        emu.reset_counters()
+        mon.run(lambda mon: monitor.write_status(str(tmp_path / "mon.json"), mon.export()), count=8)
+        assert emu.n_ops["read_mem"] == 8
+
+        assert len(mon.history) == 5
+        assert mon.history.trbids == (0x6400, 0x6401)
+        assert (mon.history.peak() >= mon.history.mean()).all()
+        assert mon.history.peak().max() > 0
+
+        d = json.load(open(tmp_path / "mon.json"))
+        assert d["samples"] == 5
+        assert len(d["boards"]["0x6401"]["mean"]) == board.n_scalers
+
+        s = socket.socket(socket.AF_UNIX)
+        s.connect(str(tmp_path / "mon.sock"))
+        assert json.loads(s.makefile().readline())["boards"]["0x6400"]["peak"] == d["boards"]["0x6400"]["peak"]
+        s.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_scalers_monitor_errors(tmp_path, monkeypatch):
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+    communication.trbnet_interface = emu
+
+    def read_mem(trbid, reg, length, option=1):
+        raise ValueError("Trbid 0x6400 not available")
+
+    # failed reads are counted, the monitor keeps polling
+    mon = monitor.ScalersMonitor(0x6400, hardware.TrbBoardType.TRB3.n_scalers, interval=0.0)
+    monkeypatch.setattr(emu, "read_mem", read_mem)
+    mon.run(count=3)
+    d = mon.export()
+    assert d["errors"] == 3 and d["samples"] == 0
+    assert d["last_error"].startswith("ValueError")
+
+    monkeypatch.undo()
+    mon.run(count=3)
+    d = mon.export()
+    assert d["errors"] == 3 and d["samples"] == 2
+
+    # only a socket is replaced
+    path = tmp_path / "mon.sock"
+    path.write_text("data")
+    try:
+        monitor.serve_status(str(path), mon)
+    except OSError:
+        pass
+    else:
+        assert False
+    assert path.read_text() == "data"
@@ -0,0 +1,72 @@
+#!/bin/env python3
+
+from context import *
+
+import json
+
+from pasttrec import hardware
+from pasttrec.emulator import TrbNetComEmulator
+from pasttrec.stats import LatencyHistogram, TrbNetComStats
+
+
+def test_latency_histogram():
+    h = LatencyHistogram()
+    for dt in (1e-4, 2e-4, 3e-4, 0.1):
+        h.add(dt)
+
+    assert h.n == 4
+    assert h.min == 1e-4 and h.max == 0.1
+    assert 1e-4 <= h.quantile(0.5) <= 1e-3
+    assert h.quantile(1.0) == 0.1
+
+
+def test_interface_stats(tmp_path):
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3}, latency=0.001)
+    com = TrbNetComStats(emu)
+
+    for i in range(3):
+        com.write(0x6400, 0xA000, i)
+    com.read(0x6400, 0x42)
+    with com.batch():
+        com.read(0x6400, 0x42)
+        com.read_mem(0x6400, 0xC000, 4)
+
+    assert com.n_ops == {"write": 3, "read": 2, "read_mem": 1, "batch": 1}
+    assert com.stats[("write", 0x6400, 0xA000)].n == 3
+    assert com.stats[("write", 0x6400, 0xA000)].min >= 0.001
+
+    # operations of the batch are executed one after another and timed one by one
+    assert com.stats[("read", 0x6400, 0x42)].n == 2
+    assert com.stats[("read_mem", 0x6400, 0xC000)].min >= 0.001
+
+    summary = com.summary()
+    assert "write" in summary and "0xa000" in summary
+
+    filename = str(tmp_path / "stats.json")
+    com.report(filename)
+    with open(filename) as fp:
+        d = json.load(fp)
+    assert len(d["entries"]) == 4
+
+
+def test_interface_stats_streamed():
+    class StreamedEmulator(TrbNetComEmulator):
+        def execute_batch(self, ops):
+            TrbNetComEmulator.execute_batch(self, ops)
+
+    com = TrbNetComStats(StreamedEmulator({0x6400: hardware.TrbBoardType.TRB3}))
+
+    com.read(0x6400, 0x42)
+    for i in range(2):
+        with com.batch():
+            com.read(0x6400, 0x42)
+            com.read_mem(0x6400, 0xC000, 4)
+
+    # streamed batch is timed as a whole, its operations are only counted
+    assert com.n_ops == {"read": 3, "read_mem": 2, "batch": 2}
+    assert com.stats[("read", 0x6400, 0x42)].n == 1
+    assert com.by_operation()["batch"].n == 2
+
+    summary = com.summary().splitlines()
+    assert [line.split()[:2] for line in summary[2:4]] == [["batch", "2"], ["read", "1"]]
+    assert "streamed batches: 2, 2.0 operations per batch" in summary[4]
@@ -0,0 +1,77 @@
+#!/bin/env python3
+
+from context import *
+
+import pytest
+
+from pasttrec import communication, hardware
+from pasttrec.emulator import TrbNetComEmulator
+from pasttrec.trace import TrbNetComRecorder, TrbNetComReplay
+
+
+def run_session(com):
+    communication.trbnet_interface = com
+    communication.CardConnection.shared_trb_spi.clear()
+
+    connections = communication.make_asic_connections(communication.decode_address("0x6400:1"))
+    for con in connections:
+        con.write_reg(hardware.AsicRegisters.VTH.value, 0x20 + con.asic)
+
+    result = [con.read_reg(hardware.AsicRegisters.VTH.value) for con in connections]
+    result.append(communication.read_rm_scalers(0x6400, 4))
+
+    with com.batch():
+        f = com.read(0x6400, 0x42)
+    result.append(f.result())
+
+    try:
+        com.read(0x6402, 0x42)
+    except ValueError as e:
+        result.append(str(e))
+
+    return result
+
+
+def test_record_and_replay(tmp_path):
+    filename = str(tmp_path / "trace.jsonl")
+
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+    rec = TrbNetComRecorder(emu, filename)
+    recorded = run_session(rec)
+    rec.close()
+
+    assert recorded[:2] == [0x20, 0x21]
+
+    replay = TrbNetComReplay(filename)
+    assert run_session(replay) == recorded
+    assert replay.n_ops["read"] == emu.n_ops["read"]
+    assert replay.n_ops["write"] + replay.n_ops["write_mem"] == emu.n_ops["write"] + emu.n_ops["write_mem"]
+
+    try:
+        replay.read(0x6400, 0x43)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def test_record_other_errors(tmp_path):
+    filename = str(tmp_path / "trace.jsonl")
+
+    class FailingEmulator(TrbNetComEmulator):
+        def read(self, trbid, reg):
+            if reg == 0x43:
+                raise TimeoutError("no answer")
+            return TrbNetComEmulator.read(self, trbid, reg)
+
+    rec = TrbNetComRecorder(FailingEmulator({0x6400: hardware.TrbBoardType.TRB3}), filename)
+    assert rec.read(0x6400, 0x42) is not None
+    with pytest.raises(TimeoutError):
+        rec.read(0x6400, 0x43)
+    rec.close()
+
+    replay = TrbNetComReplay(filename)
+    replay.read(0x6400, 0x42)
+    with pytest.raises(TimeoutError, match="no answer"):
+        replay.read(0x6400, 0x43)
+    assert replay.n_ops["read"] == 2
@@ -0,0 +1,114 @@
+#!/bin/env python3
+
+from context import *
+
+from pasttrec import hardware
+from pasttrec.emulator import TrbNetComEmulator
+from pasttrec.trb_spi import SpiTrbTdc
+
+encoder = hardware.PasttrecDataWordEncoder()
+
+
+def make_spi():
+    emu = TrbNetComEmulator({0x6400: hardware.TrbBoardType.TRB3})
+    spi = SpiTrbTdc(emu, 0x6400)
+    spi.delay_1wire_temp = 0
+    spi.delay_1wire_id = 0
+    emu.reset_counters()
+    return emu, spi
+
+
+def test_shadow_skips_setup_writes():
+    emu, spi = make_spi()
+
+    for reg in range(12):
+        spi.write(1, encoder.write(0, reg, reg))
+
+    # full setup only for the first word, then data and length
+    assert emu.n_ops["write"] == 4 + 2 + 11 * 2
+    assert emu.boards[0x6400].asics[1][0].regs == list(range(12))
+
+    emu.reset_counters()
+    for reg in range(12):
+        assert spi.read(1, encoder.read(0, reg) << 1) == reg
+    assert emu.n_ops["write"] == 12 * 2
+    assert emu.n_ops["read"] == 12
+
+    # switch cable
+    emu.reset_counters()
+    spi.write(2, encoder.write(1, 3, 0x33))
+    assert emu.n_ops["write"] == 3 + 2
+    assert emu.boards[0x6400].asics[2][1].regs[3] == 0x33
+
+
+def test_shadow_invalidation():
+    emu, spi = make_spi()
+
+    spi.write(0, encoder.write(0, 3, 0x11))
+
+    spi.spi_reset(0)
+    assert emu.boards[0x6400].asics[0][0].regs[3] == 0
+
+    emu.reset_counters()
+    spi.write(0, encoder.write(0, 3, 0x12))
+    assert emu.boards[0x6400].asics[0][0].regs[3] == 0x12
+    # CS is already restored by the reset, word length changes back from 25
+    assert emu.n_ops["write"] == 3 + 2 + 1
+
+    spi.read_1wire_temp(1)
+    emu.reset_counters()
+    spi.write(0, encoder.write(0, 3, 0x13))
+    assert emu.boards[0x6400].asics[0][0].regs[3] == 0x13
+    # 1-wire switch: 0x23, full setup, length and data
+    assert emu.n_ops["write"] == 1 + 4 + 1 + 2
+
+    spi.invalidate()
+    emu.reset_counters()
+    spi.write(0, encoder.write(0, 3, 0x14))
+    assert emu.n_ops["write"] == 4 + 1 + 2
+
+
+def test_shadow_invalidation_on_error():
+    emu, spi = make_spi()
+
+    spi.write(0, encoder.write(0, 3, 0x11))
+    assert len(spi.shadow)
+
+    spi.trbid = 0x6401
+    try:
+        spi.read(0, encoder.read(0, 3) << 1)
+    except ValueError:
+        pass
+
+    assert len(spi.shadow) == 0
+
+
+def test_shadow_invalidation_on_batch_failure():
+    emu, spi = make_spi()
+
+    spi.write(0, encoder.write(0, 3, 0x11))
+
+    # cancelled batch, the queued setup of cable 1 is not written
+    try:
+        with emu.batch():
+            spi.write(1, encoder.write(0, 3, 0x21))
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert len(spi.shadow) == 0
+    emu.reset_counters()
+    spi.write(1, encoder.write(0, 3, 0x22))
+    assert emu.boards[0x6400].asics[1][0].regs[3] == 0x22
+    # 1-wire switch, full setup, length and data
+    assert emu.n_ops["write"] == 1 + 4 + 1 + 2
+
+    # failed execution of the batch
+    try:
+        with emu.batch():
+            spi.write(2, encoder.write(0, 3, 0x31))
+            emu.read(0x6401, 0x0)
+    except ValueError:
+        pass
+
+    assert len(spi.shadow) == 0
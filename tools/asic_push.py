@@ -22,7 +22,7 @@
 
 import argparse
 
-from pasttrec import communication, misc, g_verbose
+from pasttrec import communication, misc, output_formats, g_verbose
 
 
 if __name__ == "__main__":
@@ -33,6 +33,21 @@ if __name__ == "__main__":
     group.add_argument("-d", "--dump", help="trbcmd dump file, bl regs only", type=str)
     group.add_argument("-D", "--Dump", help="trbcmd dump file, all regs", type=str)
     parser.add_argument("-e", "--exec", help="execute", action="store_true")
+    parser.add_argument(
+        "-r",
+        "--readback",
+        help="read registers of unknown state first and write only the changed ones, slower than writing them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        help="snapshot file with the known state of the asics (asic_snapshot.py save), updated after the push",
+        type=str,
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="number of threads, 0 - one per TDC; libtrbnet calls are serialised", type=int, default=0
+    )
 
     parser.add_argument(
         "-v",
@@ -56,6 +71,7 @@ if __name__ == "__main__":
     if args.Dump:
         dump_file = open(args.Dump, "w")
 
+    configs = {}
     for f in args.dat_file:
         with open(f) as data:
             lines = data.readlines()
@@ -71,23 +87,29 @@ if __name__ == "__main__":
 
             nl = [misc.convertToInt(x) for x in parts[0:15]]
 
-            con = tuple(communication.make_asic_connections((tuple(nl[0:3]),)))[0]
-
             for i, val in enumerate(nl[3:15]):
                 nl[3 + i] = i << 8 | nl[3 + i]
 
             if args.dump:
-                communication.cmd_to_file = dump_file
-                con.write_chunk(nl[2], nl[3:15])
-                communication.cmd_to_file = None
+                output_formats.cmd_to_file = dump_file
+                output_formats.export_chunk(
+                    misc.trbaddr(nl[0]),
+                    nl[1],
+                    nl[2],
+                    nl[7:15],
+                    "  %s  %d  %d    %2d  %2d  %2d  %2d  %2d  %2d  %2d  %2d",
+                )
 
             if args.Dump:
-                communication.cmd_to_file = dump_file
-                con.write_chunk(nl[3:15])
-                communication.cmd_to_file = None
+                output_formats.cmd_to_file = dump_file
+                output_formats.export_chunk(misc.trbaddr(nl[0]), nl[1], nl[2], nl[3:15])
 
             if args.exec or args.dump is None and args.Dump is None:
-                con.write_chunk(nl[3:15])
+                configs[tuple(nl[0:3])] = nl[3:15]
 
     if dump_file:
         dump_file.close()
+
+    if len(configs):
+        n = communication.push_asic_configs(configs, args.readback, args.jobs, args.baseline)
+        print("Written {:d} registers of {:d} asics".format(n, len(configs)))
@@ -30,7 +30,18 @@ from pasttrec.misc import trbaddr
 def_time = 0.0
 
 
-def read_asic(address):
+def read_regs(con):
+    if def_time > 0.0:
+        regs = []
+        for reg in range(12):
+            regs.append(con.read_reg(reg))
+            sleep(def_time)
+        return regs
+
+    return con.read_all_regs()
+
+
+def read_asic(address, jobs=0):
 
     print("   TDC  Cable  Asic   Reg# " + Fore.YELLOW, end="", flush=True)
 
@@ -40,7 +51,9 @@ def read_asic(address):
 
     print(Style.RESET_ALL)
 
-    for con in communication.make_asic_connections(address):
+    connections = communication.make_asic_connections(address)
+
+    for con, regs in communication.execute_parallel(read_regs, connections, jobs):
         if communication.g_verbose == 0:
             print(
                 Fore.YELLOW
@@ -52,7 +65,7 @@ def read_asic(address):
 
         for reg in range(12):
 
-            rc = con.read_reg(reg)
+            rc = regs[reg]
             try:
                 _t = rc & 0xFF
             except ValueError as ve:
@@ -89,7 +102,6 @@ def read_asic(address):
                     print("  {:#0{}x}".format(_t, 4), end="", flush=True)
 
             print(Style.RESET_ALL, end="", flush=True)
-            sleep(def_time)
 
         print(Style.RESET_ALL)
 
@@ -110,6 +122,13 @@ if __name__ == "__main__":
     )
 
     parser.add_argument("-t", "--time", help="sleep time", type=float, default=def_time)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of parallel jobs, 0: one per TDC; libtrbnet calls are serialised",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -128,4 +147,4 @@ if __name__ == "__main__":
         print(args)
 
     tup = communication.decode_address(args.trbids)
-    r = read_asic(tup)
+    r = read_asic(tup, args.jobs)
@@ -29,15 +29,26 @@ def_pastrec_thresh_range = [0x00, 0x7F]
 
 
 def fill_register(address, value):
-    for x in range(12):
-        set_register(address, x, value)
+    connections = communication.make_broadcast_connections(
+        communication.make_multicable_connections(communication.make_asic_connections(address))
+    )
+
+    with communication.batch():
+        for x in range(12):
+            for con in connections:
+                con.write_reg(x, value & 0xFF)
 
     return 0
 
 
 def set_register(address, register, value):
-    for con in communication.make_asic_connections(address):
-        con.write_reg(register, value & 0xFF)
+    connections = communication.make_broadcast_connections(
+        communication.make_multicable_connections(communication.make_asic_connections(address))
+    )
+
+    with communication.batch():
+        for con in connections:
+            con.write_reg(register, value & 0xFF)
 
     return 0
 
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import time
+
+from pasttrec import communication, hardware, output_formats
+from pasttrec.misc import trbaddr
+
+encoder = hardware.PasttrecDataWordEncoder()
+
+
+def save_snapshot(address, filename, jobs=0):
+    """Read registers of all asics and write them to file."""
+
+    connections = communication.make_asic_connections(address)
+
+    regs = {
+        (con.trbid, con.cable, con.asic): hardware.AsicRegistersValue.from_regs(encoder.decode(rcs)[2].tolist())
+        for con, rcs in communication.execute_parallel(lambda con: con.read_all_regs(), connections, jobs)
+    }
+
+    output_formats.dump_snapshot(filename, regs)
+    return regs
+
+
+def restore_snapshot(filename, readback=False, verify=False, jobs=0, baseline=None):
+    """Write registers of asics from file, returns number of written registers and list of mismatched asics."""
+
+    regs = output_formats.load_snapshot(filename)
+    n = communication.push_asic_configs(regs, readback, jobs, baseline)
+
+    mismatched = []
+    if verify:
+        connections = communication.make_asic_connections(tuple(regs))
+        read = {
+            (con.trbid, con.cable, con.asic): rcs
+            for con, rcs in communication.execute_parallel(lambda con: con.read_all_regs(), connections, jobs)
+        }
+
+        if len(read):
+            _, _, values = encoder.decode(list(read.values()))
+            expected = hardware.AsicRegistersValue.images(regs[address] for address in read)
+            mismatched = [address for address, bad in zip(read, (values != expected).any(axis=1)) if bad]
+
+    return n, len(regs), mismatched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Save registers of all PASTTREC chips to file or restore them from file",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    save = subparsers.add_parser("save", help="read asics and write the snapshot")
+    save.add_argument(
+        "trbids",
+        help="list of TRBids to read in form" " addres[:card-0-1-2[:asic-0-1]]",
+        type=str,
+        nargs="+",
+    )
+    save.add_argument("-o", "--output", help="output file, .pscan for binary format", type=str, default="snapshot.json")
+
+    restore = subparsers.add_parser("restore", help="write the snapshot to asics")
+    restore.add_argument("input", help="snapshot file", type=str)
+    restore.add_argument(
+        "-r",
+        "--readback",
+        help="read registers of unknown state first and write only the changed ones, slower than writing them",
+        action="store_true",
+    )
+    restore.add_argument(
+        "-b",
+        "--baseline",
+        help="snapshot file with the known state of the asics, updated after the restore",
+        type=str,
+    )
+    restore.add_argument("-c", "--verify", help="read registers back and compare", action="store_true")
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of parallel jobs, 0: one per TDC; libtrbnet calls are serialised",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="verbose level: 0, 1, 2, 3",
+        type=int,
+        choices=[0, 1, 2, 3],
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    communication.g_verbose = args.verbose
+
+    if communication.g_verbose > 0:
+        print(args)
+
+    t = time.time()
+
+    if args.command == "save":
+        regs = save_snapshot(communication.decode_address(args.trbids), args.output, args.jobs)
+        print("Saved {:d} asics to {:s} in {:.2f} s".format(len(regs), args.output, time.time() - t))
+    else:
+        n, n_asics, mismatched = restore_snapshot(args.input, args.readback, args.verify, args.jobs, args.baseline)
+        print("Written {:d} registers of {:d} asics in {:.2f} s".format(n, n_asics, time.time() - t))
+
+        for trbid, cable, asic in mismatched:
+            print("Verification failed for {:s}  {:d}  {:d}".format(trbaddr(trbid), cable, asic))
@@ -29,8 +29,13 @@ def_pastrec_thresh_range = [0x00, 0x7F]
 
 
 def set_thresholds(address, value):
-    for con in communication.make_asic_connections(address):
-        con.write_reg(3, value & 0xFF)
+    connections = communication.make_broadcast_connections(
+        communication.make_multicable_connections(communication.make_asic_connections(address))
+    )
+
+    with communication.batch():
+        for con in connections:
+            con.write_reg(3, value & 0xFF)
 
     print("Done")
 
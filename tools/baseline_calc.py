@@ -22,7 +22,6 @@
 
 import argparse
 from colorama import Fore, Style
-import copy
 import json
 
 from pasttrec import hardware, communication, misc, output_formats
@@ -76,9 +75,7 @@ if __name__ == "__main__":
     if communication.g_verbose > 0:
         print(args)
 
-    with open(args.json_file) as json_data:
-        d = json.load(json_data)
-        json_data.close()
+    d = output_formats.load_scan(args.json_file)
 
     dump_file = None
     if args.dump:
@@ -95,6 +92,7 @@ if __name__ == "__main__":
     cfg = d["config"]
 
     tlist = []
+    configs = {}
     p = hardware.AsicRegistersValue()
 
     for k, v in cfg.items():
@@ -187,7 +185,7 @@ if __name__ == "__main__":
 
                     p.bl[ch] = _r
 
-                card.set_asic(a, copy.deepcopy(p))
+                card.set_asic(a, p.copy())
 
                 if args.dump:
                     regs = p.dump_config()[4:]
@@ -216,7 +214,7 @@ if __name__ == "__main__":
                         output_formats.export_chunk(k, c, a, regs)
 
                 if args.exec:
-                    communication.write_chunk(k, c, a, regs)
+                    configs[(int(k, 16), c, a)] = p.copy()
 
             t.set_card(c, card)
 
@@ -225,6 +223,9 @@ if __name__ == "__main__":
     if dump_file:
         dump_file.close()
 
+    if len(configs):
+        communication.push_asic_configs(configs)
+
     if out_file:
         out_file.write(json.dumps(dump(tlist), indent=2))
         out_file.close()
@@ -22,9 +22,28 @@
 
 import os
 import argparse
-import json
 
-from pasttrec import communication, misc
+import numpy as np
+
+from pasttrec import communication, misc, output_formats
+
+
+def decode_scan_address(string, shape):
+    """
+    Decode address AAAA[:B[:C]] of the scan file name without TrbNet, the cables and asics are taken
+    from the shape of the scan array (cables, asics, channels, steps).
+    """
+
+    sections = string.split(":")
+    trbid = int(sections[0], 16)
+    cables = range(shape[0])
+    asics = range(shape[1])
+    if len(sections) >= 2 and len(sections[1]):
+        cables = [int(c) for c in sections[1].split(",") if int(c) in cables]
+    if len(sections) >= 3 and len(sections[2]):
+        asics = [int(a) for a in sections[2].split(",") if int(a) in asics]
+
+    return tuple((trbid, cable, asic) for cable in cables for asic in asics)
 
 
 if __name__ == "__main__":
@@ -35,7 +54,7 @@ if __name__ == "__main__":
 
     parser.add_argument("files", help="files to merge", type=str, nargs="+")
 
-    parser.add_argument("-o", "--output", help="output file", type=str, default="merged.json")
+    parser.add_argument("-o", "--output", help="output file, .pscan for binary format", type=str, default="merged.json")
     parser.add_argument(
         "-v",
         "--verbose",
@@ -60,9 +79,7 @@ if __name__ == "__main__":
     d = None
     for filename in args.files:
         print(filename)
-        with open(filename) as json_data:
-            d = json.load(json_data)
-            json_data.close()
+        d = output_formats.load_scan(filename)
 
         out_file = None
 
@@ -75,11 +92,25 @@ if __name__ == "__main__":
         barename = os.path.splitext(filename)[0]
         trbid = barename.split("_")[-1]
 
-        tup = communication.decode_address(trbid)
+        try:
+            hex_addr = misc.trbaddr(int(trbid.split(":")[0], 16))
+        except ValueError:
+            print("Incorrect address {:s} in file name {:s}".format(trbid, filename))
+            continue
+
+        if hex_addr not in bls:
+            print("No scan of {:s} in {:s}".format(hex_addr, filename))
+            continue
+
+        # the layout of the board comes from the scan itself, no TrbNet access is needed
+        shape = np.shape(bls[hex_addr])
+        if hex_addr not in b.baselines:
+            b.baselines[hex_addr] = np.zeros(shape, dtype=np.int64)
+            b.exposures[hex_addr] = np.zeros(shape)
 
-        for addr, card, asic in tup:
-            b.add_trb(addr)
-            b.baselines[addr][card][asic] = bls[addr][card][asic]
+        for addr, card, asic in decode_scan_address(trbid, shape):
+            b.baselines[hex_addr][card][asic] = bls[hex_addr][card][asic]
+            if "exposures" in d:
+                b.exposures[hex_addr][card][asic] = d["exposures"][hex_addr][card][asic]
 
-    with open(args.output, "w") as fp:
-        json.dump(b.__dict__, fp, indent=2)
+    b.save(args.output)
@@ -22,13 +22,25 @@
 
 import sys
 import argparse
-from time import sleep
-import json
+import math
+import numpy as np
 
 from pasttrec import hardware, communication, misc
 from pasttrec.misc import trbaddr
 
 def_time = 1
+def_reuse = True
+
+# statistics driven window: count until def_target counts, but not longer than def_max_time
+def_target = None
+def_max_time = 10.0
+
+def_checkpoint = None
+
+# adaptive scan: coarse scan every def_coarse_step with fraction of the time, then resolve the peak
+def_coarse_step = 4
+def_coarse_time_fraction = 0.1
+def_resolve_sigma = 3.0
 
 def_max_bl_register_steps = 32
 def_pastrec_thresh_range = [0x00, 0x7F]
@@ -36,43 +48,24 @@ def_pastrec_bl_base = 0x00000
 def_pastrec_bl_range = [0x00, def_max_bl_register_steps]
 
 
-def update_baselines(bbb, broadcasts_list, connections, blv):
-    for bc_addr, n_scalers in broadcasts_list:
-        v1 = communication.read_rm_scalers(bc_addr, n_scalers)
-        sleep(def_time)
-        v2 = communication.read_rm_scalers(bc_addr, n_scalers)
-        a1 = misc.parse_rm_scalers(n_scalers, v1)
-        a2 = misc.parse_rm_scalers(n_scalers, v2)
-        bb = a2.diff(a1)
-
-        for con in connections:
-            hex_addr = misc.trbaddr(con.trbid)
-            blv_data = []
-            for c in list(range(con.fetype.n_channels)):
-                blv_data.append(hardware.TrbRegistersOffsets.c_bl_reg[c])
+def count_point(bbb, scanner, connections, blv, step=None):
+    """Count scalers for the baseline value, see communication.count_scan_point."""
 
-                chan = misc.calc_tdc_channel(con.fetype, con.cable, con.asic, c)
+    communication.count_scan_point(scanner, connections, bbb, blv, step, def_checkpoint, def_target, def_max_time)
 
-                vv = bb.scalers[con.trbid][chan]
-                if vv < 0:
-                    vv += 0x80000000
 
-                bbb.add_trb(hex_addr, con.fetype)
-                bbb.baselines[hex_addr][con.cable][con.asic][c][blv] = vv
+def make_scanner(connections):
+    """All boards are counted in a common window, see communication.ScalersScanner."""
 
-            # This line kills baseline scan for the reg #16 (last of 2nd asic
-            # but dunno why. Why writing zero kills it?
-            # communication.write_chunk(addr, cable, asic, blv_data)
+    boards = {con.trbid: con.fetype for con in connections}
+    return communication.ScalersScanner(boards, def_time, reuse=def_reuse)
 
 
 def scan_baseline_single(address):
     bbb = misc.Baselines()
     connections = communication.make_asic_connections(address)
 
-    # Store here pairs of bc address and number of channels in an endpoint
-    broadcasts_list = set()
-    for con in connections:
-        broadcasts_list.add((con.trbid, con.fetype.n_scalers))
+    scanner = make_scanner(connections)
 
     print(" trbid   channel   bl 0{:s}31".format(" " * 32))
     print("                      |{:s}|".format("-" * 32))
@@ -83,10 +76,11 @@ def scan_baseline_single(address):
         for blv in range(def_pastrec_bl_range[0], def_pastrec_bl_range[1]):
             print(".", end="", flush=True)
 
-            for con in connections:
-                con.write_reg(4 + c, blv)
+            with communication.batch():
+                for con in connections:
+                    con.write_reg(4 + c, blv)
 
-            update_baselines(bbb, broadcasts_list, connections, blv)
+            count_point(bbb, scanner, connections, blv, c * def_max_bl_register_steps + blv)
 
         print("  done")
 
@@ -97,30 +91,132 @@ def scan_baseline_multi(address):
     bbb = misc.Baselines()
     connections = communication.make_asic_connections(address)
 
-    # Store here pairs of bc address and number of channels in an endpoint
-    broadcasts_list = set()
-    for con in connections:
-        broadcasts_list.add((con.trbid, con.fetype.n_scalers))
+    scanner = make_scanner(connections)
 
     print(" trbid   channel   bl 0{:s}31".format(" " * 32))
     print("                      |{:s}|".format("-" * 32))
     print("{:s}    {:s}          ".format(trbaddr(0), "all"), end="", flush=True)  # FIXME set proper BC address?
 
+    # the same baseline is written to all channels, use all cables and broadcast if possible
+    write_connections = communication.make_broadcast_connections(communication.make_multicable_connections(connections))
+
     for blv in range(def_pastrec_bl_range[0], def_pastrec_bl_range[1]):
         print(".", end="", flush=True)
 
-        for con in connections:
-            blv_data = []
+        with communication.batch():
+            for con in write_connections:
+                blv_data = []
+
+                for c in list(range(con.fetype.n_channels)):
+                    blv_data.append(hardware.TrbRegistersOffsets.c_bl_reg[c] | blv)
+
+                con.write_chunk(blv_data)
+
+        count_point(bbb, scanner, connections, blv)
+
+    print("  done")
+
+    return bbb
+
+
+def resolved_peaks(counts, fine):
+    """
+    Mark channels which peak measured with the full window is higher than both its
+    neighbours by def_resolve_sigma standard deviations.
+    """
+
+    # not measured steps are negative, beyond the range there are no counts
+    c = np.pad(np.where(fine, counts, -1.0), [(0, 0)] * (counts.ndim - 1) + [(1, 1)])
+
+    best = c.argmax(axis=-1)[..., None]
+    peak = np.take_along_axis(c, best, -1)[..., 0]
+    left = np.take_along_axis(c, best - 1, -1)[..., 0]
+    right = np.take_along_axis(c, best + 1, -1)[..., 0]
+    neighbour = np.maximum(left, right)
+
+    return (left >= 0) & (right >= 0) & (peak - neighbour > def_resolve_sigma * np.sqrt(peak + neighbour))
+
+
+def scan_baseline_adaptive(address):
+    """
+    Coarse scan of all channels with short windows, then scan with full windows around the
+    noise peak of each channel until the peak is resolved. Counts are normalised to the full
+    window, steps which were not scanned stay zero.
+    """
+
+    bbb = misc.Baselines()
+    connections = communication.make_asic_connections(address)
+
+    scanner = make_scanner(connections)
+
+    n_steps = def_pastrec_bl_range[1] - def_pastrec_bl_range[0]
+    n_channels = max((con.fetype.n_channels for con in connections), default=0)
+
+    counts = np.zeros((len(connections), n_channels, n_steps))
+    exposures = np.zeros(counts.shape)
+    fine = np.zeros(counts.shape, dtype=bool)
+
+    def measure(steps, window, mask):
+        """Set baseline step of each channel and store normalised counts of the masked channels."""
+
+        with communication.batch():
+            for con, con_steps in zip(connections, steps):
+                con.write_chunk(
+                    [
+                        hardware.TrbRegistersOffsets.c_bl_reg[c] | int(def_pastrec_bl_range[0] + con_steps[c])
+                        for c in range(con.fetype.n_channels)
+                    ]
+                )
+
+        scanner.window = window
+        bb = scanner.measure()
 
-            for c in list(range(con.fetype.n_channels)):
-                blv_data.append(hardware.TrbRegistersOffsets.c_bl_reg[c] | blv)
+        for i, con in enumerate(connections):
+            first = misc.calc_tdc_channel(con.fetype, con.cable, con.asic, 0)
+            values = bb.scalers[con.trbid][first : first + n_channels] * (def_time / window)
 
-            con.write_chunk(blv_data)
+            channels = np.nonzero(mask[i])[0]
+            counts[i, channels, steps[i, channels]] = values[channels]
+            exposures[i, channels, steps[i, channels]] = window
+            if window == def_time:
+                fine[i, channels, steps[i, channels]] = True
 
-        update_baselines(bbb, broadcasts_list, connections, blv)
+    print(" trbid   channel   bl 0{:s}31".format(" " * 32))
+    print("                      |{:s}|".format("-" * 32))
+    print("{:s}    {:s}          ".format(trbaddr(0), "all"), end="", flush=True)
+
+    all_channels = np.ones(counts.shape[:2], dtype=bool)
+
+    coarse_steps = list(range(0, n_steps, def_coarse_step))
+    if coarse_steps[-1] != n_steps - 1:
+        coarse_steps.append(n_steps - 1)
+
+    for step in coarse_steps:
+        print(",", end="", flush=True)
+        measure(np.full(counts.shape[:2], step), def_time * def_coarse_time_fraction, all_channels)
+
+    # channels without any counts have no peak to refine
+    peaks = counts.argmax(axis=-1)
+    pending = counts.max(axis=-1) > 0
+
+    offsets = [0] + [sign * d for d in range(1, def_coarse_step) for sign in (-1, 1)]
+
+    for offset in offsets:
+        pending &= ~resolved_peaks(counts, fine)
+        if not pending.any():
+            break
+
+        print(".", end="", flush=True)
+        measure(np.clip(peaks + offset, 0, n_steps - 1), def_time, pending)
 
     print("  done")
 
+    for i, con in enumerate(connections):
+        hex_addr = misc.trbaddr(con.trbid)
+        bbb.add_trb(hex_addr, con.fetype)
+        bbb.baselines[hex_addr][con.cable, con.asic, :, def_pastrec_bl_range[0] :] = np.rint(counts[i])
+        bbb.exposures[hex_addr][con.cable, con.asic, :, def_pastrec_bl_range[0] :] = exposures[i]
+
     return bbb
 
 
@@ -138,14 +234,45 @@ if __name__ == "__main__":
     )
 
     parser.add_argument("-t", "--time", help="sleep time", type=float, default=def_time)
-    parser.add_argument("-o", "--output", help="output file", type=str, default="results_bl.json")
+    parser.add_argument(
+        "--no-reuse",
+        dest="reuse",
+        action="store_false",
+        help="take new opening scalers snapshot for each step instead of reusing the closing one of previous step",
+    )
+    parser.add_argument(
+        "--target-counts",
+        help="count each step (at least --time) until all active channels reach this value, results are normalised "
+        "to --time, not with the adaptive scan",
+        type=int,
+    )
+    parser.add_argument(
+        "--target-error",
+        help="as --target-counts, given with relative statistical error",
+        type=float,
+    )
+    parser.add_argument("--max-time", help="maximal counting time with target", type=float, default=def_max_time)
+    parser.add_argument(
+        "-o", "--output", help="output file, .pscan for binary format", type=str, default="results_bl.json"
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="checkpoint file, default: output file with .ckpt suffix, not with the adaptive scan",
+        type=str,
+    )
+    parser.add_argument(
+        "--resume", help="resume the scan from the checkpoint, not with the adaptive scan", action="store_true"
+    )
+    parser.add_argument("--force", help="overwrite existing checkpoint when not resuming", action="store_true")
     parser.add_argument(
         "-s",
         "--scan",
         help="scan type: singel-low/high:"
         " one channel at a time, baseline set to low/high,"
-        " multi: all channels parallel",
-        choices=["single-low", "single-high", "multi"],
+        " multi: all channels parallel,"
+        " adaptive: coarse scan and refinement around the peak of each channel, without target counts and"
+        " checkpoint",
+        choices=["single-low", "single-high", "multi", "adaptive"],
         default="multi",
     )
     parser.add_argument(
@@ -232,8 +359,27 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # the adaptive scan has own timing and its points depend on previous results
+    if args.scan == "adaptive":
+        unsupported = {
+            "--target-counts": args.target_counts is not None,
+            "--target-error": args.target_error is not None,
+            "--checkpoint": args.checkpoint is not None,
+            "--resume": args.resume,
+            "--force": args.force,
+        }
+        unsupported = [k for k, v in unsupported.items() if v]
+        if unsupported:
+            parser.error("{:s} not supported by the adaptive scan".format(", ".join(unsupported)))
+
     communication.g_verbose = args.verbose
     def_time = args.time
+    def_reuse = args.reuse
+    def_max_time = args.max_time
+    if args.target_counts is not None:
+        def_target = args.target_counts
+    elif args.target_error is not None:
+        def_target = math.ceil(1.0 / args.target_error**2)
 
     if communication.g_verbose > 0:
         print(args)
@@ -248,7 +394,7 @@ if __name__ == "__main__":
         def_pastrec_bl_base = def_pastrec_bl_range[0]
     elif def_scan_type == "single-high":
         def_pastrec_bl_base = def_pastrec_bl_range[1] - 1
-    elif def_scan_type == "multi":
+    elif def_scan_type in ("multi", "adaptive"):
         def_pastrec_bl_base = def_pastrec_bl_range[0]
 
     p = hardware.AsicRegistersValue(
@@ -265,18 +411,33 @@ if __name__ == "__main__":
 
     tup = communication.decode_address(args.trbids)
 
+    if def_scan_type != "adaptive":
+        header = {"scan": def_scan_type, "config": p.export(), "time": def_time, "target": def_target}
+        try:
+            def_checkpoint = misc.ScanCheckpoint(
+                args.checkpoint or args.output + ".ckpt", header, args.resume, args.force
+            )
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
     if args.defaults:
         communication.asics_to_defaults(tup, p)
 
     if def_scan_type == "multi":
         r = scan_baseline_multi(tup)
+    elif def_scan_type == "adaptive":
+        r = scan_baseline_adaptive(tup)
     else:
         r = scan_baseline_single(tup)
 
-    r.config = p.__dict__
+    r.config = p.export()
 
     if args.defaults:
         communication.asics_to_defaults(tup, p)
 
-    with open(args.output, "w") as fp:
-        json.dump(r.__dict__, fp, indent=2)
+    r.save(args.output)
+
+    # the scan is completed, the checkpoint is not needed anymore
+    if def_checkpoint is not None:
+        def_checkpoint.remove()
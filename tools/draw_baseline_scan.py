@@ -21,9 +21,10 @@
 # SOFTWARE.
 
 import argparse
-import json
 import matplotlib.pyplot as plt
 
+from pasttrec import output_formats
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Draw baseline scan results")
     parser.add_argument("json_file", help="list of arguments", type=str)
@@ -31,9 +32,7 @@ if __name__ == "__main__":
 
     print(args)
 
-    with open(args.json_file) as json_data:
-        d = json.load(json_data)
-        json_data.close()
+    d = output_formats.load_scan(args.json_file)
 
     x = list(range(0, 32))
 
@@ -21,7 +21,8 @@
 # SOFTWARE.
 
 import argparse
-import json
+
+from pasttrec import output_formats
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Draw baseline scan results")
@@ -30,9 +31,7 @@ if __name__ == "__main__":
 
     print(args)
 
-    with open(args.json_file) as json_data:
-        d = json.load(json_data)
-        json_data.close()
+    d = output_formats.load_scan(args.json_file)
 
     x = list(range(0, 32))
 
@@ -43,11 +42,7 @@ if __name__ == "__main__":
     for k, v in bls.items():
         for t in list(range(128)):
             print("{:d}   ".format(t), end="")
-            for c in [0, 1, 2]:
-                for a in [0, 1]:
-                    for ch in list(range(8)):
-
-                        tt = v[c][a][ch][t]
-                        print("{:d} ".format(tt), end="")
+            for tt in v[:, :, :, t].ravel():  # all cables, asics and channels
+                print("{:d} ".format(tt), end="")
 
             print(" ")
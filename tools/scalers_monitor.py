@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Rafal Lalik <rafal.lalik@uj.edu.pl>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import curses
+
+from pasttrec import communication, hardware, monitor
+
+modes = {"m": "mean", "p": "peak", "l": "last"}
+
+
+def draw(stdscr, mon, window, state):
+    """Show the rates of all channels of the boards, the noisiest channels are highlighted."""
+
+    c = stdscr.getch()
+    if c == ord("q"):
+        mon.stop()
+    elif 0 <= c < 256 and chr(c) in modes:
+        state["mode"] = modes[chr(c)]
+
+    d = mon.export(window)
+    mode = state["mode"]
+
+    field_width = 10
+    height, width = stdscr.getmaxyx()
+
+    stdscr.erase()
+    title = "{:s} rates [Hz] of {:d} samples, {:.0f} s, {:d} read errors  (m/p/l: mean/peak/last, q: quit)".format(
+        mode, d["samples"], d["span"], d["errors"]
+    )
+    stdscr.addstr(0, 0, title[: width - 1])
+
+    boards = sorted(d["boards"].items())[: max(0, (width - field_width) // field_width)]
+    rates = [v[mode] or [] for k, v in boards]
+    limit = sorted((r for v in rates for r in v), reverse=True)[: state["top"]]
+    limit = limit[-1] if len(limit) and limit[-1] > 0 else None
+
+    for i, (trbid, v) in enumerate(boards):
+        stdscr.addstr(1, field_width * (i + 1), "{:>{}s}".format(trbid, field_width), curses.A_STANDOUT)
+
+        for ch, r in enumerate(rates[i][: max(0, height - 3)]):
+            attr = curses.A_BOLD if limit is not None and r >= limit else curses.A_NORMAL
+            stdscr.addstr(2 + ch, field_width * (i + 1), "{:>{}.1f}".format(r, field_width), attr)
+
+    for ch in range(min(mon.n_scalers, max(0, height - 3))):
+        stdscr.addstr(2 + ch, 0, "Chan {:#3d}  ".format(ch), curses.A_STANDOUT)
+
+    stdscr.refresh()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Monitor scalers rates of the boards",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+
+    parser.add_argument("-b", "--board", help="board type", type=str, choices=["TRB3", "TRB5SC"], default="TRB3")
+    parser.add_argument(
+        "-a", "--address", help="address to read, default: broadcast of board type", type=lambda x: int(x, 0)
+    )
+    parser.add_argument("-i", "--interval", help="time between reads [s]", type=float, default=1.0)
+    parser.add_argument("-s", "--size", help="number of samples kept in the history", type=int, default=3600)
+    parser.add_argument("-w", "--window", help="time window of mean and peak rates [s]", type=float, default=60.0)
+    parser.add_argument("-o", "--output", help="JSON file updated after each read", type=str)
+    parser.add_argument("-S", "--socket", help="unix socket serving the JSON data", type=str)
+    parser.add_argument("-H", "--history", help="include full history in the file and socket", action="store_true")
+    parser.add_argument("-n", "--no-ui", help="run without the curses display", action="store_true")
+    parser.add_argument("-t", "--top", help="number of highlighted noisiest channels", type=int, default=10)
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="verbose level: 0, 1, 2, 3",
+        type=int,
+        choices=[0, 1, 2, 3],
+        default=0,
+    )
+
+    args = parser.parse_args()
+
+    communication.g_verbose = args.verbose
+
+    board = hardware.TrbBoardType[args.board]
+    address = args.address if args.address is not None else board.broadcast
+    window = max(1, int(args.window / args.interval))
+
+    mon = monitor.ScalersMonitor(address, board.n_scalers, args.interval, args.size)
+
+    server = monitor.serve_status(args.socket, mon, args.history) if args.socket else None
+
+    def update(mon):
+        if args.output:
+            monitor.write_status(args.output, mon.export(window, args.history))
+
+    try:
+        if args.no_ui:
+            mon.run(update)
+        else:
+            state = {"mode": "mean", "top": args.top}
+
+            def run(stdscr):
+                stdscr.nodelay(True)
+
+                def show(mon):
+                    update(mon)
+                    draw(stdscr, mon, window, state)
+
+                mon.run(show)
+
+            curses.wrapper(run)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
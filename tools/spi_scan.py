@@ -22,7 +22,6 @@
 
 import sys
 import argparse
-from time import sleep
 from colorama import Fore, Style
 
 from alive_progress import alive_bar
@@ -33,7 +32,7 @@ from pasttrec.misc import trbaddr
 def_time = 0.0
 
 
-def scan_spi_communication(address, def_time=1.0, def_no_skip=False):
+def scan_spi_communication(address, def_time=1.0, def_no_skip=False, jobs=0):
 
     print("   TDC  Cable  Asic")
 
@@ -43,7 +42,12 @@ def scan_spi_communication(address, def_time=1.0, def_no_skip=False):
     tests_failed = 0
     tests_ok = 0
 
-    for con in communication.make_asic_connections(address):
+    def test(con):
+        return communication.check_asic_connection(con, [reg_target], reg_test_vals, def_time, def_no_skip)
+
+    connections = communication.make_asic_connections(address)
+
+    for con, (passed, failure) in communication.execute_parallel(test, connections, jobs):
 
         with alive_bar(
             len(reg_test_vals),
@@ -55,36 +59,13 @@ def scan_spi_communication(address, def_time=1.0, def_no_skip=False):
             elapsed=False,
             stats=False,
         ) as bar:
-            reg_test_ok = True
-
-            for t in reg_test_vals:
-                con.write_reg(reg_target, t)
-                sleep(def_time)
-                rc = con.read_reg(reg_target)
-                try:
-                    _t = rc & 0xFF
-                except ValueError as ve:
-                    bar.text(f"Wrong result: {rc.split()[1]} {ve}")
-                    _t = None
-
-                if _t != t or _t is None:
-                    if not def_no_skip:
-                        bar.text(
-                            Fore.RED
-                            + " Test failed for register {:d}".format(reg_target)
-                            + Style.RESET_ALL
-                            + "  Sent {:d}, received {:d}".format(t, _t),
-                        )
-                        reg_test_ok = False
-                        break
-                else:
-                    bar()
-
-            if reg_test_ok:
+            bar(passed)
+
+            if failure is None:
                 bar.text(Fore.GREEN + " OK" + Style.RESET_ALL)
                 tests_ok += 1
             else:
-                bar.text(Fore.RED + " FAILED" + Style.RESET_ALL)
+                bar.text(Fore.RED + " FAILED" + Style.RESET_ALL + failure)
                 tests_failed += 1
 
     print(Fore.GREEN + f"OK tests: {tests_ok}  ", end="")
@@ -111,6 +92,13 @@ if __name__ == "__main__":
 
     parser.add_argument("-n", "--no-skip", help="do not skip missing FEEs", action="store_true")
     parser.add_argument("-t", "--time", help="sleep time", type=float, default=def_time)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of parallel jobs, 0: one per TDC; libtrbnet calls are serialised",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -127,5 +115,5 @@ if __name__ == "__main__":
         print(args)
 
     tup = communication.decode_address(args.trbids)
-    r = scan_spi_communication(tup, args.time, args.no_skip)
+    r = scan_spi_communication(tup, args.time, args.no_skip, args.jobs)
     sys.exit(r)
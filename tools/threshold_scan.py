@@ -21,13 +21,20 @@
 # SOFTWARE.
 
 import argparse
-from time import sleep
-import json
+import sys
+import math
 
 from pasttrec import hardware, communication, misc
-from pasttrec.misc import parse_rm_scalers, calc_tdc_channel
 
 def_time = 1
+def_settle = 0.1
+def_reuse = False  # reusing the closing snapshot skips def_settle
+
+# statistics driven window: count until def_target counts, but not longer than def_max_time
+def_target = None
+def_max_time = 10.0
+
+def_checkpoint = None
 
 def_pastrec_thresh_range = [0x00, 0x7F]
 
@@ -37,10 +44,9 @@ def scan_threshold(address):
 
     connections = communication.make_asic_connections(address)
 
-    # Store here pairs of bc address and number of channels in an endpoint
-    broadcasts_list = set()
-    for con in connections:
-        broadcasts_list.add((con.trbid, con.fetype.n_scalers))
+    # all boards are counted in a common window, see communication.ScalersScanner
+    boards = {con.trbid: con.fetype for con in connections}
+    scanner = communication.ScalersScanner(boards, def_time, def_settle, def_reuse)
 
     print(" trbid   channel   th 0{:s}{:d}".format(" " * def_threshold_max, def_threshold_max))
     print("                      |{:s}|".format("-" * def_threshold_max))
@@ -50,30 +56,11 @@ def scan_threshold(address):
     for vth in range(def_pastrec_thresh_range[0], def_threshold_max):
         print(".", end="", flush=True)
 
-        for con in connections:
-            con.write_reg(3, vth)
-
-        sleep(0.1)
-        for bc_addr, n_scalers in broadcasts_list:
-            v1 = communication.read_rm_scalers(bc_addr, n_scalers)
-            sleep(def_time)
-            v2 = communication.read_rm_scalers(bc_addr, n_scalers)
-            a1 = parse_rm_scalers(n_scalers, v1)
-            a2 = parse_rm_scalers(n_scalers, v2)
-            bb = a2.diff(a1)
-
+        with communication.batch():
             for con in connections:
-                hex_addr = misc.trbaddr(con.trbid)
-
-                for c in list(range(con.fetype.n_channels)):
-                    chan = misc.calc_tdc_channel(con.fetype, con.cable, con.asic, c)
+                con.write_reg(3, vth)
 
-                    vv = bb.scalers[con.trbid][chan]
-                    if vv < 0:
-                        vv += 0x80000000
-
-                    ttt.add_trb(hex_addr, con.fetype)
-                    ttt.thresholds[hex_addr][con.cable][con.asic][c][vth] = vv
+        communication.count_scan_point(scanner, connections, ttt, vth, None, def_checkpoint, def_target, def_max_time)
 
     print("  done")
 
@@ -94,7 +81,30 @@ if __name__ == "__main__":
     )
 
     parser.add_argument("-t", "--time", help="sleep time", type=float, default=def_time)
-    parser.add_argument("-o", "--output", help="output file", type=str, default="results_th.json")
+    parser.add_argument(
+        "--reuse",
+        action="store_true",
+        help="reuse the closing scalers snapshot of previous step as the opening one, faster but skips the "
+        "{:.1f} s settle time after the threshold change, so the transients are counted".format(def_settle),
+    )
+    parser.add_argument(
+        "--target-counts",
+        help="count each step (at least --time) until all active channels reach this value, results are normalised "
+        "to --time",
+        type=int,
+    )
+    parser.add_argument(
+        "--target-error",
+        help="as --target-counts, given with relative statistical error",
+        type=float,
+    )
+    parser.add_argument("--max-time", help="maximal counting time with target", type=float, default=def_max_time)
+    parser.add_argument(
+        "-o", "--output", help="output file, .pscan for binary format", type=str, default="results_th.json"
+    )
+    parser.add_argument("--checkpoint", help="checkpoint file, default: output file with .ckpt suffix", type=str)
+    parser.add_argument("--resume", help="resume the scan from the checkpoint", action="store_true")
+    parser.add_argument("--force", help="overwrite existing checkpoint when not resuming", action="store_true")
     parser.add_argument(
         "-v",
         "--verbose",
@@ -181,6 +191,12 @@ if __name__ == "__main__":
 
     communication.g_verbose = args.verbose
     def_time = args.time
+    def_reuse = args.reuse
+    def_max_time = args.max_time
+    if args.target_counts is not None:
+        def_target = args.target_counts
+    elif args.target_error is not None:
+        def_target = math.ceil(1.0 / args.target_error**2)
     def_threshold_max = args.limit
 
     if communication.g_verbose > 0:
@@ -200,14 +216,24 @@ if __name__ == "__main__":
 
     tup = communication.decode_address(args.trbids)
 
+    header = {"scan": "threshold", "config": p.export(), "time": def_time, "target": def_target}
+    try:
+        def_checkpoint = misc.ScanCheckpoint(args.checkpoint or args.output + ".ckpt", header, args.resume, args.force)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
     if args.defaults:
         communication.asics_to_defaults(tup, p)
 
     r = scan_threshold(tup)
-    r.config = p.__dict__
+    r.config = p.export()
 
     if args.defaults:
         communication.asics_to_defaults(tup, p)
 
-    with open(args.output, "w") as fp:
-        json.dump(r.__dict__, fp, indent=2)
+    r.save(args.output)
+
+    # the scan is completed, the checkpoint is not needed anymore
+    if def_checkpoint is not None:
+        def_checkpoint.remove()
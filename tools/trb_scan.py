@@ -59,9 +59,9 @@ def scan_trb_communication(address, def_time=1.0, infinite_loop=False):
                 bar.text("Testing...")
 
                 for t in reg_test_vals:
-                    communication.trbnet_interface.write(addr, reg, t)
+                    communication.get_trbnet_interface().write(addr, reg, t)
                     sleep(def_time)
-                    rc = communication.trbnet_interface.read(addr, reg)
+                    rc = communication.get_trbnet_interface().read(addr, reg)
                     cnt = cnt + 1
 
                     try: